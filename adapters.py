@@ -3,6 +3,9 @@ import threading
 import time
 from typing import Optional, Callable
 
+from events import CAUTION, HAZARD, EventBus, ObstacleCoalescer, vision_bus
+from phrase_cache import PcmPlayer, PhraseCache
+
 try:
     from plyer import tts
 except Exception:
@@ -10,7 +13,20 @@ except Exception:
 
 
 class MobileTTS:
+    def __init__(self, phrases: Optional[PhraseCache] = None):
+        # plyer can't render to a file, so the cache is only read here (filled by VoiceIO on desktop)
+        self.phrases = phrases
+        self.player = PcmPlayer() if phrases is not None else None
+
     def say(self, text: str):
+        if self.phrases is not None and self.player.available:
+            clip = self.phrases.lookup(text)
+            if clip is not None:
+                try:
+                    self.player.play(clip)
+                    return
+                except Exception:
+                    pass
         if tts:
             try:
                 tts.speak(text)
@@ -21,8 +37,13 @@ class MobileTTS:
 
 
 class VisionSimulator:
-    def __init__(self, on_obstacle: Optional[Callable[[str], None]] = None, interval_sec: int = 15):
-        self._on_obstacle = on_obstacle
+    """Raises a simulated obstacle every ``interval_sec`` that clears after ``clear_after_sec``, on the same bus as VisionLoop."""
+
+    def __init__(self, on_obstacle: Optional[Callable[[str], None]] = None, interval_sec: int = 15, bus: Optional[EventBus] = None, clear_after_sec: float = 5.0):
+        self.bus = bus or vision_bus()
+        self.coalescer = ObstacleCoalescer(self.bus, clear_after_sec)
+        if on_obstacle is not None:
+            self.bus.subscribe(HAZARD, lambda e: on_obstacle(e.message), name="on_obstacle", threaded=False)
         self._interval = interval_sec
         self._stop = threading.Event()
         self._thread: Optional[threading.Thread] = None
@@ -45,9 +66,7 @@ class VisionSimulator:
             now = time.time()
             if now - last >= self._interval:
                 last = now
-                if self._on_obstacle:
-                    try:
-                        self._on_obstacle("Obstacle ahead. Please wait.")
-                    except Exception:
-                        pass
+                self.coalescer.hazard("Obstacle ahead. Please wait.", CAUTION, now)
+            else:
+                self.coalescer.tick(now)
             time.sleep(0.25)
@@ -1,9 +1,17 @@
 from __future__ import annotations
+from typing import Dict, List, Optional
 from kivy.app import App
+from kivy.clock import Clock
 from kivy.lang import Builder
 from kivy.properties import StringProperty
 from kivy.uix.screenmanager import ScreenManager, Screen
 from .adapters import MobileTTS, VisionSimulator
+from .events import OBSTACLE, ObstacleChanged
+from .config import DEMO_MODE, GOOGLE_MAPS_API_KEY, ORS_API_KEY, PHRASE_CACHE_DIR, ROUTE_DEADLINE_SEC
+from .location import from_config as location_from_config
+from .phrase_cache import PhraseCache
+from .routing import Router, RouteOption, describe_route
+from .ui_tasks import UIWorkerPool
 
 KV = """
 ScreenManager:
@@ -20,6 +28,10 @@ ScreenManager:
         Label:
             text: "Blind Navigation Assistant"
             font_size: 24
+        Label:
+            text: root.status
+            size_hint_y: None
+            height: "32dp"
         TextInput:
             id: dest
             hint_text: "Enter destination"
@@ -59,6 +71,11 @@ ScreenManager:
             Button:
                 text: "Transit"
                 on_release: app.start_guidance("transit")
+        Button:
+            text: "Back"
+            size_hint_y: None
+            height: "48dp"
+            on_release: app.go_back()
 
 <GuidanceScreen>:
     name: "guide"
@@ -76,7 +93,7 @@ ScreenManager:
 """
 
 class MenuScreen(Screen):
-    pass
+    status = StringProperty("")
 
 class RoutesScreen(Screen):
     routes_text = StringProperty("Routes will appear here")
@@ -84,48 +101,115 @@ class RoutesScreen(Screen):
 class GuidanceScreen(Screen):
     status = StringProperty("Waiting to start…")
 
+def _on_ui_thread(callback):
+    Clock.schedule_once(lambda dt: callback())
+
+
 class BlindNavKivyApp(App):
+    """Routing, speech and vision callbacks run on worker threads; only their results touch widgets."""
+
+    def __init__(self, router=None, tts=None, inline: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self._router = router
+        self._tts = tts
+        self._inline = inline
+
     def build(self):
-        self.tts = MobileTTS()
+        self.tasks = UIWorkerPool(_on_ui_thread, inline=self._inline)
+        self.tts = self._tts or MobileTTS(PhraseCache(None, PHRASE_CACHE_DIR) if PHRASE_CACHE_DIR else None)
+        self.router = self._router or Router(demo_mode=DEMO_MODE, google_key=GOOGLE_MAPS_API_KEY, ors_key=ORS_API_KEY, deadline_sec=ROUTE_DEADLINE_SEC)
+        self.location = location_from_config().start() if self._router is None else None
+        self.options: Dict[str, RouteOption] = {}
         self.vision_enabled = False
-        self.vision = VisionSimulator(on_obstacle=self._on_obstacle, interval_sec=15)
+        self.vision = VisionSimulator(interval_sec=15)
+        self.vision.bus.subscribe(OBSTACLE, lambda e: self.tasks.call_soon(self._on_obstacle, e), name="ui", threaded=False)
         self.sm = Builder.load_string(KV)
+        self.sm.bind(current=self._on_screen_change)
+        self._screen = self.sm.current
         return self.sm
 
+    def say(self, text: str):
+        """Speak without blocking; speech queued from a screen is dropped when the user leaves it."""
+        self.tasks.speak(self.tts.say, text, group=self.sm.current)
+
+    def _on_screen_change(self, sm, current: str):
+        previous, self._screen = self._screen, current
+        self.tasks.cancel(previous)
+
     def toggle_vision(self):
         self.vision_enabled = not self.vision_enabled
-        self.tts.say("Vision enabled" if self.vision_enabled else "Vision disabled")
+        self.say("Vision enabled" if self.vision_enabled else "Vision disabled")
         if self.vision_enabled:
             self.vision.start()
         else:
-            self.vision.stop()
+            self.tasks.submit(self.vision.stop)
 
     def on_find_routes(self, destination: str):
         dest = destination.strip() or "nearest coffee shop"
-        # Demo route list; in Phase 2 wire to routing.Router
-        text = f"Options to {dest}:\n1) Walking - ~15 min\n2) Driving - ~8 min\n3) Transit - ~18 min"
-        self.tts.say(f"Found routes to {dest}. Walking, Driving, and Transit.")
+        # A new search replaces one still in flight
+        self.tasks.cancel("menu")
+        self.sm.get_screen("menu").status = f"Finding routes to {dest}…"
+        self.say(f"Finding routes to {dest}.")
+        self.tasks.submit(self.router.get_routes, self._origin(), dest, on_done=lambda options: self._show_routes(dest, options), on_error=lambda exc: self._routes_failed(dest), group="menu")
+
+    def _origin(self) -> str:
+        fix = self.location.current() if self.location is not None else None
+        if fix is None:
+            return "current location"
+        if DEMO_MODE:
+            return fix.display or "current location"
+        return f"{fix.lat},{fix.lon}"
+
+    def _show_routes(self, dest: str, options: List[RouteOption]):
+        if not options:
+            self._routes_failed(dest)
+            return
+        self.options = {opt.mode: opt for opt in options}
+        lines = [f"Options to {dest}:"] + [f"{idx}) {describe_route(opt)}" for idx, opt in enumerate(options, start=1)]
+        self.sm.get_screen("menu").status = ""
         routes_screen: RoutesScreen = self.sm.get_screen("routes")
-        routes_screen.routes_text = text
+        routes_screen.routes_text = "\n".join(lines)
         self.sm.current = "routes"
+        self.say(f"Found routes to {dest}. " + ", ".join(opt.mode.title() for opt in options) + ".")
+
+    def _routes_failed(self, dest: str):
+        self.sm.get_screen("menu").status = f"No routes found to {dest}."
+        self.say(f"I'm sorry, I couldn't find routes to {dest}.")
 
     def start_guidance(self, mode: str):
-        g: GuidanceScreen = self.sm.get_screen("guide")
-        g.status = f"{mode.title()} guidance started. Say start when ready."
-        self.tts.say(f"Starting {mode} guidance. Say start when you are ready to begin.")
+        option: Optional[RouteOption] = self.options.get(mode)
         self.sm.current = "guide"
+        g: GuidanceScreen = self.sm.get_screen("guide")
+        if option is None:
+            g.status = f"No {mode} route for this destination."
+            self.say(f"There is no {mode} route for this destination.")
+            return
+        g.status = f"{mode.title()} guidance started. {option.duration_min} min. Say start when ready."
+        self.say(f"Starting {mode} guidance. Say start when you are ready to begin.")
 
-    def _on_obstacle(self, msg: str):
+    def _on_obstacle(self, event: ObstacleChanged):
         if not self.vision_enabled:
             return
         g: GuidanceScreen = self.sm.get_screen("guide")
+        if not event.active:
+            g.status = "Path clear."
+            return
         g.status = "Obstacle ahead. Waiting for 2 minutes…"
-        self.tts.say("Obstacle ahead. Please wait two minutes.")
-        # In this demo we don't actually block the UI thread. A real implementation would manage timers.
+        # Not tied to a screen, so navigating never drops a safety alert
+        self.tasks.speak(self.tts.say, "Obstacle ahead. Please wait two minutes.", group="alerts")
 
     def stop_guidance(self):
-        self.tts.say("Guidance stopped.")
         self.sm.current = "menu"
+        self.say("Guidance stopped.")
+
+    def go_back(self):
+        self.sm.current = "menu"
+
+    def on_stop(self):
+        self.tasks.shutdown()
+        if self.location is not None:
+            self.location.stop()
+        self.vision.stop()
 
 if __name__ == "__main__":
     BlindNavKivyApp().run()
@@ -14,3 +14,22 @@ ORS_API_KEY = os.getenv("ORS_API_KEY", "").strip()
 DEFAULT_CITY = os.getenv("DEFAULT_CITY", "").strip()
 DEFAULT_LAT = os.getenv("DEFAULT_LAT", "").strip()
 DEFAULT_LON = os.getenv("DEFAULT_LON", "").strip()
+GPS_SOURCE = os.getenv("GPS_SOURCE", "").strip()  # serial port (e.g. COM3, /dev/ttyUSB0) or a .nmea/.gpx track
+LOCATION_CACHE_PATH = os.getenv("LOCATION_CACHE_PATH", os.path.join(".cache", "location.json")).strip()  # empty disables
+LOCATION_TTL_SEC = float(os.getenv("LOCATION_TTL_SEC", "21600"))
+
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", os.path.join(".cache", "routes.sqlite")).strip()
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "256"))
+ROUTE_DEADLINE_SEC = float(os.getenv("ROUTE_DEADLINE_SEC", "8"))
+OFFLINE_GRAPH_PATH = os.getenv("OFFLINE_GRAPH_PATH", "").strip()  # compiled graph dir or .osm extract
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", "").strip()  # CSV: name, lat, lon[, category, address]
+
+PHRASE_CACHE_DIR = os.getenv("PHRASE_CACHE_DIR", os.path.join(".cache", "phrases")).strip()  # empty disables
+PHRASE_CACHE_MB = int(os.getenv("PHRASE_CACHE_MB", "64"))
+
+VISION_BACKEND = os.getenv("VISION_BACKEND", "ultralytics").strip().lower()  # 'ultralytics' or 'onnx'
+VISION_MODEL_PATH = os.getenv("VISION_MODEL_PATH", "yolov8n.pt").strip()
+VISION_INPUT_SIZE = int(os.getenv("VISION_INPUT_SIZE", "640"))
+VISION_ROI = os.getenv("VISION_ROI", "").strip()  # 'x1,y1,x2,y2' frame fractions, or 'path'
+VISION_THREADS = int(os.getenv("VISION_THREADS", "0"))
+VISION_DETECT_EVERY = int(os.getenv("VISION_DETECT_EVERY", "3"))  # run the detector on every Nth frame
@@ -0,0 +1,346 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, ClassVar, Deque, Dict, List, Optional, Tuple
+
+from tracing import count
+
+HAZARD = "vision.hazard"  # every alert the detector raises
+OBSTACLE = "vision.obstacle"  # coalesced obstacle set/clear transitions
+
+# Severity of a hazard / an active obstacle
+CAUTION = 1
+DANGER = 2
+
+# What a full subscriber queue does with a new event
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+
+
+@dataclass
+class HazardSeen:
+    message: str
+    severity: int = CAUTION
+    at: float = 0.0  # on the publisher's clock
+    topic: ClassVar[str] = HAZARD
+
+    @property
+    def key(self) -> str:
+        return self.message
+
+
+@dataclass
+class ObstacleChanged:
+    active: bool
+    severity: int = 0
+    message: str = ""
+    at: float = 0.0
+    topic: ClassVar[str] = OBSTACLE
+
+    @property
+    def key(self) -> str:
+        return f"{self.active}:{self.severity}"
+
+
+class RateLimit:
+    """Token bucket for one topic, plus suppression of repeats of the same event key."""
+
+    def __init__(self, per_sec: float, burst: int = 1, dedupe_sec: float = 0.0):
+        self.per_sec = per_sec
+        self.burst = max(1, burst)
+        self.dedupe_sec = dedupe_sec
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._last_key: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def allow(self, key: str, now: Optional[float] = None) -> Optional[str]:
+        """None if the event may pass, otherwise why not ("duplicate" or "rate")."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self.dedupe_sec > 0:
+                last = self._last_key.get(key)
+                if last is not None and now - last < self.dedupe_sec:
+                    return "duplicate"
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.per_sec)
+            self._updated = now
+            if self._tokens < 1.0:
+                return "rate"
+            self._tokens -= 1.0
+            if self.dedupe_sec > 0:
+                self._last_key[key] = now
+                if len(self._last_key) > 256:
+                    self._last_key = {k: t for k, t in self._last_key.items() if now - t < self.dedupe_sec}
+            return None
+
+
+class Subscription:
+    """One subscriber's bounded queue, drained by its own thread so a slow subscriber only delays itself.
+
+    With ``threaded=False`` the handler runs on the publisher's thread
+    instead, for cheap handlers that must see events synchronously.
+    """
+
+    def __init__(self, bus: "EventBus", topic: str, handler: Callable, name: str, max_queue: int, policy: str, block_timeout_sec: float, threaded: bool):
+        self.bus = bus
+        self.topic = topic
+        self.handler = handler
+        self.name = name or getattr(handler, "__name__", "subscriber")
+        self.max_queue = max(1, max_queue)
+        self.policy = policy
+        self.block_timeout_sec = block_timeout_sec
+        self.threaded = threaded
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        # Seconds from publish to the handler being called
+        self.latencies: Deque[float] = deque(maxlen=4096)
+        self._queue: Deque[Tuple[object, float]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def offer(self, event, published_at: float) -> bool:
+        if not self.threaded:
+            self._call(event, published_at)
+            return True
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self._queue) >= self.max_queue:
+                if self.policy == BLOCK:
+                    self._cond.wait_for(lambda: len(self._queue) < self.max_queue or self._closed, timeout=self.block_timeout_sec)
+                if len(self._queue) >= self.max_queue:
+                    self.dropped += 1
+                    count("events_dropped", topic=self.topic, subscriber=self.name)
+                    if self.policy != DROP_OLDEST:
+                        return False
+                    self._queue.popleft()
+            self._queue.append((event, published_at))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f"events-{self.name}", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return True
+
+    def close(self):
+        self.bus.unsubscribe(self)
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "topic": self.topic,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "queued": len(self._queue),
+            "latency_p50_ms": _percentile_ms(self.latencies, 0.5),
+            "latency_p99_ms": _percentile_ms(self.latencies, 0.99),
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if self._closed:
+                    return
+                event, published_at = self._queue.popleft()
+                self._cond.notify_all()
+            self._call(event, published_at)
+
+    def _call(self, event, published_at: float):
+        self.latencies.append(time.perf_counter() - published_at)
+        try:
+            self.handler(event)
+            self.delivered += 1
+        except Exception:
+            self.errors += 1
+
+
+class EventBus:
+    """Typed in-process publish/subscribe between vision, guidance, speech and UI.
+
+    Events are dataclasses carrying their ``topic``. Each topic can have a
+    ``RateLimit`` applied at publish time, and each subscriber has its own
+    bounded queue whose overflow policy is its backpressure: drop the
+    oldest event (state-like topics, where only the newest matters), drop
+    the new one, or block the publisher briefly.
+    """
+
+    def __init__(self):
+        self._subscribers: Dict[str, Tuple[Subscription, ...]] = {}
+        self._limits: Dict[str, RateLimit] = {}
+        self._lock = threading.Lock()
+        self.published: Dict[str, int] = {}
+        self.limited: Dict[str, int] = {}
+
+    def subscribe(self, topic: str, handler: Callable, name: str = "", max_queue: int = 64, policy: str = DROP_OLDEST, block_timeout_sec: float = 0.05, threaded: bool = True) -> Subscription:
+        sub = Subscription(self, topic, handler, name, max_queue, policy, block_timeout_sec, threaded)
+        with self._lock:
+            # Copy on write so publish never takes this lock
+            self._subscribers[topic] = self._subscribers.get(topic, ()) + (sub,)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            self._subscribers[sub.topic] = tuple(s for s in self._subscribers.get(sub.topic, ()) if s is not sub)
+
+    def limit(self, topic: str, per_sec: float, burst: int = 1, dedupe_sec: float = 0.0):
+        self._limits[topic] = RateLimit(per_sec, burst, dedupe_sec)
+
+    def publish(self, event) -> int:
+        """Fan ``event`` out to its topic's subscribers; returns how many accepted it."""
+        topic = event.topic
+        limit = self._limits.get(topic)
+        if limit is not None:
+            reason = limit.allow(event.key)
+            if reason is not None:
+                self.limited[topic] = self.limited.get(topic, 0) + 1
+                count("events_limited", topic=topic, reason=reason)
+                return 0
+        self.published[topic] = self.published.get(topic, 0) + 1
+        published_at = time.perf_counter()
+        accepted = 0
+        for sub in self._subscribers.get(topic, ()):
+            accepted += sub.offer(event, published_at)
+        return accepted
+
+    def close(self):
+        with self._lock:
+            subs = [s for group in self._subscribers.values() for s in group]
+        for sub in subs:
+            sub.close()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            subs = [s for group in self._subscribers.values() for s in group]
+        return {
+            "published": dict(self.published),
+            "limited": dict(self.limited),
+            "subscribers": {s.name: s.stats() for s in subs},
+        }
+
+
+def vision_bus() -> EventBus:
+    """A bus with the limits used for the live camera: a busy street raises the same alert
+    over and over, so repeats within two seconds are dropped and at most two alerts
+    per second get through. Obstacle transitions are never limited."""
+    bus = EventBus()
+    bus.limit(HAZARD, per_sec=2.0, burst=2, dedupe_sec=2.0)
+    return bus
+
+
+class ObstacleCoalescer:
+    """Turns a burst of hazard sightings into obstacle set/clear transitions.
+
+    The first hazard sets the obstacle, a more severe one re-announces it,
+    and it clears once nothing has been seen for ``clear_after_sec``. Times
+    are on the caller's clock, so replays can run on video time.
+    """
+
+    def __init__(self, bus: EventBus, clear_after_sec: float = 2.0):
+        self.bus = bus
+        self.clear_after_sec = clear_after_sec
+        self.active = False
+        self.severity = 0
+        self._seen_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def hazard(self, message: str, severity: int, at: float):
+        self.bus.publish(HazardSeen(message, severity, at))
+        with self._lock:
+            self._seen_at = max(self._seen_at, at)
+            if self.active and severity <= self.severity:
+                return
+            self.active = True
+            self.severity = severity
+        self.bus.publish(ObstacleChanged(True, severity, message, at))
+
+    def keep_alive(self, at: float):
+        """A hazard is still in view, though not worth a new alert."""
+        with self._lock:
+            self._seen_at = max(self._seen_at, at)
+
+    def tick(self, at: float):
+        with self._lock:
+            if not self.active or at - self._seen_at < self.clear_after_sec:
+                return
+            self.active = False
+            self.severity = 0
+        self.bus.publish(ObstacleChanged(False, 0, "", at))
+
+
+def bench(events: int = 100000, subscribers: int = 3, slow_ms: float = 0.0, max_queue: int = 1024) -> Dict[str, object]:
+    """Publish ``events`` hazards from one thread to N threaded subscribers and report throughput and fan-out latency.
+
+    The last subscriber sleeps ``slow_ms`` per event to show that a slow
+    subscriber drops its own events without holding up the others.
+    """
+    bus = EventBus()
+    done = threading.Event()
+    lock = threading.Lock()
+    remaining = [subscribers]
+
+    def make(i: int):
+        def handler(event):
+            if slow_ms and i == subscribers - 1:
+                time.sleep(slow_ms / 1000.0)
+            if event.message == "last":
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+        return handler
+
+    subs = [bus.subscribe(HAZARD, make(i), name=f"sub{i}", max_queue=max_queue, policy=DROP_NEWEST if i == subscribers - 1 and slow_ms else BLOCK, block_timeout_sec=1.0) for i in range(subscribers)]
+    event = HazardSeen("car ahead", DANGER)
+    start = time.perf_counter()
+    for _ in range(events - 1):
+        bus.publish(event)
+    publish_sec = time.perf_counter() - start
+    if slow_ms:
+        # The slow subscriber may have dropped "last"; don't wait for it
+        remaining[0] -= 1
+    bus.publish(HazardSeen("last", DANGER))
+    done.wait(timeout=60)
+    total_sec = time.perf_counter() - start
+    report = {
+        "events": events,
+        "subscribers": subscribers,
+        "publish_per_sec": round((events - 1) / publish_sec) if publish_sec else 0,
+        "delivered_per_sec": round(sum(s.delivered for s in subs) / total_sec) if total_sec else 0,
+        "subscriber_stats": {s.name: s.stats() for s in subs},
+    }
+    bus.close()
+    return report
+
+
+def _percentile_ms(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0, 3)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Event bus throughput and fan-out latency")
+    parser.add_argument("--events", type=int, default=100000)
+    parser.add_argument("--subscribers", type=int, default=3)
+    parser.add_argument("--slow-ms", type=float, default=0.0, help="make the last subscriber this slow per event")
+    parser.add_argument("--max-queue", type=int, default=1024)
+    args = parser.parse_args(argv)
+    sys.stdout.write(json.dumps(bench(args.events, args.subscribers, args.slow_ms, args.max_queue), indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
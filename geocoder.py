@@ -0,0 +1,260 @@
+from __future__ import annotations
+import csv
+import heapq
+import math
+import re
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+from utils import haversine_m
+
+# Words STT adds around a place name that carry no identity
+FILLER = {"the", "a", "an", "to", "me", "take", "please", "go", "want", "i", "find", "nearby", "near", "closest", "nearest"}
+NEAREST = {"nearest", "closest", "nearby", "near"}
+
+MAX_PREFIX_RESULTS = 500
+
+
+@dataclass
+class Place:
+    name: str
+    lat: float
+    lon: float
+    category: str = ""
+    address: str = ""
+
+
+@dataclass
+class GeocodeCandidate:
+    name: str
+    lat: float
+    lon: float
+    score: float
+    category: str = ""
+    address: str = ""
+    distance_m: Optional[float] = None
+
+    @property
+    def latlon(self) -> str:
+        return f"{self.lat:.6f},{self.lon:.6f}"
+
+
+def normalize(text: str) -> str:
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+_SOUNDEX = {c: d for letters, d in (("bfpv", "1"), ("cgjkqsxz", "2"), ("dt", "3"), ("l", "4"), ("mn", "5"), ("r", "6")) for c in letters}
+
+
+def soundex(word: str) -> str:
+    # Soundex, except the first letter is coded too so "kofee" and "coffee" agree
+    word = re.sub(r"[^a-z]", "", word.lower())
+    if not word:
+        return word
+    out = ""
+    prev = ""
+    for c in word:
+        d = _SOUNDEX.get(c, "")
+        if d and d != prev:
+            out += d
+        if c not in "hw":
+            prev = d
+    if word[0] in "aeiouy":
+        out = "0" + out
+    return (out + "000")[:4]
+
+
+def trigrams(text: str) -> Set[str]:
+    s = f"  {text.replace(' ', '')} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, _TrieNode] = {}
+        self.ids: List[int] = []
+
+
+class Geocoder:
+    """Resolves spoken place names against a local gazetteer.
+
+    Names and categories are indexed three ways: a prefix trie (so a partial
+    "blue bot" finds "Blue Bottle Coffee"), Soundex codes per word (so "kofee"
+    finds "coffee") and character trigrams (so "star bucks" finds "Starbucks").
+    A lat/lon grid ranks matches by distance from the user.
+    """
+
+    def __init__(self, places: Iterable[Place], cell_deg: float = 0.01):
+        self.places: List[Place] = list(places)
+        self.cell_deg = cell_deg
+        self._trie = _TrieNode()
+        phonetic: Dict[str, Set[int]] = defaultdict(set)
+        tri_postings: Dict[str, Set[int]] = defaultdict(set)
+        self._grid: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._keys: List[str] = []
+        tri_sizes: List[int] = []
+        for idx, place in enumerate(self.places):
+            key = normalize(place.name)
+            tokens = key.split() + normalize(place.category).split()
+            self._keys.append(key)
+            # Insert from every word start so mid-name words are prefix-searchable
+            words = key.split()
+            for i in range(len(words)):
+                self._insert(" ".join(words[i:]), idx)
+            if place.category:
+                self._insert(normalize(place.category), idx)
+            for tok in tokens:
+                phonetic[soundex(tok)].add(idx)
+            tris = trigrams(key)
+            tri_sizes.append(len(tris))
+            for tri in tris:
+                tri_postings[tri].add(idx)
+            self._grid[self._cell(place.lat, place.lon)].append(idx)
+        # Postings become sorted arrays so fuzzy stages count hits with bincount
+        self._phonetic = {k: np.fromiter(sorted(v), dtype=np.int32) for k, v in phonetic.items()}
+        self._trigrams = {k: np.fromiter(sorted(v), dtype=np.int32) for k, v in tri_postings.items()}
+        self._tri_sizes = np.asarray(tri_sizes, dtype=np.float32)
+
+    @classmethod
+    def from_csv(cls, path: str, cell_deg: float = 0.01) -> "Geocoder":
+        """Load a gazetteer CSV with columns name, lat, lon and optional category, address."""
+        places = []
+        with open(path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                try:
+                    places.append(
+                        Place(
+                            name=row["name"].strip(),
+                            lat=float(row["lat"]),
+                            lon=float(row["lon"]),
+                            category=(row.get("category") or "").strip(),
+                            address=(row.get("address") or "").strip(),
+                        )
+                    )
+                except (KeyError, ValueError):
+                    continue
+        return cls(places, cell_deg=cell_deg)
+
+    def search(self, text: str, near: Optional[Tuple[float, float]] = None, limit: int = 5) -> List[GeocodeCandidate]:
+        words = normalize(text).split()
+        want_nearest = any(w in NEAREST for w in words)
+        words = [w for w in words if w not in FILLER] or words
+        if not words:
+            return []
+        query = " ".join(words)
+
+        scores: Dict[int, float] = {}
+
+        def _bump(idx: int, score: float):
+            if score > scores.get(idx, 0.0):
+                scores[idx] = score
+
+        for idx in self._prefix(query):
+            _bump(idx, 1.0 if self._keys[idx] == query else 0.9)
+        # Every spoken word is a prefix of some word in the name or category
+        word_hits: Dict[int, int] = defaultdict(int)
+        for w in words:
+            for idx in set(self._prefix(w)):
+                word_hits[idx] += 1
+        for idx, hits in word_hits.items():
+            _bump(idx, 0.8 * hits / len(words))
+        # Sound-alike and misspelling matches are only worth their cost when
+        # the prefix indexes found nothing convincing
+        if max(scores.values(), default=0.0) < 0.8:
+            hits = self._count_hits([self._phonetic.get(soundex(w)) for w in words])
+            for idx in np.nonzero(hits)[0]:
+                _bump(int(idx), 0.65 * float(hits[idx]) / len(words))
+        if max(scores.values(), default=0.0) < 0.7:
+            q_tri = trigrams(query)
+            hits = self._count_hits([self._trigrams.get(t) for t in q_tri])
+            sim = hits / np.maximum(self._tri_sizes, len(q_tri))
+            for idx in np.nonzero(sim >= 0.4)[0]:
+                _bump(int(idx), 0.75 * float(sim[idx]))
+
+        if not scores:
+            return []
+        # Let weak fuzzy matches through only when nothing scores well
+        best = max(scores.values())
+        pool = {idx: s for idx, s in scores.items() if s >= best * 0.6}
+
+        distances: Dict[int, float] = {}
+        if near is not None:
+            k = max(limit * 4, 20)
+            if len(pool) > k:
+                distances = self._nearest_within(pool, near, k)
+                # Rank only the nearest matches plus the best text matches
+                keep = set(distances) | set(heapq.nlargest(k, pool, key=pool.get))
+                pool = {idx: pool[idx] for idx in keep}
+        geo_weight = 0.6 if want_nearest else 0.25
+        ranked = []
+        for idx, text_score in pool.items():
+            d = distances.get(idx)
+            if near is not None and d is None:
+                d = haversine_m(near[0], near[1], self.places[idx].lat, self.places[idx].lon)
+            proximity = 1.0 / (1.0 + d / 1000.0) if d is not None else 0.0
+            score = text_score * (1.0 - geo_weight) + proximity * geo_weight if near is not None else text_score
+            ranked.append((score, idx, d))
+        ranked.sort(key=lambda x: -x[0])
+        out = []
+        for score, idx, d in ranked[:limit]:
+            p = self.places[idx]
+            out.append(GeocodeCandidate(p.name, p.lat, p.lon, round(score, 3), p.category, p.address, d))
+        return out
+
+    def _count_hits(self, postings: List[Optional[np.ndarray]]) -> np.ndarray:
+        arrays = [p for p in postings if p is not None]
+        if not arrays:
+            return np.zeros(len(self.places), dtype=np.int32)
+        return np.bincount(np.concatenate(arrays), minlength=len(self.places))
+
+    def _insert(self, key: str, idx: int):
+        node = self._trie
+        for ch in key:
+            node = node.children.setdefault(ch, _TrieNode())
+        node.ids.append(idx)
+
+    def _prefix(self, prefix: str) -> List[int]:
+        node = self._trie
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        out: List[int] = []
+        stack = [node]
+        while stack and len(out) < MAX_PREFIX_RESULTS:
+            n = stack.pop()
+            out.extend(n.ids)
+            stack.extend(n.children.values())
+        return out
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _nearest_within(self, pool: Dict[int, float], near: Tuple[float, float], k: int) -> Dict[int, float]:
+        """Distances for the ``k`` pool members closest to ``near``, found by ring search over the grid."""
+        lat, lon = near
+        ci, cj = self._cell(lat, lon)
+        cell_m = self.cell_deg * 111320.0 * max(0.1, math.cos(math.radians(lat)))
+        found: List[Tuple[float, int]] = []
+        max_rings = 50
+        for ring in range(max_rings + 1):
+            for di in range(-ring, ring + 1):
+                for dj in range(-ring, ring + 1):
+                    if max(abs(di), abs(dj)) != ring:
+                        continue
+                    for idx in self._grid.get((ci + di, cj + dj), ()):
+                        if idx in pool:
+                            p = self.places[idx]
+                            heapq.heappush(found, (-haversine_m(lat, lon, p.lat, p.lon), idx))
+                            if len(found) > k:
+                                heapq.heappop(found)
+            # Anything in later rings is at least ring * cell_m away
+            if len(found) >= k and -found[0][0] <= ring * cell_m:
+                break
+        return {idx: -neg for neg, idx in found}
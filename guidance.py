@@ -0,0 +1,406 @@
+from __future__ import annotations
+import asyncio
+import math
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Iterable, List, Optional
+
+from intents import START, ask_intent
+from positions import Fix
+from route_tracker import LocalProjection, ManeuverIndex, RouteGuard, Rerouter, TrackState
+from routing import RouteOption
+from tracing import count, span
+from tts_queue import ROUTINE
+from utils import describe_distance, minutes_to_eta_str, now_plus_minutes
+
+# Event kinds
+OBSTACLE_SET = "obstacle_set"
+OBSTACLE_CLEAR = "obstacle_clear"
+POSITION = "position"
+FEED_END = "feed_end"
+HEARD = "heard"  # an STT answer, already mapped to an intent (or None)
+TICK = "tick"
+REROUTED = "rerouted"  # a reroute finished; payload is the new RouteOption or None
+STOP = "stop"
+
+
+@dataclass
+class GuidanceEvent:
+    kind: str
+    payload: Any = None
+
+
+class StepAnnouncer:
+    """Announces each step as the user nears the point where it begins.
+
+    Maneuver points sit in a ``ManeuverIndex``; the announce distance is
+    ``lead_sec`` seconds of travel at the user's current speed, kept within
+    [min_m, max_m], so a walker hears a turn a few meters out and a driver
+    well before the junction. Each fix costs O(1).
+    """
+
+    def __init__(self, option: RouteOption, proj: LocalProjection, lead_sec: float = 12.0, min_m: float = 15.0, max_m: float = 150.0, default_speed_mps: float = 1.4):
+        self.lead_sec = lead_sec
+        self.min_m = min_m
+        self.max_m = max_m
+        self.speed_mps = default_speed_mps
+        self._last: Optional[tuple] = None
+        self.reset(option, proj)
+
+    def reset(self, option: RouteOption, proj: LocalProjection):
+        self.proj = proj
+        self.steps = list(option.steps)
+        self.index = ManeuverIndex([proj.to_xy(lat, lon) for lat, lon in option.maneuvers], cell_m=self.max_m)
+        # The first step is spoken when guidance (or a new route) starts
+        self.next_step = 1
+        self._last = None
+
+    @property
+    def threshold_m(self) -> float:
+        return max(self.min_m, min(self.max_m, self.speed_mps * self.lead_sec))
+
+    def update(self, fix: Fix) -> Optional[str]:
+        x, y = self.proj.to_xy(fix.lat, fix.lon)
+        speed = fix.speed_mps
+        if speed is None and self._last is not None:
+            lx, ly, lt = self._last
+            dt = fix.timestamp - lt
+            if dt > 0:
+                speed = math.hypot(x - lx, y - ly) / dt
+        if speed is not None:
+            self.speed_mps += 0.3 * (speed - self.speed_mps)
+        self._last = (x, y, fix.timestamp)
+        if self.next_step >= len(self.steps):
+            return None
+        pending = [(i, d) for d, i in self.index.near(x, y, self.threshold_m) if i >= self.next_step]
+        if not pending:
+            return None
+        # The earliest pending step in range; later ones are skipped if the user cut a corner
+        i, d = min(pending)
+        self.next_step = i + 1
+        step = self.steps[i]
+        if d < 8.0:
+            return step
+        return f"In {describe_distance(d)}, {step[:1].lower()}{step[1:]}"
+
+
+class GuidanceSession:
+    """One user's guidance, driven entirely by events on an asyncio loop.
+
+    Obstacle set/clear, position fixes, STT answers and ETA ticks all arrive
+    through ``post`` (safe from any thread) and wake the session at once.
+    An obstacle pauses ETA updates until vision reports the path clear, or
+    ``max_pause_sec`` passes without word. Blocking work (listening for an
+    answer, reading the position feed) runs on its own daemon thread, short
+    calls (a reroute) in the loop's executor, and both report back as events.
+
+    With a position feed and route geometry, steps are announced as their
+    maneuver points come up and the ETA follows actual progress; arrival is
+    declared within ``arrive_m`` of the end. Otherwise (and once the feed
+    runs out) the ETA simply counts down one minute per tick.
+    """
+
+    def __init__(
+        self,
+        voice,
+        selection: RouteOption,
+        auto_start: bool = False,
+        fixes: Optional[Iterable[Fix]] = None,
+        router=None,
+        tick_sec: float = 60.0,
+        step_gap_sec: float = 1.0,
+        max_pause_sec: float = 120.0,
+        arrive_m: float = 20.0,
+    ):
+        self.voice = voice
+        self.selection = selection
+        self.auto_start = auto_start
+        self.fixes = fixes
+        self.tick_sec = tick_sec
+        self.step_gap_sec = step_gap_sec
+        self.max_pause_sec = max_pause_sec
+        self.arrive_m = arrive_m
+        self.remaining = selection.duration_min
+        self.started = auto_start
+        self.arrived = False
+        self.paused = False
+        self.pauses = 0
+        self.guard: Optional[RouteGuard] = None
+        self.steps: Optional[StepAnnouncer] = None
+        if fixes is not None and len(selection.geometry) >= 2:
+            self.guard = RouteGuard(selection, Rerouter(router.route_between) if router is not None else None, on_instruction=voice.alert)
+            if selection.maneuvers and len(selection.maneuvers) == len(selection.steps):
+                self.steps = StepAnnouncer(selection, self.guard.tracker.proj)
+        self.position_mode = self.guard is not None
+        # Progress rate along the route, seeded with the route's own average speed
+        total_m = self.guard.tracker.total_m if self.guard is not None else 0.0
+        self.pace_mps = total_m / (selection.duration_min * 60.0) if selection.duration_min > 0 and total_m > 0 else 1.4
+        self._last_progress: Optional[tuple] = None
+        self._rerouting = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._events: Optional[asyncio.Queue] = None
+        self._early: List[GuidanceEvent] = []
+        self._lock = threading.Lock()
+        self._tick_timer: Optional[asyncio.TimerHandle] = None
+        self._pause_timer: Optional[asyncio.TimerHandle] = None
+        self._stopping = threading.Event()
+
+    # Thread-safe inputs
+
+    def post(self, kind: str, payload: Any = None):
+        event = GuidanceEvent(kind, payload)
+        with self._lock:
+            if self._loop is None:
+                self._early.append(event)
+                return
+            loop = self._loop
+        try:
+            loop.call_soon_threadsafe(self._events.put_nowait, event)
+        except RuntimeError:
+            pass  # loop already closed; the session is over
+
+    def obstacle_set(self, message: Optional[str] = None):
+        self.post(OBSTACLE_SET, message)
+
+    def obstacle_clear(self):
+        self.post(OBSTACLE_CLEAR)
+
+    def position(self, fix: Fix):
+        self.post(POSITION, fix)
+
+    def stop(self):
+        self._stopping.set()
+        self.post(STOP)
+
+    # Session
+
+    async def run(self) -> bool:
+        """Guide to the destination; returns True on arrival, False if stopped."""
+        loop = asyncio.get_running_loop()
+        self._events = asyncio.Queue()
+        with self._lock:
+            self._loop = loop
+            for event in self._early:
+                self._events.put_nowait(event)
+            self._early.clear()
+        with span("guidance.session"):
+            return await self._run(loop)
+
+    async def _run(self, loop: asyncio.AbstractEventLoop) -> bool:
+        selection = self.selection
+        await self._say(f"Starting {selection.mode} guidance. Estimated time {minutes_to_eta_str(selection.duration_min)}. Arrival around {now_plus_minutes(selection.duration_min)}.")
+        # Steps are read out as they come up when we know where the user is
+        for step in (selection.steps[:1] if self.steps is not None else selection.steps):
+            await self._say(step)
+            await asyncio.sleep(self.step_gap_sec)
+        if self.started:
+            self._begin(loop)
+        else:
+            self._listen_for_start(loop)
+        try:
+            while not self.arrived:
+                event = await self._events.get()
+                if event.kind == STOP:
+                    return False
+                await self._handle(event, loop)
+        finally:
+            self._cancel_timers()
+            self._stopping.set()
+        self.voice.cancel("eta")
+        await self._say("You have arrived at your destination.")
+        return True
+
+    def _begin(self, loop: asyncio.AbstractEventLoop):
+        self.started = True
+        if self.guard is not None:
+            _daemon(self._pump_fixes, "guidance-feed")
+        if not self.paused:
+            self.post(TICK)
+
+    async def _handle(self, event: GuidanceEvent, loop: asyncio.AbstractEventLoop):
+        count("guidance_events", kind=event.kind)
+        if event.kind == HEARD:
+            if self.started:
+                return
+            if event.payload is not None and event.payload.name == "start":
+                self._say_nowait("Starting now. Stay safe and follow the instructions.")
+                self._begin(loop)
+            else:
+                await self._say("Okay, I will wait. Let me know when to start.")
+                self._listen_for_start(loop)
+        elif event.kind == OBSTACLE_SET:
+            if self.paused:
+                return
+            self.paused = True
+            self.pauses += 1
+            self._cancel(self._tick_timer)
+            self._say_nowait("Obstacle ahead. Please wait. I will let you know when it's safe to continue.")
+            # Fallback in case vision goes quiet without ever reporting clear
+            self._pause_timer = loop.call_later(self.max_pause_sec, self.post, OBSTACLE_CLEAR)
+        elif event.kind == OBSTACLE_CLEAR:
+            if not self.paused:
+                return
+            self.paused = False
+            self._cancel(self._pause_timer)
+            self._say_nowait("It should be clear now. You can proceed.")
+            if self.started:
+                self._schedule_tick(loop)
+        elif event.kind == POSITION:
+            if self.guard is None:
+                return
+            fix = event.payload
+            state = self.guard.track(fix)
+            # The reroute itself waits on the network; events keep flowing meanwhile
+            if state.deviated and not self._rerouting:
+                self._rerouting = True
+                loop.run_in_executor(None, self._reroute, fix)
+            if self.position_mode:
+                self._on_fix(fix, state)
+        elif event.kind == REROUTED:
+            self._rerouting = False
+            new_option = event.payload
+            if new_option is not None:
+                self.selection = new_option
+                self.remaining = new_option.duration_min
+                self._last_progress = None
+                if self.steps is not None:
+                    self.steps.reset(new_option, self.guard.tracker.proj)
+        elif event.kind == FEED_END:
+            # No more fixes: count down from the latest estimate. The tick chain
+            # may have stopped while progress drove the ETA, so restart it.
+            self.position_mode = False
+            if self.remaining <= 0:
+                self.arrived = True
+            elif self.started and not self.paused:
+                self._schedule_tick(loop)
+        elif event.kind == TICK:
+            if not self.started or self.paused:
+                return
+            if self.remaining <= 0:
+                if self.position_mode:
+                    # Arrival comes from position; keep ticking in case the feed ends short of it
+                    self._schedule_tick(loop)
+                else:
+                    self.arrived = True
+                return
+            # Routine updates never hold up alerts, and a backlog collapses to the latest one
+            if self.remaining == 1:
+                self._say_nowait("One minute remaining.", priority=ROUTINE, key="eta", max_age_sec=30)
+            else:
+                self._say_nowait(f"{self.remaining} minutes remaining.", priority=ROUTINE, key="eta", max_age_sec=30)
+            if not self.position_mode:
+                self.remaining -= 1
+            self._schedule_tick(loop)
+
+    def _on_fix(self, fix: Fix, state: Optional[TrackState]):
+        if self.steps is not None:
+            text = self.steps.update(fix)
+            if text:
+                self._say_nowait(text, key="step")
+        if state is None or not state.on_route:
+            return
+        if self._last_progress is not None:
+            progress, at = self._last_progress
+            dt = fix.timestamp - at
+            if dt > 0:
+                rate = max(0.0, state.progress_m - progress) / dt
+                self.pace_mps += 0.2 * (rate - self.pace_mps)
+        self._last_progress = (state.progress_m, fix.timestamp)
+        self.remaining = int(math.ceil(state.remaining_m / max(self.pace_mps, 0.3) / 60.0))
+        if state.remaining_m <= self.arrive_m:
+            self.arrived = True
+
+    def _listen_for_start(self, loop: asyncio.AbstractEventLoop):
+        def _ask():
+            intent = ask_intent(self.voice, "Say start when you are ready to begin, or say go.", START, reask="Sorry. Say start, or say wait.")
+            self.post(HEARD, intent)
+
+        # Waiting for the user can take minutes; keep it off the shared executor
+        _daemon(_ask, "guidance-start")
+
+    def _reroute(self, fix: Fix):
+        # Runs on an executor thread
+        new_option = None
+        try:
+            new_option = self.guard.reroute(fix)
+        finally:
+            self.post(REROUTED, new_option)
+
+    def _pump_fixes(self):
+        # Runs on its own thread for the whole session; the feed may block between fixes
+        try:
+            for fix in self.fixes:
+                if self._stopping.is_set():
+                    break
+                self.position(fix)
+        finally:
+            self.post(FEED_END)
+
+    def _schedule_tick(self, loop: asyncio.AbstractEventLoop):
+        self._cancel(self._tick_timer)
+        self._tick_timer = loop.call_later(self.tick_sec, self.post, TICK)
+
+    def _cancel_timers(self):
+        self._cancel(self._tick_timer)
+        self._cancel(self._pause_timer)
+
+    @staticmethod
+    def _cancel(timer: Optional[asyncio.TimerHandle]):
+        if timer is not None:
+            timer.cancel()
+
+    def _say_nowait(self, text: str, **kwargs) -> Future:
+        return self.voice.say(text, wait=False, **kwargs)
+
+    async def _say(self, text: str, **kwargs):
+        """Speak and wait for it without holding up the loop."""
+        future = self._say_nowait(text, **kwargs)
+        if isinstance(future, Future):
+            await asyncio.wrap_future(future)
+
+
+class GuidanceScheduler:
+    """Runs any number of guidance sessions on one asyncio loop in a background thread.
+
+    Waiting costs nothing per session. Short blocking calls (rerouting) take
+    a thread from the bounded shared executor while they run; long waits
+    (a position feed, waiting for the user to say start) get a daemon thread
+    of their own so they can never starve the executor.
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="guidance")
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self._executor)
+        self._thread = threading.Thread(target=self.loop.run_forever, name="guidance-loop", daemon=True)
+        self._thread.start()
+
+    def submit(self, session: GuidanceSession) -> Future:
+        return asyncio.run_coroutine_threadsafe(session.run(), self.loop)
+
+    def run(self, session: GuidanceSession) -> bool:
+        return self.submit(session).result()
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=2)
+        self._executor.shutdown(wait=False)
+
+
+def _daemon(target, name: str) -> threading.Thread:
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    return thread
+
+
+_default: Optional[GuidanceScheduler] = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler() -> GuidanceScheduler:
+    global _default
+    with _default_lock:
+        if _default is None:
+            _default = GuidanceScheduler()
+        return _default
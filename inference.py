@@ -0,0 +1,233 @@
+from __future__ import annotations
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+import tracing
+from startup import lazy_import
+
+cv2 = lazy_import("cv2")
+ultralytics = lazy_import("ultralytics")  # optional
+
+# Class order and spelling of the COCO-trained YOLOv8 models (``model.names``)
+COCO_NAMES = (
+    "person", "bicycle", "car", "motorcycle", "airplane", "bus", "train", "truck", "boat", "traffic light",
+    "fire hydrant", "stop sign", "parking meter", "bench", "bird", "cat", "dog", "horse", "sheep", "cow",
+    "elephant", "bear", "zebra", "giraffe", "backpack", "umbrella", "handbag", "tie", "suitcase", "frisbee",
+    "skis", "snowboard", "sports ball", "kite", "baseball bat", "baseball glove", "skateboard", "surfboard",
+    "tennis racket", "bottle", "wine glass", "cup", "fork", "knife", "spoon", "bowl", "banana", "apple",
+    "sandwich", "orange", "broccoli", "carrot", "hot dog", "pizza", "donut", "cake", "chair", "couch",
+    "potted plant", "bed", "dining table", "toilet", "tv", "laptop", "mouse", "remote", "keyboard",
+    "cell phone", "microwave", "oven", "toaster", "sink", "refrigerator", "book", "clock", "vase", "scissors",
+    "teddy bear", "hair drier", "toothbrush",
+)
+
+# Centre-bottom of the frame: where the user is about to walk
+WALKING_PATH_ROI = (0.15, 0.3, 0.85, 1.0)
+
+
+@dataclass
+class Detection:
+    name: str
+    confidence: float
+    box: Tuple[float, float, float, float]  # x1, y1, x2, y2 in full-frame pixels
+
+
+@dataclass
+class BackendConfig:
+    kind: str = "ultralytics"  # or "onnx" (OpenCV DNN)
+    model_path: str = "yolov8n.pt"
+    input_size: int = 640
+    roi: Optional[Tuple[float, float, float, float]] = None  # x1, y1, x2, y2 as frame fractions
+    threads: Optional[int] = None
+    conf: float = 0.35
+
+
+class InferenceBackend:
+    """Object detector over an optional region of interest.
+
+    Subclasses implement the three stages on the cropped image; ``detect``
+    times each stage into ``last_timings`` and maps boxes back into
+    full-frame coordinates.
+    """
+
+    name = "base"
+
+    def __init__(self, config: BackendConfig):
+        self.config = config
+        self.last_timings: Dict[str, float] = {}
+        if config.threads:
+            cv2.setNumThreads(config.threads)
+
+    def detect(self, frame) -> List[Detection]:
+        t0 = time.perf_counter()
+        image, x0, y0 = self._crop(frame)
+        inputs = self._preprocess(image)
+        t1 = time.perf_counter()
+        raw = self._forward(inputs)
+        t2 = time.perf_counter()
+        dets = _shift(self._postprocess(raw, image.shape[:2]), x0, y0)
+        t3 = time.perf_counter()
+        self.last_timings = {"preprocess": t1 - t0, "inference": t2 - t1, "postprocess": t3 - t2}
+        tracing.record("inference.preprocess", t0, t1)
+        tracing.record("inference.forward", t1, t2)
+        tracing.record("inference.postprocess", t2, t3)
+        return dets
+
+    def detect_batch(self, frames) -> List[List[Detection]]:
+        """Detect on several frames in one forward pass where the backend supports it."""
+        t0 = time.perf_counter()
+        crops = [self._crop(f) for f in frames]
+        inputs = [self._preprocess(image) for image, _, _ in crops]
+        t1 = time.perf_counter()
+        raws = self._forward_batch(inputs)
+        t2 = time.perf_counter()
+        out = [_shift(self._postprocess(raw, image.shape[:2]), x0, y0) for raw, (image, x0, y0) in zip(raws, crops)]
+        t3 = time.perf_counter()
+        self.last_timings = {"preprocess": t1 - t0, "inference": t2 - t1, "postprocess": t3 - t2, "batch": len(frames)}
+        tracing.record("inference.preprocess", t0, t1)
+        tracing.record("inference.forward_batch", t1, t2)
+        tracing.record("inference.postprocess", t2, t3)
+        return out
+
+    def _crop(self, frame) -> Tuple[Any, int, int]:
+        if not self.config.roi:
+            return frame, 0, 0
+        h, w = frame.shape[:2]
+        fx1, fy1, fx2, fy2 = self.config.roi
+        x0, y0 = int(fx1 * w), int(fy1 * h)
+        return frame[y0:int(fy2 * h), x0:int(fx2 * w)], x0, y0
+
+    def _preprocess(self, image) -> Any:
+        return image
+
+    def _forward_batch(self, inputs: List[Any]) -> List[Any]:
+        return [self._forward(x) for x in inputs]
+
+    def _forward(self, inputs) -> Any:
+        raise NotImplementedError
+
+    def _postprocess(self, raw, image_hw: Tuple[int, int]) -> List[Detection]:
+        return raw
+
+
+class UltralyticsBackend(InferenceBackend):
+    name = "ultralytics"
+
+    def __init__(self, config: BackendConfig):
+        super().__init__(config)
+        if not ultralytics.available:
+            raise RuntimeError("ultralytics is not installed")
+        if config.threads:
+            try:
+                import torch
+
+                torch.set_num_threads(config.threads)
+            except Exception:
+                pass
+        self.model = ultralytics.YOLO(config.model_path)
+        self.names = self.model.names if hasattr(self.model, "names") else {}
+
+    def _forward(self, image):
+        # ultralytics letterboxes internally, so its preprocessing is timed as inference
+        return self.model(image, imgsz=self.config.input_size, conf=self.config.conf, verbose=False)
+
+    def _forward_batch(self, images):
+        results = self.model(list(images), imgsz=self.config.input_size, conf=self.config.conf, verbose=False)
+        return [[r] for r in results]
+
+    def _postprocess(self, results, image_hw: Tuple[int, int]) -> List[Detection]:
+        out: List[Detection] = []
+        for r in results:
+            boxes = getattr(r, "boxes", None)
+            if boxes is None:
+                continue
+            for b in boxes:
+                cls = int(b.cls[0])
+                name = self.names.get(cls, "object") if isinstance(self.names, dict) else "object"
+                x1, y1, x2, y2 = (float(v) for v in b.xyxy[0])
+                out.append(Detection(name, float(b.conf[0]), (x1, y1, x2, y2)))
+        return out
+
+
+class OpenCVDNNBackend(InferenceBackend):
+    """YOLOv8 exported to ONNX (``yolo export format=onnx``), run through cv2.dnn."""
+
+    name = "onnx"
+
+    def __init__(self, config: BackendConfig, nms_iou: float = 0.45):
+        super().__init__(config)
+        self.net = cv2.dnn.readNetFromONNX(config.model_path)
+        self.nms_iou = nms_iou
+
+    def _preprocess(self, image):
+        size = self.config.input_size
+        return cv2.dnn.blobFromImage(image, 1 / 255.0, (size, size), swapRB=True, crop=False)
+
+    def _forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def _postprocess(self, output, image_hw: Tuple[int, int]) -> List[Detection]:
+        size = self.config.input_size
+        h, w = image_hw
+        # YOLOv8 output: (1, 4 + classes, anchors) with cx, cy, w, h in input pixels
+        preds = output[0].T
+        scores = preds[:, 4:]
+        cls_ids = scores.argmax(axis=1)
+        confs = scores[np.arange(len(scores)), cls_ids]
+        keep = confs >= self.config.conf
+        if not keep.any():
+            return []
+        preds, cls_ids, confs = preds[keep], cls_ids[keep], confs[keep]
+        sx, sy = w / size, h / size
+        boxes = np.stack(
+            [(preds[:, 0] - preds[:, 2] / 2) * sx, (preds[:, 1] - preds[:, 3] / 2) * sy, preds[:, 2] * sx, preds[:, 3] * sy],
+            axis=1,
+        )
+        idxs = cv2.dnn.NMSBoxes(boxes.tolist(), confs.tolist(), self.config.conf, self.nms_iou)
+        out: List[Detection] = []
+        for i in np.asarray(idxs).reshape(-1):
+            x, y, bw, bh = boxes[i]
+            cid = int(cls_ids[i])
+            name = COCO_NAMES[cid] if cid < len(COCO_NAMES) else "object"
+            out.append(Detection(name, float(confs[i]), (float(x), float(y), float(x + bw), float(y + bh))))
+        return out
+
+
+def _shift(dets: List[Detection], x0: int, y0: int) -> List[Detection]:
+    """Map boxes from ROI coordinates back into the full frame."""
+    if not (x0 or y0):
+        return dets
+    return [Detection(d.name, d.confidence, (d.box[0] + x0, d.box[1] + y0, d.box[2] + x0, d.box[3] + y0)) for d in dets]
+
+
+def create_backend(config: BackendConfig) -> InferenceBackend:
+    if config.kind == "onnx":
+        return OpenCVDNNBackend(config)
+    if config.kind == "ultralytics":
+        return UltralyticsBackend(config)
+    raise ValueError(f"unknown inference backend {config.kind!r}")
+
+
+def warm_up(backend: InferenceBackend, frame_hw: Tuple[int, int] = (480, 640)):
+    """One throwaway inference so lazy graph setup and allocations happen before real frames."""
+    backend.detect(np.zeros((frame_hw[0], frame_hw[1], 3), dtype=np.uint8))
+
+
+def parse_roi(text: str) -> Optional[Tuple[float, float, float, float]]:
+    """Parse "x1,y1,x2,y2" frame fractions; "path" selects the walking-path default."""
+    text = text.strip().lower()
+    if not text:
+        return None
+    if text == "path":
+        return WALKING_PATH_ROI
+    try:
+        x1, y1, x2, y2 = (float(v) for v in text.split(","))
+    except ValueError:
+        return None
+    if 0.0 <= x1 < x2 <= 1.0 and 0.0 <= y1 < y2 <= 1.0:
+        return x1, y1, x2, y2
+    return None
@@ -0,0 +1,131 @@
+from __future__ import annotations
+import difflib
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+_WORD = re.compile(r"[a-z0-9']+")
+
+
+@dataclass
+class Intent:
+    name: str
+    confidence: float
+    text: str
+
+
+class IntentSet:
+    """Maps short spoken answers to intents through a precomputed phrase index.
+
+    Each intent lists its trigger phrases. The index maps every phrase (one or
+    two words) to its intent, and the same phrases form the Vosk grammar for
+    the prompt, so the recognizer can only return words the index knows.
+    Words outside the index (from open-vocabulary STT or keyboard input) are
+    matched fuzzily at reduced weight. ``weak`` words are homophones of a
+    trigger ("to" for "two"); they count, at ``weak_weight``, only when
+    nothing else in the answer matched, so "I want to walk" means walking.
+    """
+
+    def __init__(self, phrases: Dict[str, Iterable[str]], fuzzy_cutoff: float = 0.8, fuzzy_weight: float = 0.6, weak: Optional[Dict[str, Iterable[str]]] = None, weak_weight: float = 0.5):
+        self.index: Dict[str, str] = {}
+        for intent, triggers in phrases.items():
+            for p in triggers:
+                self.index[" ".join(_WORD.findall(p.lower()))] = intent
+        self.weak: Dict[str, str] = {}
+        for intent, triggers in (weak or {}).items():
+            for p in triggers:
+                self.weak[" ".join(_WORD.findall(p.lower()))] = intent
+        self.intents = list(phrases)
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fuzzy_weight = fuzzy_weight
+        self.weak_weight = weak_weight
+        self._single = [p for p in self.index if " " not in p]
+
+    @property
+    def grammar(self) -> List[str]:
+        # Digits aren't in the recognizer's vocabulary; they only help typed answers.
+        # Weak words stay in so the recognizer can say "to" instead of forcing "two".
+        return sorted(p for p in list(self.index) + list(self.weak) if not any(c.isdigit() for c in p))
+
+    def match(self, text: str, asr_confidence: float = 1.0) -> Optional[Intent]:
+        """Best intent for ``text`` or None; confidence folds in ambiguity, fuzziness and ASR confidence."""
+        tokens = _WORD.findall(text.lower())
+        if not tokens:
+            return None
+        scores: Dict[str, float] = {}
+        weak_scores: Dict[str, float] = {}
+        used = set()
+        # Two-word phrases first ("on foot", "not yet"), then single words
+        for i in range(len(tokens) - 1):
+            intent = self.index.get(f"{tokens[i]} {tokens[i + 1]}")
+            if intent is not None:
+                scores[intent] = scores.get(intent, 0.0) + 2.0
+                used.update((i, i + 1))
+        for i, tok in enumerate(tokens):
+            if i in used:
+                continue
+            if tok in self.weak and tok not in self.index:
+                weak_scores[self.weak[tok]] = weak_scores.get(self.weak[tok], 0.0) + self.weak_weight
+                continue
+            intent = self.index.get(tok)
+            weight = 1.0
+            if intent is None and len(tok) > 2:
+                close = difflib.get_close_matches(tok, self._single, n=1, cutoff=self.fuzzy_cutoff)
+                if close:
+                    intent, weight = self.index[close[0]], self.fuzzy_weight
+            if intent is not None:
+                scores[intent] = scores.get(intent, 0.0) + weight
+        if not scores:
+            scores = weak_scores
+        if not scores:
+            return None
+        best, best_score = max(scores.items(), key=lambda kv: kv[1])
+        total = sum(scores.values())
+        # A single exact hit is fully trusted; fuzzy- or weak-only hits are capped at their weight
+        quality = min(1.0, best_score)
+        confidence = (best_score / total) * quality * asr_confidence
+        return Intent(best, round(confidence, 3), text)
+
+
+ROUTE_CHOICE = IntentSet({
+    "1": ("one", "1", "first", "first one", "option one", "number one"),
+    "2": ("two", "2", "second", "second one", "option two", "number two"),
+    "3": ("three", "3", "third", "third one", "option three", "number three"),
+    "walking": ("walk", "walking", "on foot", "foot"),
+    "driving": ("drive", "driving", "car", "taxi"),
+    "transit": ("bus", "transit", "public", "train", "subway", "metro", "public transport"),
+}, weak={"1": ("won",), "2": ("to", "too"), "3": ("tree",)})
+
+START = IntentSet({
+    "start": ("start", "go", "begin", "proceed", "ready", "let's go", "yes"),
+    "wait": ("wait", "stop", "not yet", "no", "hold on", "later"),
+})
+
+YES_NO = IntentSet({
+    "yes": ("yes", "yeah", "yep", "correct", "right", "sure", "okay"),
+    "no": ("no", "nope", "wrong", "not that"),
+})
+
+_LABELS = {"1": "option one", "2": "option two", "3": "option three"}
+
+
+def ask_intent(voice, prompt: str, intents: IntentSet, reask: str, min_confidence: float = 0.6, attempts: int = 2) -> Optional[Intent]:
+    """Ask ``prompt`` with a grammar built from ``intents``; re-ask briefly instead of guessing.
+
+    A match below ``min_confidence`` is confirmed with a yes/no question;
+    no match at all repeats ``reask``. Returns None after ``attempts`` tries.
+    """
+    question = prompt
+    for _ in range(attempts):
+        heard = voice.ask_transcript(question, grammar=intents.grammar)
+        intent = intents.match(heard.text, heard.confidence)
+        if intent is not None and intent.confidence >= min_confidence:
+            return intent
+        if intent is not None:
+            label = _LABELS.get(intent.name, intent.name)
+            answer = voice.ask_transcript(f"Did you say {label}? Yes or no.", grammar=YES_NO.grammar)
+            yes = YES_NO.match(answer.text, answer.confidence)
+            if yes is not None and yes.name == "yes":
+                return intent
+        question = reask
+    return None
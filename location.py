@@ -0,0 +1,245 @@
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Iterable, List, Optional
+
+from positions import Fix, parse_nmea, replay_track
+from startup import StartupTimer, lazy_import
+from utils import get_approx_location, haversine_m
+
+serial = lazy_import("serial")  # optional: pyserial, for a live GPS receiver
+
+# How fast a stale fix is assumed to drift from the truth: about a brisk walk
+_DRIFT_MPS = 1.5
+
+
+@dataclass
+class LocationFix:
+    lat: float
+    lon: float
+    accuracy_m: float
+    source: str  # ip, gps, fixed, cached
+    timestamp: float
+    display: str = ""
+
+    def age_sec(self, now: Optional[float] = None) -> float:
+        return max(0.0, (now if now is not None else time.time()) - self.timestamp)
+
+    def effective_accuracy_m(self, now: Optional[float] = None) -> float:
+        """Stated accuracy widened by how far the user could have moved since."""
+        return self.accuracy_m + _DRIFT_MPS * self.age_sec(now)
+
+    def as_dict(self) -> dict:
+        """The shape ``utils.get_approx_location`` returns."""
+        return {"lat": self.lat, "lon": self.lon, "display": self.display, "source": self.source}
+
+
+Publish = Callable[[LocationFix], None]
+
+
+class FixedProvider:
+    """A configured location (``DEFAULT_LAT``/``DEFAULT_LON``), available at once."""
+
+    name = "fixed"
+
+    def __init__(self, lat: float, lon: float, display: str = "", accuracy_m: float = 2000.0):
+        self.fix = LocationFix(lat, lon, accuracy_m, self.name, 0.0, display)
+
+    def start(self, publish: Publish):
+        publish(LocationFix(self.fix.lat, self.fix.lon, self.fix.accuracy_m, self.name, time.time(), self.fix.display))
+
+    def stop(self):
+        pass
+
+
+class IPProvider:
+    """One coarse IP geolocation lookup on a background thread."""
+
+    name = "ip"
+
+    def __init__(self, lookup: Callable[[], dict] = get_approx_location, accuracy_m: float = 5000.0, startup: Optional[StartupTimer] = None):
+        self.lookup = lookup
+        self.accuracy_m = accuracy_m
+        self.startup = startup or StartupTimer()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, publish: Publish):
+        self._thread = threading.Thread(target=self._run, args=(publish,), name="location-ip", daemon=True)
+        self._thread.start()
+
+    def _run(self, publish: Publish):
+        with self.startup.phase("ip_location"):
+            data = self.lookup()
+        if data and data.get("lat") is not None and data.get("lon") is not None:
+            publish(LocationFix(float(data["lat"]), float(data["lon"]), self.accuracy_m, self.name, time.time(), data.get("display", "")))
+
+    def stop(self):
+        pass
+
+
+class GPSProvider:
+    """Fixes from a GPS feed: a serial NMEA receiver, or a recorded .nmea/.gpx track."""
+
+    name = "gps"
+
+    def __init__(self, fixes: Callable[[], Iterable[Fix]], default_accuracy_m: float = 10.0):
+        self._open = fixes
+        self.default_accuracy_m = default_accuracy_m
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_source(cls, source: str, baud: int = 4800) -> "GPSProvider":
+        """``source`` is a track file, or a serial port such as COM3 or /dev/ttyUSB0."""
+        if os.path.isfile(source):
+            return cls(lambda: replay_track(source))
+
+        def _lines():
+            with serial.Serial(source, baud, timeout=1) as port:
+                while True:
+                    line = port.readline()
+                    if line:
+                        yield line.decode("ascii", errors="ignore")
+
+        return cls(lambda: parse_nmea(_lines()))
+
+    def start(self, publish: Publish):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(publish,), name="location-gps", daemon=True)
+        self._thread.start()
+
+    def _run(self, publish: Publish):
+        try:
+            for fix in self._open():
+                if self._stop.is_set():
+                    break
+                accuracy = fix.accuracy_m if fix.accuracy_m is not None else self.default_accuracy_m
+                # Receiver clocks can be off; the fix is as fresh as its arrival
+                publish(LocationFix(fix.lat, fix.lon, accuracy, self.name, time.time()))
+        except Exception:
+            pass
+
+    def stop(self):
+        self._stop.set()
+
+
+class LocationService:
+    """Keeps the best available fix from several providers running in the background.
+
+    A fix replaces the current one when its accuracy beats the current
+    fix's accuracy widened by its age, so a fresh GPS fix wins over an IP
+    guess and a minutes-old GPS fix eventually yields to anything recent.
+    The best fix is saved to ``store_path`` and reused on the next start if
+    it is younger than ``ttl_sec``, so a restart has a location immediately.
+    ``current`` never blocks.
+    """
+
+    def __init__(self, providers: List, store_path: str = "", ttl_sec: float = 6 * 3600.0, startup: Optional[StartupTimer] = None, save_every_sec: float = 30.0):
+        self.providers = providers
+        self.store_path = store_path
+        self.ttl_sec = ttl_sec
+        self.startup = startup or StartupTimer()
+        self.save_every_sec = save_every_sec
+        self._fix: Optional[LocationFix] = None
+        self._cond = threading.Condition()
+        self._saved_at = 0.0
+        self._listeners: List[Publish] = []
+
+    def start(self) -> "LocationService":
+        cached = self._load()
+        if cached is not None:
+            with self._cond:
+                self._fix = cached
+        for provider in self.providers:
+            try:
+                provider.start(self.publish)
+            except Exception:
+                pass
+        return self
+
+    def stop(self):
+        for provider in self.providers:
+            try:
+                provider.stop()
+            except Exception:
+                pass
+        self._save(force=True)
+
+    def add_listener(self, listener: Publish):
+        self._listeners.append(listener)
+
+    def current(self) -> Optional[LocationFix]:
+        with self._cond:
+            return self._fix
+
+    def wait(self, timeout: float) -> Optional[LocationFix]:
+        """The current fix, waiting up to ``timeout`` only if there is none yet."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._fix is not None, timeout=timeout)
+            return self._fix
+
+    def publish(self, fix: LocationFix):
+        now = time.time()
+        with self._cond:
+            current = self._fix
+            if current is not None and fix.accuracy_m > current.effective_accuracy_m(now):
+                return
+            if not fix.display and current is not None and current.display and haversine_m(fix.lat, fix.lon, current.lat, current.lon) < 5000.0:
+                fix.display = current.display
+            first = current is None or current.source == "cached"
+            self._fix = fix
+            self._cond.notify_all()
+        if first:
+            self.startup.mark("first_location")
+        self._save()
+        for listener in list(self._listeners):
+            try:
+                listener(fix)
+            except Exception:
+                pass
+
+    def _load(self) -> Optional[LocationFix]:
+        if not self.store_path:
+            return None
+        try:
+            with open(self.store_path, "r", encoding="utf-8") as fh:
+                data = json.load(fh)
+            fix = LocationFix(float(data["lat"]), float(data["lon"]), float(data["accuracy_m"]), "cached", float(data["timestamp"]), data.get("display", ""))
+        except Exception:
+            return None
+        return fix if fix.age_sec() <= self.ttl_sec else None
+
+    def _save(self, force: bool = False):
+        fix = self.current()
+        if not self.store_path or fix is None or fix.source == "cached":
+            return
+        now = time.monotonic()
+        if not force and now - self._saved_at < self.save_every_sec:
+            return
+        self._saved_at = now
+        try:
+            os.makedirs(os.path.dirname(self.store_path) or ".", exist_ok=True)
+            tmp = self.store_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as fh:
+                json.dump(asdict(fix), fh)
+            os.replace(tmp, self.store_path)
+        except OSError:
+            pass
+
+
+def from_config(startup: Optional[StartupTimer] = None) -> LocationService:
+    """Providers from the environment: GPS_SOURCE, DEFAULT_LAT/DEFAULT_LON (+ DEFAULT_CITY), and IP lookup."""
+    from config import DEFAULT_CITY, DEFAULT_LAT, DEFAULT_LON, GPS_SOURCE, LOCATION_CACHE_PATH, LOCATION_TTL_SEC
+
+    providers: List = []
+    if GPS_SOURCE:
+        providers.append(GPSProvider.from_source(GPS_SOURCE))
+    try:
+        providers.append(FixedProvider(float(DEFAULT_LAT), float(DEFAULT_LON), DEFAULT_CITY))
+    except ValueError:
+        pass
+    providers.append(IPProvider(startup=startup))
+    return LocationService(providers, store_path=LOCATION_CACHE_PATH, ttl_sec=LOCATION_TTL_SEC, startup=startup)
@@ -1,13 +1,32 @@
 from __future__ import annotations
+import time
+
+_STARTED = time.perf_counter()
+
 import argparse
-from typing import Optional
-import threading
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
 
-from config import DEMO_MODE, VOICE_STT_ENGINE, VOSK_MODEL_PATH, ENABLE_VISION, GOOGLE_MAPS_API_KEY, ORS_API_KEY
+from config import DEMO_MODE, VOICE_STT_ENGINE, VOSK_MODEL_PATH, ENABLE_VISION, GOOGLE_MAPS_API_KEY, ORS_API_KEY, ROUTE_CACHE_PATH, ROUTE_CACHE_SIZE, ROUTE_DEADLINE_SEC, OFFLINE_GRAPH_PATH, GAZETTEER_PATH, PHRASE_CACHE_DIR, PHRASE_CACHE_MB
+from config import VISION_BACKEND, VISION_MODEL_PATH, VISION_INPUT_SIZE, VISION_ROI, VISION_THREADS, VISION_DETECT_EVERY
 from voice_io import VoiceIO
+from guidance import GuidanceScheduler, GuidanceSession, default_scheduler
+from phrase_cache import COMMON_PHRASES
+from intents import ROUTE_CHOICE, ask_intent
 from routing import Router, describe_route, RouteOption
+from route_cache import RouteCache
+from positions import Fix, replay_track
 from vision import VisionLoop
-from utils import minutes_to_eta_str, now_plus_minutes, sleep_seconds, get_approx_location
+from events import OBSTACLE, vision_bus
+from inference import BackendConfig, parse_roi
+from startup import StartupTimer
+import tracing
+import location
+from utils import describe_distance
+
+_IMPORTED = time.perf_counter()
 
 
 def choose_route(voice: VoiceIO, options: list[RouteOption]) -> Optional[RouteOption]:
@@ -16,77 +35,44 @@ def choose_route(voice: VoiceIO, options: list[RouteOption]) -> Optional[RouteOp
     for idx, opt in enumerate(options, start=1):
         voice.say(f"Option {idx}: {describe_route(opt)}")
 
-    resp = voice.ask("Which option do you want? One, two, or three?")
-    resp_num = None
-    tokens = resp.lower().split()
-    for token in tokens:
-        if token in ("one", "1"):
-            resp_num = 1
-            break
-        if token in ("two", "2"):
-            resp_num = 2
-            break
-        if token in ("three", "3"):
-            resp_num = 3
-            break
-    # Allow choosing by mode name
-    if resp_num is None:
-        chosen_mode = None
-        for t in tokens:
-            if t in ("walk", "walking"):
-                chosen_mode = "walking"
-                break
-            if t in ("drive", "driving", "car"):
-                chosen_mode = "driving"
-                break
-            if t in ("bus", "transit", "public"):
-                chosen_mode = "transit"
-                break
-        if chosen_mode:
-            for opt in options:
-                if opt.mode == chosen_mode:
-                    return opt
-    if resp_num and 1 <= resp_num <= len(options):
-        return options[resp_num - 1]
+    intent = ask_intent(voice, "Which option do you want? One, two, or three?", ROUTE_CHOICE, reask="Sorry. Say one, two, or three, or a mode like walking.")
+    if intent is not None:
+        if intent.name.isdigit() and 1 <= int(intent.name) <= len(options):
+            return options[int(intent.name) - 1]
+        # Allow choosing by mode name
+        for opt in options:
+            if opt.mode == intent.name:
+                return opt
     voice.say("I didn't catch that. I'll pick the shortest route.")
     return sorted(options, key=lambda x: x.duration_min)[0]
 
 
-def guidance_loop(voice: VoiceIO, selection: RouteOption, obstacle_event: Optional[threading.Event] = None, demo_mode: bool = True, auto_start: bool = False):
-    voice.say(f"Starting {selection.mode} guidance. Estimated time {minutes_to_eta_str(selection.duration_min)}. Arrival around {now_plus_minutes(selection.duration_min)}.")
-    remaining = selection.duration_min
-    # Speak the first few steps more often, then minute-by-minute updates
-    for step in selection.steps:
-        voice.say(step)
-        sleep_seconds(1.0)
-
-    # Wait for explicit start unless auto-start is enabled
-    if not auto_start:
-        while True:
-            resp = voice.ask("Say start when you are ready to begin, or say go.")
-            r = resp.strip().lower()
-            if any(k in r for k in ("start", "go", "begin", "proceed")):
-                voice.say("Starting now. Stay safe and follow the instructions.")
-                break
-            else:
-                voice.say("Okay, I will wait. Let me know when to start.")
-
-    while remaining > 0:
-        # Pause if obstacle signaled
-        if obstacle_event is not None and obstacle_event.is_set():
-            wait_seconds = 120
-            voice.say("Obstacle ahead. Please wait. I will let you know when it's safe to continue.")
-            sleep_seconds(wait_seconds)
-            if obstacle_event is not None:
-                obstacle_event.clear()
-            voice.say("It should be clear now. You can proceed.")
-        if remaining == 1:
-            voice.say("One minute remaining.")
-        else:
-            voice.say(f"{remaining} minutes remaining.")
-        remaining -= 1
-        sleep_seconds(3.0 if DEMO_MODE else 60.0)
-    voice.say("You have arrived at your destination.")
+def guidance_loop(voice: VoiceIO, selection: RouteOption, vision: Optional[VisionLoop] = None, demo_mode: bool = True, auto_start: bool = False, fixes: Optional[Iterable[Fix]] = None, router: Optional[Router] = None, scheduler: Optional[GuidanceScheduler] = None, time_scale: float = 1.0) -> bool:
+    """Run one guidance session on the shared scheduler and wait for it to finish.
+
+    ``time_scale`` shrinks every wait (0.01 turns a minute into 0.6 s) for simulations.
+    """
+    session = GuidanceSession(
+        voice,
+        selection,
+        auto_start=auto_start,
+        fixes=fixes,
+        router=router,
+        tick_sec=(3.0 if demo_mode else 60.0) * time_scale,
+        step_gap_sec=1.0 * time_scale,
+        max_pause_sec=120.0 * time_scale,
+    )
+    subscription = None
+    if vision is not None:
+        # post() only queues onto the session's loop, so this runs on the camera thread
+        subscription = vision.bus.subscribe(OBSTACLE, lambda e: session.obstacle_set(e.message) if e.active else session.obstacle_clear(), name="guidance", threaded=False)
+        if vision.obstacle_active:
+            session.obstacle_set()
+    try:
+        return (scheduler or default_scheduler()).run(session)
+    finally:
+        if subscription is not None:
+            subscription.close()
 
 
 def main():
@@ -97,20 +83,105 @@ def main():
     parser.add_argument("--auto-select", action="store_true", help="Automatically select the shortest route (non-interactive)")
     parser.add_argument("--vision", action="store_true", help="Force-enable vision safety loop (camera)")
     parser.add_argument("--auto-start", action="store_true", help="Start guidance immediately without waiting for confirmation")
+    parser.add_argument("--positions", type=str, default="", help="Replay a recorded track (.gpx, .nmea, or lat,lon per line) as the position feed")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Play the --positions track this many times faster than recorded")
+    parser.add_argument("--startup-report", action="store_true", help="Print startup phase timings as JSON to stderr on exit")
+    parser.add_argument("--profile", action="store_true", help="Trace the session and print a per-phase summary to stderr on exit")
+    parser.add_argument("--trace-out", type=str, default="", help="Write a Chrome trace-event JSON file on exit (implies tracing)")
+    parser.add_argument("--metrics-out", type=str, default="", help="Write Prometheus text metrics on exit (implies tracing)")
+    parser.add_argument("--metrics-port", type=int, default=0, help="Serve Prometheus text metrics at http://127.0.0.1:PORT/metrics")
     args = parser.parse_args()
+    if args.profile or args.trace_out or args.metrics_out or args.metrics_port:
+        tracing.enable()
+        if args.metrics_port:
+            tracing.serve_prometheus(args.metrics_port)
 
     demo_mode = DEMO_MODE or args.demo
+    startup = StartupTimer(t0=_STARTED)
+    startup.record("imports", _STARTED, _IMPORTED)
+    locator = location.from_config(startup=startup).start()
 
-    voice = VoiceIO(stt_engine=VOICE_STT_ENGINE, vosk_model_path=VOSK_MODEL_PATH)
-    router = Router(demo_mode=demo_mode, google_key=GOOGLE_MAPS_API_KEY, ors_key=ORS_API_KEY)
-
+    voice = VoiceIO(stt_engine=VOICE_STT_ENGINE, vosk_model_path=VOSK_MODEL_PATH, startup=startup, phrase_cache_dir=PHRASE_CACHE_DIR, phrase_cache_mb=PHRASE_CACHE_MB)
+    voice.prerender(list(COMMON_PHRASES) + [str(n) for n in range(2, 31)])
+    vision_enabled = (not args.no_vision) and (args.vision or ENABLE_VISION)
+    backend_config = BackendConfig(
+        kind=VISION_BACKEND,
+        model_path=VISION_MODEL_PATH,
+        input_size=VISION_INPUT_SIZE,
+        roi=parse_roi(VISION_ROI),
+        threads=VISION_THREADS or None,
+    )
+    vision = VisionLoop(enabled=vision_enabled, voice_say=lambda text: voice.say(text, wait=False), voice_alert=voice.alert, demo_mode=demo_mode, backend_config=backend_config, detect_every=VISION_DETECT_EVERY, startup=startup, bus=vision_bus(), threaded_alerts=True)
+    # Models and graphs load, and location providers run, while the greeting is spoken
+    voice.warm_up()
+    if vision_enabled:
+        vision.warm_up()
+    background = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    offline_future = background.submit(_load_offline, demo_mode, startup)
+    geocoder_future = background.submit(_load_geocoder, startup)
+
+    startup.mark("first_prompt")
     voice.say("Hello. I am your navigation assistant. Please tell me your destination.")
-    # Determine approximate origin via IP
-    origin_display = "current location"
-    loc = get_approx_location()
-    if loc:
-        origin_display = loc.get("display") or origin_display
-        voice.say(f"I detected you are near {origin_display}.")
+    try:
+        _navigate(args, voice, vision, demo_mode, startup, offline_future, geocoder_future, locator)
+    finally:
+        background.shutdown(wait=False)
+        locator.stop()
+        if args.startup_report:
+            sys.stderr.write(json.dumps(startup.report(), indent=2) + "\n")
+        _export_trace(args)
+
+
+def _export_trace(args):
+    tracer = tracing.get_tracer()
+    if tracer is None:
+        return
+    if args.trace_out:
+        tracing.write_chrome_trace(args.trace_out)
+    if args.metrics_out:
+        tracing.write_prometheus(args.metrics_out)
+    if args.profile:
+        sys.stderr.write(tracing.format_summary(tracer.summary()) + "\n")
+
+
+def _load_offline(demo_mode: bool, startup: StartupTimer):
+    if not OFFLINE_GRAPH_PATH or demo_mode:
+        return None
+    try:
+        from offline_router import OfflineRouter
+        with startup.phase("offline_graph_load"):
+            return OfflineRouter.load(OFFLINE_GRAPH_PATH)
+    except Exception:
+        return None
+
+
+def _load_geocoder(startup: StartupTimer):
+    if not GAZETTEER_PATH:
+        return None
+    try:
+        from geocoder import Geocoder
+        with startup.phase("gazetteer_load"):
+            return Geocoder.from_csv(GAZETTEER_PATH)
+    except Exception:
+        return None
+
+
+def _navigate(args, voice: VoiceIO, vision: VisionLoop, demo_mode: bool, startup: StartupTimer, offline_future, geocoder_future, locator: location.LocationService):
+    with startup.phase("route_cache_open"):
+        cache = RouteCache(path=ROUTE_CACHE_PATH, max_entries=ROUTE_CACHE_SIZE)
+    router = Router(
+        demo_mode=demo_mode,
+        google_key=GOOGLE_MAPS_API_KEY,
+        ors_key=ORS_API_KEY,
+        cache=cache,
+        deadline_sec=ROUTE_DEADLINE_SEC,
+        offline=offline_future.result(),
+    )
+    geocoder = geocoder_future.result()
+
+    fix = locator.current()
+    if fix is not None and fix.display:
+        voice.say(f"I detected you are near {fix.display}.")
     if args.destination:
         destination = args.destination
     else:
@@ -119,9 +190,36 @@ def main():
         destination = "nearest coffee shop"
         voice.say("I didn't hear a destination. Using a nearby place as an example.")
 
-    # In a real app, origin would come from GPS or IP geolocation; here we use a placeholder
-    origin = origin_display
-    options = router.get_routes(origin, destination)
+    # The freshest fix by now; only a cold start with nothing cached or configured waits, for at most the old IP lookup timeout
+    fix = locator.current() or locator.wait(timeout=5.0)
+    origin_display = "current location"
+    near = None
+    if fix is not None:
+        origin_display = fix.display or origin_display
+        near = (fix.lat, fix.lon)
+
+    # Routing providers take "lat,lon" when we have it; demo routes just use the spoken name
+    origin = f"{near[0]},{near[1]}" if near and not demo_mode else origin_display
+    route_destination = destination
+    if geocoder is not None:
+        candidates = geocoder.search(destination, near=near)
+        if candidates:
+            best = candidates[0]
+            if best.distance_m is not None:
+                voice.say(f"Going to {best.name}, about {describe_distance(best.distance_m)} away.")
+            else:
+                voice.say(f"Going to {best.name}.")
+            if not demo_mode:
+                route_destination = best.latlon
+
+    result = router.lookup(origin, route_destination)
+    options = result.options
+    if result.provider == "demo" and not demo_mode and router.orchestrator.providers:
+        voice.say("I couldn't reach the routing service, so these are example routes only.")
+    elif options and any(r in ("timeout", "error") for r in result.missing_modes.values()):
+        # Modes still loading in the background or not offered at all aren't failures
+        skipped = ", ".join(sorted(m for m, r in result.missing_modes.items() if r in ("timeout", "error")))
+        voice.say(f"I couldn't get {skipped} routes, so they are not included.")
     if not options:
         voice.say("I'm sorry, I couldn't find routes. Falling back to a safe demo.")
         options = router._demo_routes(destination)
@@ -132,14 +230,12 @@ def main():
         selected = choose_route(voice, options)
 
     # Start vision loop if enabled
-    vision_enabled = (not args.no_vision) and (args.vision or ENABLE_VISION)
-    obstacle_event = threading.Event() if vision_enabled else None
-    vision = VisionLoop(enabled=vision_enabled, voice_say=voice.say, demo_mode=demo_mode, obstacle_event=obstacle_event)
     vision.start()
 
     try:
         if selected:
-            guidance_loop(voice, selected, obstacle_event=obstacle_event, demo_mode=demo_mode, auto_start=args.auto_start)
+            fixes = replay_track(args.positions, speedup=args.replay_speed) if args.positions else None
+            guidance_loop(voice, selected, vision=vision, demo_mode=demo_mode, auto_start=args.auto_start, fixes=fixes, router=router)
         else:
             voice.say("No route selected.")
     finally:
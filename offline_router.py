@@ -0,0 +1,512 @@
+from __future__ import annotations
+import heapq
+import json
+import math
+import os
+import random
+import sys
+import time
+import xml.etree.ElementTree as ET
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from routing import RouteOption
+from utils import EARTH_RADIUS_M, bearing_deg, describe_distance
+
+WALK = 1
+DRIVE = 2
+MODE_FLAGS = {"walking": WALK, "driving": DRIVE}
+
+WALK_SPEED_MPS = 1.2  # unhurried pace for a visually impaired pedestrian
+
+# Typical urban driving speeds (m/s) when a way has no usable maxspeed tag
+DRIVE_SPEEDS_MPS = {
+    "motorway": 27.0, "motorway_link": 17.0, "trunk": 22.0, "trunk_link": 14.0,
+    "primary": 17.0, "primary_link": 11.0, "secondary": 14.0, "secondary_link": 10.0,
+    "tertiary": 11.0, "tertiary_link": 9.0, "unclassified": 9.0, "residential": 8.0,
+    "living_street": 3.0, "service": 5.0,
+}
+WALK_ONLY = {"footway", "path", "pedestrian", "steps", "cycleway", "track", "bridleway", "corridor"}
+NO_WALK = {"motorway", "motorway_link", "trunk", "trunk_link"}
+
+_ARRAYS = (
+    "node_lat", "node_lon", "indptr", "indices", "edge_len", "edge_speed", "edge_flags", "edge_name",
+    "rev_indptr", "rev_indices", "rev_edge",
+)
+
+
+def _haversine_np(lat1, lon1, lat2, lon2):
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((p2 - p1) / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+class OfflineGraph:
+    """Road/footpath graph in CSR form.
+
+    Node ``u``'s outgoing edges are ``indptr[u]:indptr[u + 1]``; ``indices`` holds
+    the head node and the ``edge_*`` arrays hold per-edge attributes in the same
+    order. The ``rev_*`` arrays are the transposed graph for backward search,
+    with ``rev_edge`` pointing back into the forward edge arrays.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], names: List[str]):
+        for key in _ARRAYS:
+            setattr(self, key, arrays[key])
+        self.names = names
+        self.max_drive_speed = float(self.edge_speed.max()) if len(self.edge_speed) else 1.0
+        # Per-node mode mask so snapping never lands on a node the mode can't use
+        node_flags = np.zeros(len(self.node_lat), dtype=np.uint8)
+        src = np.repeat(np.arange(len(self.node_lat)), np.diff(self.indptr))
+        np.bitwise_or.at(node_flags, src, self.edge_flags)
+        np.bitwise_or.at(node_flags, np.asarray(self.indices), self.edge_flags)
+        self.node_flags = node_flags
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_lat)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_edges(
+        cls,
+        node_lat: Sequence[float],
+        node_lon: Sequence[float],
+        src: Sequence[int],
+        dst: Sequence[int],
+        flags: Sequence[int],
+        speeds: Sequence[float],
+        name_ids: Sequence[int],
+        names: List[str],
+    ) -> "OfflineGraph":
+        lat = np.asarray(node_lat, dtype=np.float64)
+        lon = np.asarray(node_lon, dtype=np.float64)
+        src_a = np.asarray(src, dtype=np.int32)
+        dst_a = np.asarray(dst, dtype=np.int32)
+        n = len(lat)
+        order = np.argsort(src_a, kind="stable")
+        src_a, dst_a = src_a[order], dst_a[order]
+        arrays = {
+            "node_lat": lat,
+            "node_lon": lon,
+            "indptr": np.concatenate(([0], np.cumsum(np.bincount(src_a, minlength=n)))).astype(np.int64),
+            "indices": dst_a,
+            "edge_len": _haversine_np(lat[src_a], lon[src_a], lat[dst_a], lon[dst_a]).astype(np.float32),
+            "edge_speed": np.asarray(speeds, dtype=np.float32)[order],
+            "edge_flags": np.asarray(flags, dtype=np.uint8)[order],
+            "edge_name": np.asarray(name_ids, dtype=np.int32)[order],
+        }
+        rev_order = np.argsort(dst_a, kind="stable")
+        arrays["rev_indptr"] = np.concatenate(([0], np.cumsum(np.bincount(dst_a, minlength=n)))).astype(np.int64)
+        arrays["rev_indices"] = src_a[rev_order]
+        arrays["rev_edge"] = rev_order.astype(np.int32)
+        return cls(arrays, names)
+
+    @classmethod
+    def from_osm(cls, path: str) -> "OfflineGraph":
+        """Build a graph from an OSM XML extract (``.osm``)."""
+        coords: Dict[int, Tuple[float, float]] = {}
+        ways: List[Tuple[List[int], Dict[str, str]]] = []
+        for _, elem in ET.iterparse(path, events=("end",)):
+            if elem.tag == "node":
+                coords[int(elem.get("id"))] = (float(elem.get("lat")), float(elem.get("lon")))
+                elem.clear()
+            elif elem.tag == "way":
+                tags = {t.get("k"): t.get("v") for t in elem.findall("tag")}
+                if "highway" in tags and tags.get("area") != "yes":
+                    ways.append(([int(nd.get("ref")) for nd in elem.findall("nd")], tags))
+                elem.clear()
+
+        node_index: Dict[int, int] = {}
+        lat: List[float] = []
+        lon: List[float] = []
+        name_index: Dict[str, int] = {"": 0}
+        names: List[str] = [""]
+        src: List[int] = []
+        dst: List[int] = []
+        flags: List[int] = []
+        speeds: List[float] = []
+        name_ids: List[int] = []
+
+        def _node(osm_id: int) -> int:
+            idx = node_index.get(osm_id)
+            if idx is None:
+                idx = node_index[osm_id] = len(lat)
+                la, lo = coords[osm_id]
+                lat.append(la)
+                lon.append(lo)
+            return idx
+
+        for refs, tags in ways:
+            highway = tags["highway"]
+            walk = highway not in NO_WALK and tags.get("foot") != "no"
+            drive = highway in DRIVE_SPEEDS_MPS and tags.get("motor_vehicle") != "no" and tags.get("access") != "no"
+            if highway in WALK_ONLY:
+                drive = False
+            if not (walk or drive):
+                continue
+            speed = _maxspeed_mps(tags.get("maxspeed", "")) or DRIVE_SPEEDS_MPS.get(highway, 8.0)
+            oneway = tags.get("oneway") in ("yes", "true", "1") or tags.get("junction") == "roundabout"
+            label = tags.get("name") or tags.get("ref") or ""
+            name_id = name_index.setdefault(label, len(names))
+            if name_id == len(names):
+                names.append(label)
+            refs = [r for r in refs if r in coords]
+            for a, b in zip(refs, refs[1:]):
+                u, v = _node(a), _node(b)
+                fwd = (WALK if walk else 0) | (DRIVE if drive else 0)
+                back = (WALK if walk else 0) | (DRIVE if drive and not oneway else 0)
+                for s, d, f in ((u, v, fwd), (v, u, back)):
+                    if f:
+                        src.append(s)
+                        dst.append(d)
+                        flags.append(f)
+                        speeds.append(speed)
+                        name_ids.append(name_id)
+        return cls.from_edges(lat, lon, src, dst, flags, speeds, name_ids, names)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        for key in _ARRAYS:
+            np.save(os.path.join(directory, f"{key}.npy"), np.ascontiguousarray(getattr(self, key)))
+        with open(os.path.join(directory, "names.json"), "w", encoding="utf-8") as f:
+            json.dump(self.names, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "OfflineGraph":
+        mode = "r" if mmap else None
+        arrays = {key: np.load(os.path.join(directory, f"{key}.npy"), mmap_mode=mode) for key in _ARRAYS}
+        with open(os.path.join(directory, "names.json"), encoding="utf-8") as f:
+            names = json.load(f)
+        return cls(arrays, names)
+
+    def nearest_node(self, lat: float, lon: float, flag: int) -> int:
+        # Equirectangular distance is plenty accurate for snapping within a city
+        dx = (np.asarray(self.node_lon) - lon) * math.cos(math.radians(lat))
+        dy = np.asarray(self.node_lat) - lat
+        d2 = dx * dx + dy * dy
+        d2[(self.node_flags & flag) == 0] = np.inf
+        return int(np.argmin(d2))
+
+
+class OfflineRouter:
+    """Answers routing queries on an ``OfflineGraph`` with bidirectional A*."""
+
+    MODES = ("walking", "driving")
+
+    def __init__(self, graph: OfflineGraph):
+        self.graph = graph
+
+    @classmethod
+    def load(cls, path: str) -> "OfflineRouter":
+        """Load a compiled graph directory, or compile (and save next to it) an ``.osm`` extract."""
+        if os.path.isdir(path):
+            return cls(OfflineGraph.load(path))
+        compiled = os.path.splitext(path)[0] + ".graph"
+        if os.path.isdir(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+            return cls(OfflineGraph.load(compiled))
+        graph = OfflineGraph.from_osm(path)
+        try:
+            graph.save(compiled)
+        except OSError:
+            pass
+        return cls(graph)
+
+    def route(self, origin: Tuple[float, float], destination: Tuple[float, float], mode: str) -> Optional[RouteOption]:
+        flag = MODE_FLAGS.get(mode)
+        if flag is None:
+            return None
+        g = self.graph
+        s = g.nearest_node(origin[0], origin[1], flag)
+        t = g.nearest_node(destination[0], destination[1], flag)
+        path = self.shortest_path(s, t, mode)
+        if path is None:
+            return None
+        return self._to_option(path, mode)
+
+    def shortest_path(self, s: int, t: int, mode: str) -> Optional[List[int]]:
+        """Return the edge ids of the fastest s->t path, or None if unreachable."""
+        if s == t:
+            return []
+        g = self.graph
+        flag = MODE_FLAGS[mode]
+        max_speed = WALK_SPEED_MPS if flag == WALK else g.max_drive_speed
+        lat, lon = g.node_lat, g.node_lon
+        s_lat, s_lon, t_lat, t_lon = float(lat[s]), float(lon[s]), float(lat[t]), float(lon[t])
+        cos_mid = math.cos(math.radians((s_lat + t_lat) / 2))
+        k = EARTH_RADIUS_M * math.pi / 180.0 / max_speed
+        pot_cache: Dict[int, float] = {}
+
+        def potential(v: int) -> float:
+            # Average of forward and backward heuristics keeps both searches consistent
+            p = pot_cache.get(v)
+            if p is None:
+                vl, vo = float(lat[v]), float(lon[v])
+                ht = math.hypot((vo - t_lon) * cos_mid, vl - t_lat)
+                hs = math.hypot((vo - s_lon) * cos_mid, vl - s_lat)
+                p = pot_cache[v] = 0.5 * k * (ht - hs) * 0.99
+            return p
+
+        indptr, indices = g.indptr, g.indices
+        rev_indptr, rev_indices, rev_edge = g.rev_indptr, g.rev_indices, g.rev_edge
+        edge_len, edge_speed, edge_flags = g.edge_len, g.edge_speed, g.edge_flags
+        dist = ({s: 0.0}, {t: 0.0})
+        parent: Tuple[Dict[int, int], Dict[int, int]] = ({s: -1}, {t: -1})
+        settled = (set(), set())
+        heaps = ([(potential(s), s)], [(-potential(t), t)])
+        best = math.inf
+        meet = -1
+
+        while heaps[0] and heaps[1]:
+            if heaps[0][0][0] + heaps[1][0][0] >= best:
+                break
+            side = 0 if heaps[0][0][0] <= heaps[1][0][0] else 1
+            _, u = heapq.heappop(heaps[side])
+            if u in settled[side]:
+                continue
+            settled[side].add(u)
+            du = dist[side][u]
+            other = dist[1 - side]
+            if side == 0:
+                lo, hi = int(indptr[u]), int(indptr[u + 1])
+            else:
+                lo, hi = int(rev_indptr[u]), int(rev_indptr[u + 1])
+            for i in range(lo, hi):
+                if side == 0:
+                    e, v = i, int(indices[i])
+                else:
+                    e, v = int(rev_edge[i]), int(rev_indices[i])
+                if not edge_flags[e] & flag:
+                    continue
+                speed = WALK_SPEED_MPS if flag == WALK else float(edge_speed[e])
+                dv = du + float(edge_len[e]) / speed
+                if dv < dist[side].get(v, math.inf):
+                    dist[side][v] = dv
+                    parent[side][v] = e
+                    key = dv + potential(v) if side == 0 else dv - potential(v)
+                    heapq.heappush(heaps[side], (key, v))
+                    if v in other and dv + other[v] < best:
+                        best = dv + other[v]
+                        meet = v
+        if meet < 0:
+            return None
+
+        edges: List[int] = []
+        v = meet
+        while parent[0][v] >= 0:
+            e = parent[0][v]
+            edges.append(e)
+            v = self._edge_tail(e)
+        edges.reverse()
+        v = meet
+        while parent[1][v] >= 0:
+            e = parent[1][v]
+            edges.append(e)
+            v = int(indices[e])
+        return edges
+
+    def one_to_many(
+        self, origin: Tuple[float, float], destinations: Sequence[Tuple[float, float]], mode: str
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Travel time (s) and distance (m) from ``origin`` to each destination.
+
+        One Dijkstra run that stops once every destination is settled; unreachable
+        destinations are NaN.
+        """
+        durations = np.full(len(destinations), np.nan)
+        distances = np.full(len(destinations), np.nan)
+        flag = MODE_FLAGS.get(mode)
+        if flag is None or not len(destinations):
+            return durations, distances
+        g = self.graph
+        s = g.nearest_node(origin[0], origin[1], flag)
+        targets: Dict[int, List[int]] = {}
+        for i, (lat, lon) in enumerate(destinations):
+            targets.setdefault(g.nearest_node(lat, lon, flag), []).append(i)
+        indptr, indices = g.indptr, g.indices
+        edge_len, edge_speed, edge_flags = g.edge_len, g.edge_speed, g.edge_flags
+        best: Dict[int, Tuple[float, float]] = {s: (0.0, 0.0)}
+        heap = [(0.0, 0.0, s)]
+        done = set()
+        left = len(targets)
+        while heap and left:
+            du, mu, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            done.add(u)
+            if u in targets:
+                for i in targets[u]:
+                    durations[i], distances[i] = du, mu
+                left -= 1
+            for i in range(int(indptr[u]), int(indptr[u + 1])):
+                if not edge_flags[i] & flag:
+                    continue
+                v = int(indices[i])
+                length = float(edge_len[i])
+                dv = du + length / (WALK_SPEED_MPS if flag == WALK else float(edge_speed[i]))
+                if dv < best.get(v, (math.inf, 0.0))[0]:
+                    best[v] = (dv, mu + length)
+                    heapq.heappush(heap, (dv, mu + length, v))
+        return durations, distances
+
+    def _edge_tail(self, e: int) -> int:
+        return int(np.searchsorted(self.graph.indptr, e, side="right") - 1)
+
+    def _to_option(self, edges: List[int], mode: str) -> RouteOption:
+        g = self.graph
+        flag = MODE_FLAGS[mode]
+        total_m = 0.0
+        total_s = 0.0
+        # Group consecutive edges on the same street into one instruction
+        groups: List[List] = []  # [name_id, length_m, first_edge, last_edge]
+        for e in edges:
+            length = float(g.edge_len[e])
+            total_m += length
+            total_s += length / (WALK_SPEED_MPS if flag == WALK else float(g.edge_speed[e]))
+            name_id = int(g.edge_name[e])
+            if groups and groups[-1][0] == name_id:
+                groups[-1][1] += length
+                groups[-1][3] = e
+            else:
+                groups.append([name_id, length, e, e])
+
+        steps: List[str] = []
+        prev_bearing = None
+        for name_id, length, first, last in groups:
+            name = g.names[name_id] or ("the path" if flag == WALK else "the road")
+            bearing = self._edge_bearing(first)
+            if prev_bearing is None:
+                action = f"Head {_compass(bearing)} on {name}"
+            else:
+                action = f"{_turn(bearing - prev_bearing)} onto {name}"
+            steps.append(f"{action} for {describe_distance(length)}")
+            prev_bearing = self._edge_bearing(last)
+        steps.append("Arrive at your destination")
+
+        geometry: List[Tuple[float, float]] = []
+        if edges:
+            u = self._edge_tail(edges[0])
+            geometry.append((float(g.node_lat[u]), float(g.node_lon[u])))
+            for e in edges:
+                v = int(g.indices[e])
+                geometry.append((float(g.node_lat[v]), float(g.node_lon[v])))
+        maneuvers = []
+        for _, _, first, _ in groups:
+            u = self._edge_tail(first)
+            maneuvers.append((float(g.node_lat[u]), float(g.node_lon[u])))
+        if geometry:
+            maneuvers.append(geometry[-1])
+
+        named = [gr for gr in groups if g.names[gr[0]]]
+        main_street = g.names[max(named, key=lambda gr: gr[1])[0]] if named else "local streets"
+        return RouteOption(
+            mode=mode,
+            duration_min=max(1, int(math.ceil(total_s / 60.0))) if edges else 0,
+            distance_km=round(total_m / 1000.0, 2),
+            summary=main_street,
+            provider="offline",
+            steps=steps,
+            geometry=geometry,
+            maneuvers=maneuvers if len(maneuvers) == len(steps) else [],
+        )
+
+    def _edge_bearing(self, e: int) -> float:
+        g = self.graph
+        u, v = self._edge_tail(e), int(g.indices[e])
+        return bearing_deg(float(g.node_lat[u]), float(g.node_lon[u]), float(g.node_lat[v]), float(g.node_lon[v]))
+
+
+def _maxspeed_mps(value: str) -> Optional[float]:
+    value = value.strip().lower()
+    try:
+        if value.endswith("mph"):
+            return float(value[:-3]) * 0.44704
+        return float(value.split()[0]) / 3.6
+    except (ValueError, IndexError):
+        return None
+
+
+def _compass(bearing: float) -> str:
+    names = ["north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest"]
+    return names[int((bearing + 22.5) % 360 // 45)]
+
+
+def _turn(delta: float) -> str:
+    delta = (delta + 540.0) % 360.0 - 180.0
+    if abs(delta) < 20:
+        return "Continue"
+    side = "right" if delta > 0 else "left"
+    if abs(delta) < 60:
+        return f"Turn slightly {side}"
+    if abs(delta) < 135:
+        return f"Turn {side}"
+    return f"Make a sharp {side}"
+
+
+def grid_graph(side: int, spacing_m: float = 80.0, lat0: float = 40.0, lon0: float = -74.0) -> OfflineGraph:
+    """Synthetic ``side`` x ``side`` street grid, used by the benchmark."""
+    dlat = spacing_m / 111320.0
+    dlon = dlat / math.cos(math.radians(lat0))
+    rows, cols = np.divmod(np.arange(side * side), side)
+    lat = lat0 + rows * dlat
+    lon = lon0 + cols * dlon
+    src: List[int] = []
+    dst: List[int] = []
+    rng = random.Random(side)
+    names = ["", "Main Street", "Oak Avenue", "Park Road"]
+    name_ids: List[int] = []
+    speeds: List[float] = []
+    for r in range(side):
+        for c in range(side):
+            u = r * side + c
+            for v in ((u + 1) if c + 1 < side else -1, (u + side) if r + 1 < side else -1):
+                if v < 0:
+                    continue
+                name = rng.randrange(len(names))
+                speed = rng.choice((8.0, 11.0, 14.0))
+                src += [u, v]
+                dst += [v, u]
+                name_ids += [name, name]
+                speeds += [speed, speed]
+    flags = [WALK | DRIVE] * len(src)
+    return OfflineGraph.from_edges(lat, lon, src, dst, flags, speeds, name_ids, names)
+
+
+def benchmark(sides: Sequence[int] = (50, 100, 200, 400), queries: int = 50, seed: int = 0) -> List[Dict[str, float]]:
+    """Time random walking queries on synthetic grids of increasing size."""
+    rng = random.Random(seed)
+    results = []
+    for side in sides:
+        router = OfflineRouter(grid_graph(side))
+        n = router.graph.num_nodes
+        timings = []
+        for _ in range(queries):
+            s, t = rng.randrange(n), rng.randrange(n)
+            start = time.perf_counter()
+            router.shortest_path(s, t, "walking")
+            timings.append((time.perf_counter() - start) * 1000.0)
+        timings.sort()
+        results.append({
+            "nodes": n,
+            "edges": router.graph.num_edges,
+            "mean_ms": round(sum(timings) / len(timings), 2),
+            "p50_ms": round(timings[len(timings) // 2], 2),
+            "p99_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))], 2),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    # python offline_router.py build extract.osm out_dir
+    # python offline_router.py bench
+    if len(sys.argv) >= 4 and sys.argv[1] == "build":
+        OfflineGraph.from_osm(sys.argv[2]).save(sys.argv[3])
+    elif len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        for row in benchmark():
+            print(json.dumps(row))
+    else:
+        print("usage: offline_router.py build <extract.osm> <out_dir> | bench")
@@ -0,0 +1,337 @@
+from __future__ import annotations
+import hashlib
+import io
+import os
+import re
+import sys
+import threading
+import time
+import wave
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional
+
+from startup import lazy_import
+
+simpleaudio = lazy_import("simpleaudio")  # optional, cross-platform PCM playback
+
+# Phrases the guidance loop says over and over
+COMMON_PHRASES = (
+    "Obstacle ahead. Please wait. I will let you know when it's safe to continue.",
+    "It should be clear now. You can proceed.",
+    "One minute remaining.",
+    "minutes remaining.",
+    "Say start when you are ready to begin, or say go.",
+    "Starting now. Stay safe and follow the instructions.",
+    "You have arrived at your destination.",
+    "person ahead",
+    "bicycle ahead",
+    "car ahead",
+    "car approaching",
+    "bus ahead",
+    "truck ahead",
+    "motorcycle ahead",
+)
+
+# Decimals and clock times stay whole: "1.5" and "14:05" must not be read digit group by digit group
+_NUMBER = re.compile(r"(\d+(?:[.:]\d+)?)")
+_WORD = re.compile(r"\w")
+_GAP_SEC = 0.04
+
+
+@dataclass
+class AudioClip:
+    pcm: bytes
+    rate: int
+    width: int  # bytes per sample
+    channels: int
+
+    @property
+    def duration_sec(self) -> float:
+        return len(self.pcm) / float(self.rate * self.width * self.channels)
+
+    def to_wav(self) -> bytes:
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wf:
+            wf.setnchannels(self.channels)
+            wf.setsampwidth(self.width)
+            wf.setframerate(self.rate)
+            wf.writeframes(self.pcm)
+        return buf.getvalue()
+
+    @classmethod
+    def from_wav(cls, path: str) -> "AudioClip":
+        with wave.open(path, "rb") as wf:
+            return cls(wf.readframes(wf.getnframes()), wf.getframerate(), wf.getsampwidth(), wf.getnchannels())
+
+
+def fragments(text: str) -> List[str]:
+    """Split a phrase at its numbers so "12 minutes remaining." reuses "12" and "minutes remaining."."""
+    # Bare punctuation left between numbers is never rendered on its own
+    return [p.strip() for p in _NUMBER.split(text) if _WORD.search(p)]
+
+
+def stitch(clips: List[AudioClip], gap_sec: float = _GAP_SEC) -> Optional[AudioClip]:
+    if not clips:
+        return None
+    first = clips[0]
+    if any((c.rate, c.width, c.channels) != (first.rate, first.width, first.channels) for c in clips):
+        return None
+    gap = b"\x00" * (int(gap_sec * first.rate) * first.width * first.channels)
+    return AudioClip(gap.join(c.pcm for c in clips), first.rate, first.width, first.channels)
+
+
+class PhraseCache:
+    """Rendered phrase audio, kept in a byte-bounded LRU in memory and as WAV files on disk.
+
+    ``lookup`` never synthesizes: it returns a cached clip (stitching numbered
+    phrases from their fragments) or None and remembers what was missing.
+    ``render_next`` then renders one missing fragment at a time, so the
+    speech worker can fill the cache when it is otherwise idle.
+    """
+
+    def __init__(
+        self,
+        render: Optional[Callable[[str, str], None]],
+        cache_dir: str,
+        voice_id: Optional[str] = None,
+        max_memory_bytes: int = 8 * 1024 * 1024,
+        max_disk_bytes: int = 64 * 1024 * 1024,
+    ):
+        # render(text, wav_path) synthesizes text into a WAV file; None for a read-only cache
+        self._render = render
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory: "OrderedDict[str, AudioClip]" = OrderedDict()
+        self._memory_bytes = 0
+        self._wanted: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        if voice_id is not None:
+            self._check_voice(voice_id)
+
+    def _check_voice(self, voice_id: str):
+        # Audio rendered with another voice or rate is useless; start over
+        marker = os.path.join(self.cache_dir, "voice.txt")
+        try:
+            with open(marker, "r", encoding="utf-8") as fh:
+                if fh.read() == voice_id:
+                    return
+        except OSError:
+            pass
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".wav"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+        with open(marker, "w", encoding="utf-8") as fh:
+            fh.write(voice_id)
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _path(self, text: str) -> str:
+        return os.path.join(self.cache_dir, self._key(text) + ".wav")
+
+    def lookup(self, text: str) -> Optional[AudioClip]:
+        parts = fragments(text)
+        clips = [self._get(p) for p in parts]
+        missing = [p for p, c in zip(parts, clips) if c is None]
+        with self._lock:
+            if missing or not clips:
+                self.misses += 1
+                if self._render is not None:
+                    for p in missing:
+                        self._wanted[p] = None
+                return None
+            self.hits += 1
+        return clips[0] if len(clips) == 1 else stitch(clips)
+
+    def want(self, phrases: Iterable[str]):
+        """Queue phrases (and their fragments) for background rendering."""
+        with self._lock:
+            for text in phrases:
+                for p in fragments(text):
+                    self._wanted[p] = None
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._wanted)
+
+    def render_next(self) -> bool:
+        """Render one wanted fragment; returns True if more are waiting."""
+        with self._lock:
+            if not self._wanted:
+                return False
+            text, _ = self._wanted.popitem(last=False)
+        if self._render is not None and self._get(text) is None:
+            self.render(text)
+        with self._lock:
+            return bool(self._wanted)
+
+    def render(self, text: str) -> Optional[AudioClip]:
+        path = self._path(text)
+        tmp = path + ".tmp"
+        try:
+            self._render(text, tmp)
+            clip = AudioClip.from_wav(tmp)
+            os.replace(tmp, path)
+        except Exception:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return None
+        self._remember(text, clip)
+        self._trim_disk()
+        return clip
+
+    def _get(self, text: str) -> Optional[AudioClip]:
+        with self._lock:
+            clip = self._memory.get(text)
+            if clip is not None:
+                self._memory.move_to_end(text)
+                return clip
+        path = self._path(text)
+        try:
+            clip = AudioClip.from_wav(path)
+            os.utime(path, None)  # mtime doubles as the disk LRU clock
+        except Exception:
+            return None
+        self._remember(text, clip)
+        return clip
+
+    def _remember(self, text: str, clip: AudioClip):
+        with self._lock:
+            old = self._memory.pop(text, None)
+            if old is not None:
+                self._memory_bytes -= len(old.pcm)
+            self._memory[text] = clip
+            self._memory_bytes += len(clip.pcm)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted.pcm)
+
+    def _trim_disk(self):
+        try:
+            entries = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith(".wav")]
+            stats = sorted(((os.path.getmtime(p), os.path.getsize(p), p) for p in entries))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "pending_renders": len(self._wanted),
+            }
+
+
+class PcmPlayer:
+    """Plays clips straight from memory: simpleaudio where installed, else winsound on Windows."""
+
+    def __init__(self):
+        self._winsound = None
+        if not simpleaudio.available and sys.platform == "win32":
+            try:
+                import winsound
+
+                self._winsound = winsound
+            except Exception:
+                self._winsound = None
+
+    @property
+    def available(self) -> bool:
+        return simpleaudio.available or self._winsound is not None
+
+    def play(self, clip: AudioClip, interrupted: Optional[threading.Event] = None, on_start: Optional[Callable[[], None]] = None) -> bool:
+        """Play ``clip`` to the end; returns False if ``interrupted`` cut it short."""
+        if simpleaudio.available:
+            handle = simpleaudio.play_buffer(clip.pcm, clip.channels, clip.width, clip.rate)
+            if on_start:
+                on_start()
+            while handle.is_playing():
+                if interrupted is not None and interrupted.is_set():
+                    handle.stop()
+                    return False
+                time.sleep(0.02)
+            return True
+        ws = self._winsound
+        ws.PlaySound(clip.to_wav(), ws.SND_MEMORY | ws.SND_ASYNC)
+        if on_start:
+            on_start()
+        end = time.perf_counter() + clip.duration_sec
+        while time.perf_counter() < end:
+            if interrupted is not None and interrupted.is_set():
+                ws.PlaySound(None, ws.SND_PURGE)
+                return False
+            time.sleep(0.02)
+        return True
+
+
+def bench(phrases: Iterable[str], cache_dir: str, repeats: int = 3):
+    """Time-to-first-audio for live pyttsx3 synthesis vs. playback from the phrase cache."""
+    import pyttsx3
+
+    engine = pyttsx3.init()
+    started = [0.0]
+    engine.connect("started-utterance", lambda name: started.__setitem__(0, time.perf_counter()))
+
+    def render(text: str, path: str):
+        engine.save_to_file(text, path)
+        engine.runAndWait()
+
+    cache = PhraseCache(render, cache_dir, voice_id=f"{engine.getProperty('voice')}|{engine.getProperty('rate')}")
+    player = PcmPlayer()
+    rows = []
+    for text in phrases:
+        live, cached = [], []
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            engine.say(text)
+            engine.runAndWait()
+            live.append(started[0] - t0)
+        cache.want([text])
+        while cache.render_next():
+            pass
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            clip = cache.lookup(text)
+            first = [t0]
+            if clip is not None and player.available:
+                player.play(clip, on_start=lambda: first.__setitem__(0, time.perf_counter()))
+            cached.append(first[0] - t0)
+        rows.append({
+            "phrase": text,
+            "live_ms": round(1000 * min(live), 1),
+            "cached_ms": round(1000 * min(cached), 1) if player.available else None,
+        })
+    return rows
+
+
+if __name__ == "__main__":
+    # python phrase_cache.py bench [cache_dir]
+    if len(sys.argv) >= 2 and sys.argv[1] == "bench":
+        import json
+
+        sample = list(COMMON_PHRASES[:4]) + ["12 minutes remaining.", "Turn left onto Main Street"]
+        print(json.dumps(bench(sample, sys.argv[2] if len(sys.argv) > 2 else os.path.join(".cache", "phrases")), indent=2))
+        sys.exit(0)
+    print("usage: phrase_cache.py bench [cache_dir]")
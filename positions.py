@@ -0,0 +1,164 @@
+from __future__ import annotations
+import os
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from utils import parse_latlon
+
+_KNOTS_TO_MPS = 0.514444
+# Rough horizontal error per unit of HDOP for consumer GPS
+_HDOP_TO_M = 5.0
+
+
+@dataclass
+class Fix:
+    lat: float
+    lon: float
+    timestamp: float
+    speed_mps: Optional[float] = None
+    accuracy_m: Optional[float] = None
+
+
+def replay_csv(path: str, interval_sec: float = 1.0, realtime: bool = True) -> Iterator[Fix]:
+    """Replay a recorded track with one "lat,lon" per line as a position feed."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            latlon = parse_latlon(line.strip())
+            if latlon is None:
+                continue
+            yield Fix(latlon[0], latlon[1], time.time())
+            if realtime:
+                time.sleep(interval_sec)
+
+
+def parse_nmea(lines: Iterable[str]) -> Iterator[Fix]:
+    """Fixes from NMEA 0183 sentences: one per valid RMC, or per GGA if the log has no RMC.
+
+    Sentences with a bad checksum are skipped. HDOP from GGA becomes the
+    accuracy of the following RMC fix.
+    """
+    seen_rmc = False
+    pending: Optional[Fix] = None  # a GGA fix, dropped if an RMC turns up
+    hdop: Optional[float] = None
+    day: Optional[str] = None
+    for line in lines:
+        line = line.strip()
+        if not line.startswith("$") or not _checksum_ok(line):
+            continue
+        fields = line.split("*")[0].split(",")
+        kind = fields[0][3:]
+        try:
+            if kind == "RMC" and len(fields) >= 10:
+                seen_rmc = True
+                pending = None
+                if fields[2] != "A":
+                    continue
+                day = fields[9] or day
+                speed = float(fields[7]) * _KNOTS_TO_MPS if fields[7] else None
+                yield Fix(
+                    _nmea_coord(fields[3], fields[4]),
+                    _nmea_coord(fields[5], fields[6]),
+                    _nmea_time(fields[1], day),
+                    speed,
+                    hdop * _HDOP_TO_M if hdop is not None else None,
+                )
+            elif kind == "GGA" and len(fields) >= 9:
+                if fields[6] in ("", "0"):
+                    continue
+                hdop = float(fields[8]) if fields[8] else None
+                if not seen_rmc:
+                    if pending is not None:
+                        yield pending
+                    pending = Fix(
+                        _nmea_coord(fields[2], fields[3]),
+                        _nmea_coord(fields[4], fields[5]),
+                        _nmea_time(fields[1], day),
+                        None,
+                        hdop * _HDOP_TO_M if hdop is not None else None,
+                    )
+        except ValueError:
+            continue
+    if pending is not None:
+        yield pending
+
+
+def _checksum_ok(sentence: str) -> bool:
+    if "*" not in sentence:
+        return True
+    body, _, given = sentence[1:].partition("*")
+    value = 0
+    for ch in body:
+        value ^= ord(ch)
+    try:
+        return value == int(given[:2], 16)
+    except ValueError:
+        return False
+
+
+def _nmea_coord(value: str, hemisphere: str) -> float:
+    # ddmm.mmmm / dddmm.mmmm
+    dot = value.index(".") if "." in value else len(value)
+    degrees = float(value[: dot - 2])
+    minutes = float(value[dot - 2 :])
+    coord = degrees + minutes / 60.0
+    return -coord if hemisphere in ("S", "W") else coord
+
+
+def _nmea_time(hhmmss: str, ddmmyy: Optional[str]) -> float:
+    if ddmmyy:
+        base = datetime.strptime(ddmmyy, "%d%m%y").replace(tzinfo=timezone.utc)
+    else:
+        base = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    seconds = int(hhmmss[0:2]) * 3600 + int(hhmmss[2:4]) * 60 + float(hhmmss[4:])
+    return base.timestamp() + seconds
+
+
+def parse_gpx(path: str) -> Iterator[Fix]:
+    """Track points (or route points) from a GPX file, streamed so long recordings stay cheap."""
+    for _, elem in ET.iterparse(path, events=("end",)):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if tag not in ("trkpt", "rtept"):
+            continue
+        try:
+            lat, lon = float(elem.get("lat")), float(elem.get("lon"))
+        except (TypeError, ValueError):
+            elem.clear()
+            continue
+        stamp = None
+        for child in elem:
+            if child.tag.rsplit("}", 1)[-1] == "time" and child.text:
+                try:
+                    stamp = datetime.fromisoformat(child.text.strip().replace("Z", "+00:00")).timestamp()
+                except ValueError:
+                    pass
+        elem.clear()
+        yield Fix(lat, lon, stamp if stamp is not None else time.time())
+
+
+def paced(fixes: Iterable[Fix], realtime: bool = True, speedup: float = 1.0, interval_sec: float = 1.0) -> Iterator[Fix]:
+    """Yield recorded fixes at their original pace (divided by ``speedup``)."""
+    previous: Optional[float] = None
+    for fix in fixes:
+        if realtime and previous is not None:
+            gap = fix.timestamp - previous
+            time.sleep(max(0.0, (gap if 0 < gap < 60 else interval_sec) / speedup))
+        previous = fix.timestamp
+        yield fix
+
+
+def replay_track(path: str, realtime: bool = True, speedup: float = 1.0) -> Iterator[Fix]:
+    """Replay a .gpx, .nmea/.log or "lat,lon" text file as a position feed."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".gpx":
+        return paced(parse_gpx(path), realtime, speedup)
+    if ext in (".nmea", ".log"):
+        return paced(_nmea_file(path), realtime, speedup)
+    return replay_csv(path, interval_sec=1.0 / speedup, realtime=realtime)
+
+
+def _nmea_file(path: str) -> Iterator[Fix]:
+    with open(path, encoding="ascii", errors="ignore") as f:
+        yield from parse_nmea(f)
@@ -0,0 +1,209 @@
+from __future__ import annotations
+import bisect
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+if TYPE_CHECKING:
+    from routing import RouteOption, RouteResult
+
+# A provider answers with its routes, either bare or wrapped with the modes it missed
+Answer = Union[List["RouteOption"], "RouteResult"]
+# Called as fn(origin, destination, *args) with any extra arguments given to call()
+ProviderFn = Callable[..., Answer]
+
+# Upper bounds (seconds) of the latency buckets; the last bucket is open-ended
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.total += seconds
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the ``p`` quantile (0..1), or None with no samples."""
+        with self._lock:
+            if not self.count:
+                return None
+            target = p * self.count
+            running = 0
+            for i, c in enumerate(self.counts):
+                running += c
+                if running >= target and c:
+                    return self.buckets[i] if i < len(self.buckets) else float("inf")
+            return float("inf")
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {"buckets": list(self.buckets), "counts": list(self.counts), "count": self.count, "sum": self.total}
+
+
+class CircuitBreaker:
+    """Stops calling a provider after ``failure_threshold`` consecutive failures.
+
+    After ``reset_after_sec`` one trial call is let through (half-open); its
+    outcome closes the breaker again or re-opens it for another period.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_after_sec: float = 30.0, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_after_sec = reset_after_sec
+        self._clock = clock
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._clock() - self._opened_at >= self.reset_after_sec:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+
+class ProviderOrchestrator:
+    """Calls routing providers in priority order with hedging.
+
+    The first provider whose breaker is closed gets the request. If it has not
+    answered by its own ``hedge_percentile`` latency, the next provider is asked
+    too and whichever returns routes first wins. Exceptions count against a
+    provider's breaker; an empty answer ("no route for this input") does not.
+    """
+
+    def __init__(
+        self,
+        providers: Sequence[Tuple[str, ProviderFn]],
+        hedge_percentile: float = 0.9,
+        hedge_after_sec: float = 1.5,
+        min_hedge_sec: float = 0.05,
+        min_samples: int = 5,
+        deadline_sec: float = 12.0,
+        failure_threshold: int = 3,
+        reset_after_sec: float = 30.0,
+    ):
+        self.providers = list(providers)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_after_sec = hedge_after_sec
+        self.min_hedge_sec = min_hedge_sec
+        self.min_samples = min_samples
+        self.deadline_sec = deadline_sec
+        self.breakers = {name: CircuitBreaker(failure_threshold, reset_after_sec) for name, _ in self.providers}
+        self.histograms = {name: LatencyHistogram() for name, _ in self.providers}
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._executor = ThreadPoolExecutor(max_workers=max(2, len(self.providers) * 2), thread_name_prefix="provider")
+
+    def hedge_delay(self, name: str) -> float:
+        hist = self.histograms[name]
+        if hist.count < self.min_samples:
+            return self.hedge_after_sec
+        p = hist.percentile(self.hedge_percentile) or self.hedge_after_sec
+        return max(self.min_hedge_sec, min(p, self.deadline_sec))
+
+    def call(self, origin: str, destination: str, *args) -> Tuple[Optional[str], Answer]:
+        """Return ``(provider_name, routes)`` from the first provider to answer, or ``(None, [])``."""
+        deadline = time.monotonic() + self.deadline_sec
+        queue = list(self.providers)
+        pending: Dict[Future, str] = {}
+        primary_name: Optional[str] = None
+
+        def _launch() -> Optional[str]:
+            while queue:
+                name, fn = queue.pop(0)
+                if self.breakers[name].allow():
+                    pending[self._executor.submit(self._timed, name, fn, origin, destination, *args)] = name
+                    return name
+            return None
+
+        primary_name = _launch()
+        hedged = False
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            timeout = remaining
+            if not hedged and primary_name is not None and queue:
+                timeout = min(remaining, self.hedge_delay(primary_name))
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                if not hedged and _launch() is not None:
+                    hedged = True
+                    self.hedges += 1
+                continue
+            for f in done:
+                name = pending.pop(f)
+                options = f.result()
+                if options:
+                    if hedged and name != primary_name:
+                        self.hedge_wins += 1
+                    return name, options
+            # Everything in flight failed or came back empty: move down the list
+            if not pending:
+                primary_name = _launch()
+        return None, []
+
+    def _timed(self, name: str, fn: ProviderFn, origin: str, destination: str, *args) -> Answer:
+        start = time.perf_counter()
+        try:
+            options = fn(origin, destination, *args)
+        except Exception:
+            self.histograms[name].observe(time.perf_counter() - start)
+            self.breakers[name].record_failure()
+            return []
+        self.histograms[name].observe(time.perf_counter() - start)
+        self.breakers[name].record_success()
+        return options
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        out: Dict[str, Dict[str, object]] = {}
+        for name, _ in self.providers:
+            hist = self.histograms[name]
+            out[name] = {
+                "state": self.breakers[name].state,
+                "p50_sec": hist.percentile(0.5),
+                "p90_sec": hist.percentile(0.9),
+                "p99_sec": hist.percentile(0.99),
+                "histogram": hist.snapshot(),
+            }
+        out["_hedging"] = {"hedges": self.hedges, "hedge_wins": self.hedge_wins}
+        return out
@@ -0,0 +1,198 @@
+from __future__ import annotations
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+# Seconds a cached route stays fresh, by provider. Live traffic-aware providers
+# go stale quickly; the offline engine only changes when the graph is rebuilt.
+DEFAULT_TTLS: Dict[str, float] = {
+    "google": 15 * 60,
+    "ors": 30 * 60,
+    "offline": 24 * 3600,
+}
+
+
+@dataclass
+class CacheEntry:
+    payload: List[Dict[str, Any]]
+    provider: str
+    created: float
+    stale: bool = False
+
+
+def normalize_place(place: str) -> str:
+    s = re.sub(r"\s+", " ", place.strip().lower())
+    # "lat,lon" pairs are rounded to ~1 m so GPS jitter does not defeat the cache
+    m = re.fullmatch(r"(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)", s)
+    if m:
+        return f"{float(m.group(1)):.5f},{float(m.group(2)):.5f}"
+    return s
+
+
+def make_key(origin: str, destination: str, mode: str) -> str:
+    return f"{normalize_place(origin)}|{normalize_place(destination)}|{mode.strip().lower()}"
+
+
+class RouteCache:
+    """Two-tier route cache: an in-memory LRU in front of a SQLite file.
+
+    Entries older than their provider TTL are still served for ``stale_sec``
+    more seconds while a background refresh runs (stale-while-revalidate).
+    """
+
+    def __init__(
+        self,
+        path: str = "",
+        max_entries: int = 256,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl_sec: float = 15 * 60,
+        stale_sec: float = 24 * 3600,
+        max_disk_entries: int = 10000,
+    ):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.default_ttl_sec = default_ttl_sec
+        self.stale_sec = stale_sec
+        self.max_disk_entries = max_disk_entries
+        self._mem: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refreshing: set = set()
+        self._stats = {"hits": 0, "stale_hits": 0, "misses": 0, "disk_hits": 0, "evictions": 0, "refreshes": 0}
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                self._db = sqlite3.connect(path, check_same_thread=False)
+                self._db.execute(
+                    "CREATE TABLE IF NOT EXISTS routes (key TEXT PRIMARY KEY, provider TEXT, created REAL, payload TEXT)"
+                )
+                self._db.execute("CREATE INDEX IF NOT EXISTS routes_created ON routes (created)")
+                self._db.commit()
+            except Exception:
+                self._db = None
+
+    def ttl_for(self, provider: str) -> float:
+        return self.ttls.get(provider, self.default_ttl_sec)
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                self._mem.move_to_end(key)
+            else:
+                entry = self._disk_get(key)
+                if entry is not None:
+                    self._stats["disk_hits"] += 1
+                    self._mem_put(key, entry)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            age = now - entry.created
+            ttl = self.ttl_for(entry.provider)
+            if age >= ttl + self.stale_sec:
+                self._stats["misses"] += 1
+                return None
+            stale = age >= ttl
+            self._stats["stale_hits" if stale else "hits"] += 1
+            # Hand out a copy so callers can't mutate what is cached
+            return CacheEntry(payload=json.loads(json.dumps(entry.payload)), provider=entry.provider, created=entry.created, stale=stale)
+
+    def put(self, key: str, payload: List[Dict[str, Any]], provider: str, created: Optional[float] = None):
+        entry = CacheEntry(payload=json.loads(json.dumps(payload)), provider=provider, created=created or time.time())
+        with self._lock:
+            self._mem_put(key, entry)
+            self._disk_put(key, entry)
+
+    def refresh_async(self, key: str, loader: Callable[[], None]):
+        """Run ``loader`` in the background unless a refresh for ``key`` is already in flight."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self._stats["refreshes"] += 1
+
+        def _run():
+            try:
+                loader()
+            except Exception:
+                pass
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=_run, daemon=True).start()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = len(self._mem)
+            return out
+
+    def clear(self):
+        with self._lock:
+            self._mem.clear()
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM routes")
+                    self._db.commit()
+                except Exception:
+                    pass
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                try:
+                    self._db.close()
+                except Exception:
+                    pass
+                self._db = None
+
+    # Callers hold self._lock for the helpers below
+
+    def _mem_put(self, key: str, entry: CacheEntry):
+        self._mem[key] = entry
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.max_entries:
+            self._mem.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def _disk_get(self, key: str) -> Optional[CacheEntry]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute("SELECT provider, created, payload FROM routes WHERE key = ?", (key,)).fetchone()
+        except Exception:
+            return None
+        if not row:
+            return None
+        try:
+            return CacheEntry(payload=json.loads(row[2]), provider=row[0], created=row[1])
+        except Exception:
+            return None
+
+    def _disk_put(self, key: str, entry: CacheEntry):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO routes (key, provider, created, payload) VALUES (?, ?, ?, ?)",
+                (key, entry.provider, entry.created, json.dumps(entry.payload)),
+            )
+            count = self._db.execute("SELECT COUNT(*) FROM routes").fetchone()[0]
+            if count > self.max_disk_entries:
+                self._db.execute(
+                    "DELETE FROM routes WHERE key IN (SELECT key FROM routes ORDER BY created ASC LIMIT ?)",
+                    (count - self.max_disk_entries,),
+                )
+            self._db.commit()
+        except Exception:
+            pass
@@ -0,0 +1,194 @@
+from __future__ import annotations
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence
+from urllib.parse import parse_qs, urlparse
+
+from providers import ProviderOrchestrator
+from route_cache import RouteCache, make_key
+from routing import Router, RouteOption
+
+
+class StubDirectionsServer:
+    """Local stand-in for the Google Directions API with per-mode latency.
+
+    ``delays`` maps a travel mode to the seconds each request for it sleeps
+    before answering; modes in ``failing`` answer 500. Both can be changed
+    while the server runs. Point ``Router(google_url=...)`` at ``url``.
+    """
+
+    def __init__(self, delays: Optional[Dict[str, float]] = None, host: str = "127.0.0.1", port: int = 0):
+        self.delays: Dict[str, float] = dict(delays or {})
+        self.failing: set = set()
+        self.requests: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        stub = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                mode = parse_qs(urlparse(self.path).query).get("mode", ["walking"])[0]
+                with stub._lock:
+                    stub.requests[mode] = stub.requests.get(mode, 0) + 1
+                time.sleep(stub.delays.get(mode, 0.0))
+                if mode in stub.failing:
+                    self.send_error(500)
+                    return
+                body = json.dumps(_directions_body(mode)).encode("utf-8")
+                try:
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # the client gave up on a slow mode
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self) -> "StubDirectionsServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="route-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "StubDirectionsServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def _directions_body(mode: str) -> dict:
+    minutes = {"walking": 25, "driving": 8, "transit": 15}.get(mode, 20)
+    return {
+        "status": "OK",
+        "routes": [
+            {
+                "summary": f"Stub {mode} route",
+                "legs": [
+                    {
+                        "duration": {"value": minutes * 60},
+                        "distance": {"value": 2000},
+                        "steps": [{"html_instructions": "Head <b>north</b>", "start_location": {"lat": 0.0, "lng": 0.0}}],
+                    }
+                ],
+                "overview_polyline": {"points": ""},
+            }
+        ],
+    }
+
+
+class FakeProvider:
+    """Provider callable for ``ProviderOrchestrator`` with scripted latency and failures."""
+
+    def __init__(self, name: str, delay_sec: float = 0.0, fail: bool = False, modes: Sequence[str] = ("walking", "driving")):
+        self.name = name
+        self.delay_sec = delay_sec
+        self.fail = fail
+        self.modes = tuple(modes)
+        self.calls = 0
+
+    def __call__(self, origin: str, destination: str, modes: Sequence[str] = Router.MODES) -> List[RouteOption]:
+        self.calls += 1
+        time.sleep(self.delay_sec)
+        if self.fail:
+            raise RuntimeError(f"{self.name} is down")
+        return [RouteOption(m, 10, 1.0, f"{self.name} {m}", self.name, ["Go"]) for m in modes if m in self.modes]
+
+
+def stub_check() -> List[str]:
+    """Pass/fail checks of hedging, circuit breaking and per-mode timeouts; returns the failures."""
+    failures: List[str] = []
+
+    # A mode slower than the deadline is reported as timed out; the others still arrive in time
+    with StubDirectionsServer({"transit": 1.5}) as stub:
+        router = Router(False, google_key="stub", google_url=stub.url, deadline_sec=0.4)
+        start = time.perf_counter()
+        result = router.lookup("a", "b")
+        elapsed = time.perf_counter() - start
+        if [o.mode for o in result.options] != ["walking", "driving"] or result.missing_modes != {"transit": "timeout"}:
+            failures.append(f"slow transit: got {[o.mode for o in result.options]} missing {result.missing_modes}")
+        if elapsed > 1.0:
+            failures.append(f"slow transit held the lookup for {elapsed:.2f} s, deadline 0.4 s")
+        stub.failing.add("driving")
+        result = router.lookup("a", "b")
+        if result.missing_modes.get("driving") != "error":
+            failures.append(f"failing driving mode reported as {result.missing_modes}")
+
+    # A slow primary is hedged and the backup's answer wins, but is not cached
+    slow, backup = FakeProvider("slow", delay_sec=0.6), FakeProvider("backup")
+    orch = ProviderOrchestrator([("slow", slow), ("backup", backup)], hedge_after_sec=0.05)
+    cache = RouteCache()
+    router = Router(False, google_key="stub", cache=cache, orchestrator=orch)
+    result = router.lookup("a", "b")
+    if result.provider != "backup" or orch.hedge_wins != 1:
+        failures.append(f"hedge: answer from {result.provider!r}, {orch.hedge_wins} hedge wins")
+    if cache.get(make_key("a", "b", "walking")) is not None:
+        failures.append("a hedge winner's answer was cached")
+
+    # Consecutive failures open the breaker; after the reset period one trial closes it again
+    down, backup = FakeProvider("down", fail=True), FakeProvider("backup")
+    orch = ProviderOrchestrator([("down", down), ("backup", backup)], failure_threshold=2, reset_after_sec=0.3)
+    for _ in range(2):
+        orch.call("a", "b")
+    if orch.breakers["down"].state != "open":
+        failures.append(f"breaker is {orch.breakers['down'].state} after 2 failures, expected open")
+    name, _ = orch.call("a", "b")
+    if down.calls != 2 or name != "backup":
+        failures.append(f"open breaker still let a call through ({down.calls} calls, answer from {name!r})")
+    time.sleep(0.35)
+    if orch.breakers["down"].state != "half_open":
+        failures.append(f"breaker is {orch.breakers['down'].state} after the reset period, expected half_open")
+    down.fail = False
+    name, _ = orch.call("a", "b")
+    if name != "down" or orch.breakers["down"].state != "closed":
+        failures.append(f"half-open trial: answer from {name!r}, breaker {orch.breakers['down'].state}")
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Local routing stubs: a slow Directions server and fake providers")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    sub.add_parser("check", help="pass/fail test of hedging, breakers and per-mode timeouts; exits 1 on failure")
+    serve = sub.add_parser("serve", help="run the stub Directions server until interrupted")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--delay", action="append", default=[], metavar="MODE=SEC", help="latency for one mode, e.g. transit=3")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "check":
+        failures = stub_check()
+        for failure in failures:
+            sys.stdout.write(f"FAIL: {failure}\n")
+        sys.stdout.write("ok\n" if not failures else "")
+        return 1 if failures else 0
+
+    delays = {mode: float(sec) for mode, sec in (d.split("=", 1) for d in args.delay)}
+    with StubDirectionsServer(delays, port=args.port) as stub:
+        sys.stdout.write(f"stub Directions API at {stub.url}\n")
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
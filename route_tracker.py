@@ -0,0 +1,378 @@
+from __future__ import annotations
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from dataclasses import dataclass, replace
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from positions import Fix
+from routing import RouteOption
+from utils import minutes_to_eta_str
+
+RouteFn = Callable[[Tuple[float, float], Tuple[float, float], str], Optional[RouteOption]]
+
+_M_PER_DEG = 111320.0
+_LEAF_SIZE = 8
+# Segments checked around the last match before falling back to the full index
+_WINDOW_BACK = 1
+_WINDOW_AHEAD = 4
+
+
+class LocalProjection:
+    """Equirectangular projection to meters around a reference point; fine over a city."""
+
+    def __init__(self, lat0: float, lon0: float):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.kx = _M_PER_DEG * math.cos(math.radians(lat0))
+
+    def to_xy(self, lat: float, lon: float) -> Tuple[float, float]:
+        return (lon - self.lon0) * self.kx, (lat - self.lat0) * _M_PER_DEG
+
+    def to_latlon(self, x: float, y: float) -> Tuple[float, float]:
+        return self.lat0 + y / _M_PER_DEG, self.lon0 + x / self.kx
+
+
+class SegmentIndex:
+    """Bounding-volume hierarchy over polyline segments.
+
+    ``within`` visits only the nodes whose boxes come within the search radius,
+    so a query against an n-segment route costs O(log n) plus the hits.
+    """
+
+    def __init__(self, points: Sequence[Tuple[float, float]]):
+        self.points = list(points)
+        n = max(0, len(self.points) - 1)
+        # node: [minx, miny, maxx, maxy, left, right, lo, hi]; leaves have left == -1
+        self._nodes: List[list] = []
+        self._order = list(range(n))
+        if n:
+            self._build(0, n)
+
+    def _bbox(self, seg: int) -> Tuple[float, float, float, float]:
+        (x1, y1), (x2, y2) = self.points[seg], self.points[seg + 1]
+        return min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)
+
+    def _build(self, lo: int, hi: int) -> int:
+        boxes = [self._bbox(s) for s in self._order[lo:hi]]
+        node = [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes), -1, -1, lo, hi]
+        idx = len(self._nodes)
+        self._nodes.append(node)
+        if hi - lo > _LEAF_SIZE:
+            axis = 0 if node[2] - node[0] >= node[3] - node[1] else 1
+            self._order[lo:hi] = sorted(self._order[lo:hi], key=lambda s: self._bbox(s)[axis] + self._bbox(s)[axis + 2])
+            mid = (lo + hi) // 2
+            node[4] = self._build(lo, mid)
+            node[5] = self._build(mid, hi)
+        return idx
+
+    def within(self, x: float, y: float, radius: float) -> List[Tuple[float, int, float]]:
+        """Segments within ``radius`` of (x, y) as (distance, segment, fraction along segment)."""
+        out: List[Tuple[float, int, float]] = []
+        if not self._nodes:
+            return out
+        stack = [0]
+        while stack:
+            minx, miny, maxx, maxy, left, right, lo, hi = self._nodes[stack.pop()]
+            dx = max(minx - x, 0.0, x - maxx)
+            dy = max(miny - y, 0.0, y - maxy)
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            if left >= 0:
+                stack.append(left)
+                stack.append(right)
+                continue
+            for seg in self._order[lo:hi]:
+                d, t = self._distance(seg, x, y)
+                if d <= radius:
+                    out.append((d, seg, t))
+        return out
+
+    def _distance(self, seg: int, x: float, y: float) -> Tuple[float, float]:
+        (x1, y1), (x2, y2) = self.points[seg], self.points[seg + 1]
+        vx, vy = x2 - x1, y2 - y1
+        denom = vx * vx + vy * vy
+        t = 0.0 if denom == 0 else max(0.0, min(1.0, ((x - x1) * vx + (y - y1) * vy) / denom))
+        return math.hypot(x - (x1 + t * vx), y - (y1 + t * vy)), t
+
+
+class ManeuverIndex:
+    """Uniform grid over maneuver points.
+
+    ``near`` only looks at the 3x3 cells around the query, so with radius up
+    to ``cell_m`` a lookup costs O(1) however long the route is.
+    """
+
+    def __init__(self, points: Sequence[Tuple[float, float]], cell_m: float):
+        self.points = list(points)
+        self.cell_m = cell_m
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for i, (x, y) in enumerate(self.points):
+            self._cells.setdefault(self._cell(x, y), []).append(i)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return int(math.floor(x / self.cell_m)), int(math.floor(y / self.cell_m))
+
+    def near(self, x: float, y: float, radius: float) -> List[Tuple[float, int]]:
+        """Points within ``radius`` (at most ``cell_m``) of (x, y) as (distance, index)."""
+        cx, cy = self._cell(x, y)
+        out: List[Tuple[float, int]] = []
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for i in self._cells.get((gx, gy), ()):
+                    px, py = self.points[i]
+                    d = math.hypot(px - x, py - y)
+                    if d <= radius:
+                        out.append((d, i))
+        return out
+
+
+@dataclass
+class TrackState:
+    on_route: bool
+    deviated: bool  # True only on the fix that confirms a deviation
+    offset_m: float
+    progress_m: float
+    remaining_m: float
+
+
+class RouteTracker:
+    """Matches position fixes to a route's geometry and flags deviations.
+
+    A fix counts as off-route when no segment lies within ``off_route_m``;
+    ``confirm_fixes`` consecutive such fixes are needed so GPS jitter doesn't
+    trigger a reroute.
+    """
+
+    def __init__(self, option: RouteOption, off_route_m: float = 30.0, confirm_fixes: int = 2):
+        self.off_route_m = off_route_m
+        self.confirm_fixes = confirm_fixes
+        self.reset(option)
+
+    def reset(self, option: RouteOption):
+        self.option = option
+        geometry = option.geometry or []
+        lat0, lon0 = geometry[0] if geometry else (0.0, 0.0)
+        self.proj = LocalProjection(lat0, lon0)
+        self.xy = [self.proj.to_xy(lat, lon) for lat, lon in geometry]
+        self.index = SegmentIndex(self.xy)
+        self.cum = [0.0]
+        for (x1, y1), (x2, y2) in zip(self.xy, self.xy[1:]):
+            self.cum.append(self.cum[-1] + math.hypot(x2 - x1, y2 - y1))
+        self.total_m = self.cum[-1]
+        self.progress_m = 0.0
+        self._seg = 0
+        self.last_on_route: Optional[Tuple[float, float]] = geometry[0] if geometry else None
+        self._off_count = 0
+        self._deviated = False
+
+    def update(self, lat: float, lon: float) -> TrackState:
+        x, y = self.proj.to_xy(lat, lon)
+        # Walking along the route stays within a few segments of the last match,
+        # so most fixes never touch the full index
+        hits = self._near_last(x, y) or self.index.within(x, y, self.off_route_m)
+        if hits:
+            # Prefer the match that continues from the last progress so a route
+            # that doubles back on itself isn't matched to the wrong pass
+            def _cost(hit):
+                d, seg, t = hit
+                progress = self.cum[seg] + t * (self.cum[seg + 1] - self.cum[seg])
+                return d + 0.1 * abs(progress - self.progress_m), progress, d, seg
+
+            _, progress, d, self._seg = min(_cost(h) for h in hits)
+            self.progress_m = progress
+            self.last_on_route = (lat, lon)
+            self._off_count = 0
+            self._deviated = False
+            return TrackState(True, False, d, progress, max(0.0, self.total_m - progress))
+
+        self._off_count += 1
+        newly = False
+        if self._off_count >= self.confirm_fixes and not self._deviated:
+            self._deviated = True
+            newly = True
+        return TrackState(False, newly, float("inf"), self.progress_m, max(0.0, self.total_m - self.progress_m))
+
+    def _near_last(self, x: float, y: float) -> List[Tuple[float, int, float]]:
+        out: List[Tuple[float, int, float]] = []
+        for seg in range(max(0, self._seg - _WINDOW_BACK), min(len(self.xy) - 1, self._seg + _WINDOW_AHEAD + 1)):
+            d, t = self.index._distance(seg, x, y)
+            if d <= self.off_route_m:
+                out.append((d, seg, t))
+        return out
+
+    def point_at(self, progress_m: float) -> Tuple[float, float]:
+        """(lat, lon) on the route ``progress_m`` meters from its start."""
+        if not self.xy:
+            raise ValueError("route has no geometry")
+        progress_m = max(0.0, min(progress_m, self.total_m))
+        lo, hi = 0, len(self.cum) - 1
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if self.cum[mid] <= progress_m:
+                lo = mid
+            else:
+                hi = mid
+        seg_len = self.cum[hi] - self.cum[lo]
+        t = 0.0 if seg_len == 0 else (progress_m - self.cum[lo]) / seg_len
+        (x1, y1), (x2, y2) = self.xy[lo], self.xy[hi]
+        return self.proj.to_latlon(x1 + t * (x2 - x1), y1 + t * (y2 - y1))
+
+    def project(self, lat: float, lon: float) -> Optional[float]:
+        """Progress (m) of the nearest point on the route, or None if it is far off."""
+        x, y = self.proj.to_xy(lat, lon)
+        hits = self.index.within(x, y, self.off_route_m)
+        if not hits:
+            return None
+        d, seg, t = min(hits)
+        return self.cum[seg] + t * (self.cum[seg + 1] - self.cum[seg])
+
+
+class Rerouter:
+    """Builds a detour from the deviation point back onto the unchanged route tail.
+
+    The detour targets a point ``rejoin_ahead_m`` past the last on-route progress,
+    so only the short stretch from the user to that point is recomputed and the
+    rest of the original geometry and instructions are reused. A full reroute to
+    the destination is the fallback. Each attempt is bounded by ``max_latency_sec``.
+
+    ``tracker`` follows the route the detour rejoins. Callers pass the original
+    route's tracker even when the user strays again from an earlier detour, so
+    detours are never stacked on top of each other.
+    """
+
+    def __init__(self, route_fn: RouteFn, rejoin_ahead_m: float = 150.0, max_latency_sec: float = 2.0):
+        self.route_fn = route_fn
+        self.rejoin_ahead_m = rejoin_ahead_m
+        self.max_latency_sec = max_latency_sec
+        self.latencies: List[float] = []
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="reroute")
+
+    def reroute(self, tracker: RouteTracker, position: Tuple[float, float], rejoin_progress: Optional[float] = None) -> Tuple[Optional[RouteOption], Optional[float]]:
+        """Return the new route and the progress on ``tracker``'s route where it rejoins (None for a full reroute)."""
+        start = time.perf_counter()
+        try:
+            old = tracker.option
+            mode = old.mode
+            if rejoin_progress is None:
+                rejoin_progress = tracker.progress_m + self.rejoin_ahead_m
+            if rejoin_progress < tracker.total_m:
+                target = tracker.point_at(rejoin_progress)
+                detour = self._bounded(position, target, mode, start)
+                if detour is not None and detour.geometry:
+                    return self._splice(tracker, detour, rejoin_progress), rejoin_progress
+            destination = old.geometry[-1] if old.geometry else None
+            if destination is None:
+                return None, None
+            return self._bounded(position, destination, mode, start), None
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+    def _bounded(self, a: Tuple[float, float], b: Tuple[float, float], mode: str, start: float) -> Optional[RouteOption]:
+        remaining = self.max_latency_sec - (time.perf_counter() - start)
+        if remaining <= 0:
+            return None
+        future = self._executor.submit(self.route_fn, a, b, mode)
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeout:
+            return None
+        except Exception:
+            return None
+
+    def _splice(self, tracker: RouteTracker, detour: RouteOption, rejoin_progress: float) -> RouteOption:
+        old = tracker.option
+        # Old geometry from the rejoin point onward
+        tail = [tracker.point_at(rejoin_progress)]
+        tail += [p for p, c in zip(old.geometry, tracker.cum) if c > rejoin_progress]
+        # Old steps whose maneuver lies past the rejoin point
+        tail_steps: List[str] = []
+        tail_maneuvers: List[Tuple[float, float]] = []
+        if old.maneuvers and len(old.maneuvers) == len(old.steps):
+            for step, m in zip(old.steps, old.maneuvers):
+                progress = tracker.project(m[0], m[1])
+                if progress is not None and progress > rejoin_progress:
+                    tail_steps.append(step)
+                    tail_maneuvers.append(m)
+        detour_steps = [s for s in detour.steps if not s.lower().startswith("arrive")]
+        detour_maneuvers = detour.maneuvers[: len(detour_steps)] if detour.maneuvers else []
+        remaining_m = max(0.0, tracker.total_m - rejoin_progress)
+        share = remaining_m / tracker.total_m if tracker.total_m else 0.0
+        steps = detour_steps + ["Rejoin your original route"] + tail_steps
+        maneuvers = detour_maneuvers + [tail[0]] + tail_maneuvers
+        return replace(
+            old,
+            duration_min=detour.duration_min + int(math.ceil(old.duration_min * share)),
+            distance_km=round(detour.distance_km + remaining_m / 1000.0, 2),
+            steps=steps,
+            geometry=list(detour.geometry) + tail[1:],
+            maneuvers=maneuvers if len(maneuvers) == len(steps) else [],
+        )
+
+
+class RouteGuard:
+    """Matches position fixes to the route and reroutes on deviation.
+
+    The caller feeds fixes to ``track`` and, when a fix newly deviates, calls
+    ``reroute`` wherever blocking is acceptable (guidance uses its executor).
+    ``on_instruction`` receives the text to speak after a reroute. ``current``
+    always holds the route being followed. Without a ``rerouter`` deviations
+    are only announced.
+
+    ``tracker`` follows the current route; ``base`` follows the route detours
+    are spliced onto, which stays the chosen route until a full reroute
+    replaces it. While the user is still off ``base``, a further deviation
+    reroutes to the same rejoin point rather than onto the last detour.
+    """
+
+    def __init__(self, option: RouteOption, rerouter: Optional[Rerouter], on_instruction: Callable[[str], None], off_route_m: float = 30.0):
+        self.off_route_m = off_route_m
+        self.tracker = RouteTracker(option, off_route_m=off_route_m)
+        self.base = self.tracker
+        self._rejoin_progress: Optional[float] = None
+        self.rerouter = rerouter
+        self.on_instruction = on_instruction
+        self.last_state: Optional[TrackState] = None
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> RouteOption:
+        with self._lock:
+            return self.tracker.option
+
+    def track(self, fix: Fix) -> TrackState:
+        """Match a fix against the current route; cheap, never touches the network."""
+        with self._lock:
+            state = self.tracker.update(fix.lat, fix.lon)
+            self.last_state = state
+            if self.base is not self.tracker and self.base.update(fix.lat, fix.lon).on_route:
+                # Back on the chosen route: the next deviation gets a fresh rejoin point
+                self._rejoin_progress = None
+            return state
+
+    def reroute(self, fix: Fix) -> Optional[RouteOption]:
+        """Replace the route after a deviation at ``fix``.
+
+        Blocks for the routing call, but without holding the lock, so ``track``
+        keeps working meanwhile.
+        """
+        with self._lock:
+            base, rejoin = self.base, self._rejoin_progress
+        new_option = None
+        if self.rerouter is not None:
+            new_option, rejoin = self.rerouter.reroute(base, (fix.lat, fix.lon), rejoin)
+        if new_option is None:
+            self.on_instruction("You are off route. Please stop and turn around carefully.")
+            return None
+        with self._lock:
+            self.tracker = RouteTracker(new_option, off_route_m=self.off_route_m)
+            if rejoin is None:
+                # A full reroute replaces the route detours are spliced onto
+                self.base = self.tracker
+            self._rejoin_progress = rejoin
+        first = new_option.steps[0] if new_option.steps else "Continue"
+        self.on_instruction(
+            f"You are off route. New route, {minutes_to_eta_str(new_option.duration_min)} remaining. {first}."
+        )
+        return new_option
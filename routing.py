@@ -1,12 +1,29 @@
 from __future__ import annotations
 import os
 import random
-from dataclasses import dataclass
-from typing import List, Optional, Dict
+from concurrent.futures import ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass, field
+from typing import TYPE_CHECKING, Any, List, Optional, Dict, Sequence, Tuple
 
+import numpy as np
 import requests
+from requests.adapters import HTTPAdapter
 
-from utils import minutes_to_eta_str, now_plus_minutes
+from providers import ProviderOrchestrator
+from route_cache import RouteCache, make_key
+from tracing import count, span
+from utils import minutes_to_eta_str, now_plus_minutes, parse_latlon, decode_polyline, haversine_m
+
+if TYPE_CHECKING:
+    from offline_router import OfflineRouter
+
+GOOGLE_DIRECTIONS_URL = "https://maps.googleapis.com/maps/api/directions/json"
+GOOGLE_MATRIX_URL = "https://maps.googleapis.com/maps/api/distancematrix/json"
+
+# Distance Matrix API per-request limits
+MATRIX_MAX_ORIGINS = 25
+MATRIX_MAX_DESTINATIONS = 25
+MATRIX_MAX_ELEMENTS = 100
 
 
 @dataclass
@@ -17,27 +34,235 @@ class RouteOption:
     summary: str
     provider: str
     steps: List[str]
+    # (lat, lon) polyline of the route and the point where each step begins;
+    # empty for providers that don't supply geometry (e.g. demo)
+    geometry: List[Tuple[float, float]] = field(default_factory=list)
+    maneuvers: List[Tuple[float, float]] = field(default_factory=list)
+
+
+@dataclass
+class RouteResult:
+    """Routes from one lookup, plus the modes left out of it."""
+    options: List[RouteOption]
+    provider: str = ""
+    # Modes with no answer, mapped to "timeout", "error", "unsupported" (the
+    # provider has no such mode) or "pending" (being fetched in the background
+    # after a partial cache hit)
+    missing_modes: Dict[str, str] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.options)
+
+
+@dataclass
+class RouteMatrix:
+    origins: List[str]
+    destinations: List[str]
+    modes: List[str]
+    # Shape (origins, destinations, modes); NaN where no provider had an answer
+    durations_min: np.ndarray
+    distances_km: np.ndarray
+
+    def nearest(self, origin_index: int, mode: str) -> Optional[int]:
+        """Index of the destination with the shortest travel time from an origin."""
+        row = self.durations_min[origin_index, :, self.modes.index(mode)]
+        if np.all(np.isnan(row)):
+            return None
+        return int(np.nanargmin(row))
 
 
 class Router:
-    def __init__(self, demo_mode: bool, google_key: str = "", ors_key: str = ""):
+    MODES = ("walking", "driving", "transit")
+
+    def __init__(
+        self,
+        demo_mode: bool,
+        google_key: str = "",
+        ors_key: str = "",
+        cache: Optional[RouteCache] = None,
+        deadline_sec: float = 8.0,
+        google_url: str = GOOGLE_DIRECTIONS_URL,
+        matrix_url: str = GOOGLE_MATRIX_URL,
+        offline: Optional["OfflineRouter"] = None,
+        orchestrator: Optional[ProviderOrchestrator] = None,
+    ):
         self.demo_mode = demo_mode
         self.google_key = google_key
         self.ors_key = ors_key
+        self.cache = cache
+        self.deadline_sec = deadline_sec
+        self.google_url = google_url
+        self.matrix_url = matrix_url
+        self.offline = offline
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.MODES), pool_maxsize=len(self.MODES) * 2)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=len(self.MODES) * 2, thread_name_prefix="router")
+        self.orchestrator = orchestrator or ProviderOrchestrator(self._providers(), deadline_sec=deadline_sec + 2.0)
+
+    def _providers(self):
+        # Priority order: live Google, then ORS, then the local graph
+        providers = []
+        if self.google_key:
+            providers.append(("google", self._google_routes))
+        if self.ors_key:
+            providers.append(("ors", self._ors_routes))
+        if self.offline is not None:
+            providers.append(("offline", self._offline_routes))
+        return providers
 
     def get_routes(self, origin: str, destination: str) -> List[RouteOption]:
-        if self.demo_mode or not (self.google_key or self.ors_key):
-            return self._demo_routes(destination)
-        # Prefer Google if key provided; else ORS
-        try:
-            if self.google_key:
-                return self._google_routes(origin, destination)
-            elif self.ors_key:
-                return self._ors_routes(origin, destination)
-        except Exception:
-            pass
+        return self.lookup(origin, destination).options
+
+    def lookup(self, origin: str, destination: str) -> RouteResult:
+        """Like ``get_routes``, but also reports which modes are missing and why."""
+        with span("route.get_routes"):
+            return self._lookup(origin, destination)
+
+    def _lookup(self, origin: str, destination: str) -> RouteResult:
+        if self.demo_mode or not (self.google_key or self.ors_key or self.offline):
+            return RouteResult(self._demo_routes(destination), "demo")
+        if self.cache is None:
+            return self._fetch_routes(origin, destination, self.MODES)
+
+        cached = {}
+        for mode in self.MODES:
+            entry = self.cache.get(make_key(origin, destination, mode))
+            if entry is not None:
+                cached[mode] = entry
+        if not cached:
+            count("route_cache_lookups", result="miss")
+            return self._fetch_and_store(origin, destination, self.MODES)
+
+        # Serve whatever is cached straight away. Modes that are stale or were
+        # never cached (one slow mode timed out last time) are fetched in the
+        # background, so a single slow mode can't make every lookup wait. An
+        # empty payload records a mode the provider doesn't offer; it is not
+        # refetched until it goes stale like any other entry.
+        count("route_cache_lookups", result="hit")
+        refresh = [m for m in self.MODES if m not in cached or cached[m].stale]
+        if refresh:
+            self.cache.refresh_async(
+                make_key(origin, destination, ",".join(refresh)), lambda: self._fetch_and_store(origin, destination, refresh)
+            )
+        options = [_option_from_dict(d) for m in self.MODES if m in cached for d in cached[m].payload]
+        missing = {m: "pending" for m in self.MODES if m not in cached}
+        missing.update({m: "unsupported" for m, entry in cached.items() if not entry.payload})
+        return RouteResult(options, next(iter(cached.values())).provider, missing)
+
+    def get_route_matrix(
+        self, origins: Sequence[str], destinations: Sequence[str], modes: Sequence[str] = ("walking", "driving")
+    ) -> RouteMatrix:
+        """Travel times and distances for every origin/destination/mode combination.
+
+        Cells are filled from the route cache first, then from Distance Matrix
+        requests batched up to the API limits, then from the offline engine.
+        """
+        origins, destinations, modes = list(origins), list(destinations), list(modes)
+        shape = (len(origins), len(destinations), len(modes))
+        durations = np.full(shape, np.nan)
+        distances = np.full(shape, np.nan)
+
+        if self.cache is not None:
+            for i, o in enumerate(origins):
+                for j, d in enumerate(destinations):
+                    for k, mode in enumerate(modes):
+                        cell = self._cached_cell(o, d, mode)
+                        if cell is not None:
+                            durations[i, j, k], distances[i, j, k] = cell
+
+        if self.google_key and not self.demo_mode:
+            futures = []
+            for k, mode in enumerate(modes):
+                for rows, cols in _matrix_blocks(np.isnan(durations[:, :, k])):
+                    futures.append(self._executor.submit(self._google_matrix_block, origins, destinations, rows, cols, mode))
+            done, _ = wait(futures, timeout=self.deadline_sec)
+            for f in done:
+                try:
+                    rows, cols, mode, block_dur, block_dist = f.result()
+                except Exception:
+                    continue
+                k = modes.index(mode)
+                durations[np.ix_(rows, cols, [k])] = block_dur[:, :, None]
+                distances[np.ix_(rows, cols, [k])] = block_dist[:, :, None]
+
+        if self.offline is not None:
+            for k, mode in enumerate(modes):
+                if mode not in self.offline.MODES:
+                    continue
+                for i, o in enumerate(origins):
+                    start = parse_latlon(o)
+                    cols = [j for j in np.nonzero(np.isnan(durations[i, :, k]))[0] if parse_latlon(destinations[j])]
+                    if start is None or not cols:
+                        continue
+                    secs, meters = self.offline.one_to_many(start, [parse_latlon(destinations[j]) for j in cols], mode)
+                    durations[i, cols, k] = secs / 60.0
+                    distances[i, cols, k] = meters / 1000.0
+
+        if self.demo_mode:
+            _estimate_straight_line(origins, destinations, modes, durations, distances)
+
+        return RouteMatrix(origins, destinations, modes, durations, distances)
+
+    def _cached_cell(self, origin: str, destination: str, mode: str) -> Optional[Tuple[float, float]]:
+        for key in (make_key(origin, destination, mode), make_key(origin, destination, f"{mode}:matrix")):
+            entry = self.cache.get(key)
+            if entry is not None and entry.payload:
+                first = entry.payload[0]
+                return float(first["duration_min"]), float(first["distance_km"])
+        return None
+
+    def _google_matrix_block(self, origins: List[str], destinations: List[str], rows: List[int], cols: List[int], mode: str):
+        params = {
+            "origins": "|".join(origins[i] for i in rows),
+            "destinations": "|".join(destinations[j] for j in cols),
+            "mode": mode,
+            "key": self.google_key,
+        }
+        if mode == "transit":
+            params["departure_time"] = "now"
+        r = self._session.get(self.matrix_url, params=params, timeout=(3.05, self.deadline_sec))
+        r.raise_for_status()
+        data = r.json()
+        block_dur = np.full((len(rows), len(cols)), np.nan)
+        block_dist = np.full((len(rows), len(cols)), np.nan)
+        for a, row in enumerate(data.get("rows", [])[: len(rows)]):
+            for b, el in enumerate(row.get("elements", [])[: len(cols)]):
+                if el.get("status") != "OK":
+                    continue
+                block_dur[a, b] = el["duration"]["value"] / 60.0
+                block_dist[a, b] = el["distance"]["value"] / 1000.0
+                if self.cache is not None:
+                    self.cache.put(
+                        make_key(origins[rows[a]], destinations[cols[b]], f"{mode}:matrix"),
+                        [{"duration_min": block_dur[a, b], "distance_km": block_dist[a, b]}],
+                        "google",
+                    )
+        return rows, cols, mode, block_dur, block_dist
+
+    def _fetch_and_store(self, origin: str, destination: str, modes: Sequence[str]) -> RouteResult:
+        result = self._fetch_routes(origin, destination, modes)
+        # Only the preferred provider's answer is cached. A hedge winner, a
+        # fallback after a tripped breaker or demo routes would otherwise pin
+        # this trip to a lesser provider for the whole (possibly 24 h) TTL.
+        preferred = self.orchestrator.providers[0][0] if self.orchestrator.providers else None
+        if self.cache is not None and result and result.provider == preferred:
+            for mode in modes:
+                # Unsupported modes are cached as an empty payload so lookups
+                # don't keep refetching them; failed modes are not cached at all
+                if result.missing_modes.get(mode, "unsupported") != "unsupported":
+                    continue
+                payload = [_option_to_dict(o) for o in result.options if o.mode == mode]
+                self.cache.put(make_key(origin, destination, mode), payload, result.provider)
+        return result
+
+    def _fetch_routes(self, origin: str, destination: str, modes: Sequence[str]) -> RouteResult:
+        name, result = self.orchestrator.call(origin, destination, tuple(modes))
+        if result:
+            return _as_result(result, name or "", modes)
         # fallback to demo
-        return self._demo_routes(destination)
+        return RouteResult(self._demo_routes(destination), "demo")
 
     def _demo_routes(self, destination: str) -> List[RouteOption]:
         random.seed(destination)
@@ -82,36 +307,88 @@ class Router:
         )
         return [walk, drive, transit]
 
-    def _google_routes(self, origin: str, destination: str) -> List[RouteOption]:
-        # Minimal example using Google Directions API v1 (requires billing)
-        # This function fetches walking and driving; transit requires extra params depending on region
-        base = "https://maps.googleapis.com/maps/api/directions/json"
-        modes = ["walking", "driving"]
+    def _google_routes(self, origin: str, destination: str, modes: Sequence[str] = MODES) -> RouteResult:
+        # Google Directions API v1 (requires billing). All modes are requested
+        # concurrently over one pooled keep-alive session; modes that miss the
+        # deadline are reported in the result instead of being dropped.
+        futures = {
+            self._executor.submit(self._google_mode, origin, destination, mode): mode for mode in modes
+        }
+        done, not_done = wait(futures, timeout=self.deadline_sec)
+        missing: Dict[str, str] = {futures[f]: "timeout" for f in not_done}
+        by_mode: Dict[str, Optional[RouteOption]] = {}
+        for f in done:
+            mode = futures[f]
+            try:
+                by_mode[mode] = f.result()
+            except Exception:
+                missing[mode] = "error"
+        # Nothing came back in time: raise so the breaker counts it and the
+        # orchestrator moves on, instead of treating it as "no route"
+        if missing and not any(by_mode.values()):
+            raise RuntimeError(f"Google Directions returned no routes ({', '.join(f'{m}: {why}' for m, why in sorted(missing.items()))})")
+        # Keep the MODES order regardless of completion order
+        return RouteResult([by_mode[m] for m in modes if by_mode.get(m) is not None], "google", missing)
+
+    def _google_mode(self, origin: str, destination: str, mode: str) -> Optional[RouteOption]:
+        params = {"origin": origin, "destination": destination, "mode": mode, "key": self.google_key}
+        if mode == "transit":
+            params["departure_time"] = "now"
+        r = self._session.get(self.google_url, params=params, timeout=(3.05, self.deadline_sec))
+        r.raise_for_status()
+        data = r.json()
+        if not data.get("routes"):
+            return None
+        route = data["routes"][0]
+        leg = route["legs"][0]
+        dur_min = int(leg["duration"]["value"]) // 60
+        dist_km = round(leg["distance"]["value"] / 1000.0, 2)
+        steps = [s["html_instructions"] for s in leg.get("steps", [])]
+        maneuvers = [
+            (float(s["start_location"]["lat"]), float(s["start_location"]["lng"]))
+            for s in leg.get("steps", [])
+            if "start_location" in s
+        ]
+        geometry = decode_polyline(route.get("overview_polyline", {}).get("points", ""))
+        return RouteOption(
+            mode=mode,
+            duration_min=dur_min,
+            distance_km=dist_km,
+            summary=route.get("summary", f"{mode.title()} route"),
+            provider="google",
+            steps=[_strip_html(x) for x in steps],
+            geometry=geometry,
+            maneuvers=maneuvers if len(maneuvers) == len(steps) else [],
+        )
+
+    def route_between(self, start: Tuple[float, float], end: Tuple[float, float], mode: str) -> Optional[RouteOption]:
+        """Single-mode route between two coordinates, used for rerouting mid-guidance."""
+        if self.offline is not None and mode in self.offline.MODES:
+            option = self.offline.route(start, end, mode)
+            if option is not None:
+                return option
+        if self.google_key and not self.demo_mode:
+            return self._google_mode(f"{start[0]},{start[1]}", f"{end[0]},{end[1]}", mode)
+        return None
+
+    def _offline_routes(self, origin: str, destination: str, modes: Sequence[str] = MODES) -> RouteResult:
+        # The offline engine needs coordinates; free-text places are left to online providers
+        if self.offline is None:
+            return RouteResult([], "offline")
+        start, end = parse_latlon(origin), parse_latlon(destination)
+        if start is None or end is None:
+            return RouteResult([], "offline")
         options: List[RouteOption] = []
         for mode in modes:
-            params = {"origin": origin, "destination": destination, "mode": mode, "key": self.google_key}
-            r = requests.get(base, params=params, timeout=10)
-            r.raise_for_status()
-            data = r.json()
-            if data.get("routes"):
-                route = data["routes"][0]
-                leg = route["legs"][0]
-                dur_min = int(leg["duration"]["value"]) // 60
-                dist_km = round(leg["distance"]["value"] / 1000.0, 2)
-                steps = [s["html_instructions"] for s in leg.get("steps", [])]
-                options.append(
-                    RouteOption(
-                        mode=mode,
-                        duration_min=dur_min,
-                        distance_km=dist_km,
-                        summary=route.get("summary", f"{mode.title()} route"),
-                        provider="google",
-                        steps=[_strip_html(x) for x in steps],
-                    )
-                )
-        return options
+            if mode not in self.offline.MODES:
+                continue
+            option = self.offline.route(start, end, mode)
+            if option is not None:
+                options.append(option)
+        missing = {m: "unsupported" for m in modes if m not in self.offline.MODES}
+        return RouteResult(options, "offline", missing)
 
-    def _ors_routes(self, origin: str, destination: str) -> List[RouteOption]:
+    def _ors_routes(self, origin: str, destination: str, modes: Sequence[str] = MODES) -> List[RouteOption]:
         # Minimal example using OpenRouteService Directions API
         # Note: requires geocoding origin/destination to coordinates (not implemented fully here)
         return []
@@ -124,6 +401,62 @@ def describe_route(option: RouteOption) -> str:
     )
 
 
+def _matrix_blocks(missing: np.ndarray) -> List[Tuple[List[int], List[int]]]:
+    """Split the rows/columns that still have missing cells into API-sized blocks."""
+    rows = [int(i) for i in np.nonzero(missing.any(axis=1))[0]]
+    cols = [int(j) for j in np.nonzero(missing.any(axis=0))[0]]
+    if not rows or not cols:
+        return []
+    col_size = min(MATRIX_MAX_DESTINATIONS, len(cols), MATRIX_MAX_ELEMENTS)
+    row_size = max(1, min(MATRIX_MAX_ORIGINS, MATRIX_MAX_ELEMENTS // col_size))
+    blocks = []
+    for r0 in range(0, len(rows), row_size):
+        for c0 in range(0, len(cols), col_size):
+            blocks.append((rows[r0:r0 + row_size], cols[c0:c0 + col_size]))
+    return blocks
+
+
+# Rough speeds (km/h) and street-network detour factor for demo estimates
+_DEMO_SPEEDS_KMH = {"walking": 4.5, "driving": 30.0, "transit": 18.0}
+_DETOUR_FACTOR = 1.3
+
+
+def _estimate_straight_line(origins, destinations, modes, durations: np.ndarray, distances: np.ndarray):
+    for i, o in enumerate(origins):
+        a = parse_latlon(o)
+        for j, d in enumerate(destinations):
+            b = parse_latlon(d)
+            if a is None or b is None:
+                continue
+            km = haversine_m(a[0], a[1], b[0], b[1]) / 1000.0 * _DETOUR_FACTOR
+            for k, mode in enumerate(modes):
+                if np.isnan(durations[i, j, k]):
+                    distances[i, j, k] = round(km, 2)
+                    durations[i, j, k] = km / _DEMO_SPEEDS_KMH.get(mode, 4.5) * 60.0
+
+
+def _as_result(answer, provider: str, modes: Sequence[str]) -> RouteResult:
+    # Providers may answer with a bare list of options; modes it doesn't
+    # mention can't be told apart from unsupported ones, so they count as unsupported
+    if isinstance(answer, RouteResult):
+        return answer
+    options = list(answer)
+    answered = {o.mode for o in options}
+    return RouteResult(options, provider, {m: "unsupported" for m in modes if m not in answered})
+
+
+def _option_to_dict(option: RouteOption) -> Dict[str, Any]:
+    return asdict(option)
+
+
+def _option_from_dict(data: Dict[str, Any]) -> RouteOption:
+    data = dict(data)
+    # JSON turns coordinate tuples into lists
+    for key in ("geometry", "maneuvers"):
+        data[key] = [tuple(p) for p in data.get(key, [])]
+    return RouteOption(**data)
+
+
 def _strip_html(s: str) -> str:
     import re
     return re.sub("<.*?>", " ", s).replace("  ", " ").strip()
@@ -0,0 +1,613 @@
+from __future__ import annotations
+import argparse
+import http.client
+import itertools
+import json
+import multiprocessing as mp
+import multiprocessing.connection
+import queue
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import tracing
+from config import GOOGLE_MAPS_API_KEY, ORS_API_KEY, ROUTE_CACHE_PATH, ROUTE_CACHE_SIZE, ROUTE_DEADLINE_SEC
+from inference import BackendConfig, Detection, create_backend
+from route_cache import RouteCache
+from routing import Router
+from startup import lazy_import
+from vision import VisionLoop
+
+cv2 = lazy_import("cv2")
+
+_MAX_FRAME_BYTES = 1280 * 720 * 3
+
+
+class SharedFrameSlots:
+    """A fixed set of shared-memory frame buffers.
+
+    Workers attach to every slot once at startup, so handing a frame over
+    costs one copy into the slot plus a tiny (slot, shape) message; pixels
+    never go through pickle. The free list doubles as backpressure: when
+    all slots are in flight, ``acquire`` waits.
+    """
+
+    def __init__(self, count: int, max_bytes: int = _MAX_FRAME_BYTES):
+        self.max_bytes = max_bytes
+        self._shms = [shared_memory.SharedMemory(create=True, size=max_bytes) for _ in range(count)]
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for i in range(count):
+            self._free.put(i)
+
+    @property
+    def names(self) -> List[str]:
+        return [s.name for s in self._shms]
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        try:
+            return self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, slot: int):
+        self._free.put(slot)
+
+    def write(self, slot: int, frame: np.ndarray) -> Tuple[Tuple[int, ...], str]:
+        if frame.nbytes > self.max_bytes:
+            raise ValueError(f"frame of {frame.nbytes} bytes exceeds the {self.max_bytes}-byte slot")
+        view = np.ndarray(frame.shape, dtype=frame.dtype, buffer=self._shms[slot].buf)
+        np.copyto(view, frame)
+        return frame.shape, frame.dtype.str
+
+    def close(self):
+        for s in self._shms:
+            try:
+                s.close()
+                s.unlink()
+            except Exception:
+                pass
+
+
+class _StubBackend:
+    """Stands in for a model in load tests: reads every pixel, finds nothing."""
+
+    def detect_batch(self, frames) -> List[List[Detection]]:
+        for f in frames:
+            float(f.mean())
+        return [[] for _ in frames]
+
+
+def _worker_main(index: int, config: Optional[BackendConfig], slot_names: List[str], tasks, results):
+    # Spawned workers share the parent's resource tracker, so attaching doesn't take ownership
+    shms = [shared_memory.SharedMemory(name=n) for n in slot_names]
+    try:
+        backend = create_backend(config) if config is not None else _StubBackend()
+        results.send((index, "ready", None, None, 0.0))
+    except Exception as exc:
+        results.send((index, "failed", None, repr(exc), 0.0))
+        return
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        batch_id, items = task
+        t0 = time.perf_counter()
+        frames = [np.ndarray(shape, dtype=np.dtype(dtype), buffer=shms[slot].buf) for _, slot, shape, dtype in items]
+        try:
+            dets = backend.detect_batch(frames)
+            payload = [[(d.name, d.confidence, d.box) for d in per_frame] for per_frame in dets]
+            error = None
+        except Exception as exc:
+            payload, error = None, repr(exc)
+        del frames  # drop the buffer views before the slots are reused
+        results.send((index, batch_id, [req_id for req_id, _, _, _ in items], payload if error is None else error, time.perf_counter() - t0))
+    results.close()
+    for s in shms:
+        s.close()
+
+
+class InferencePool:
+    """Detection on a pool of worker processes, each with its own model, shared by every client.
+
+    Requests queue in the parent. Whenever a worker is free, everything
+    waiting (up to ``max_batch``) goes to it as one batch, so batches grow
+    with load and stay at one frame when idle. ``config=None`` runs a stub
+    detector for load tests without a model.
+
+    Each worker has its own task queue and result pipe, so the pool knows
+    which batch every worker holds and a worker dying can't wedge a lock
+    the others share. A worker that dies (its pipe hits EOF) has its batch
+    failed and its frame slots freed, and is replaced by a fresh process.
+    """
+
+    def __init__(self, config: Optional[BackendConfig], workers: int = 2, max_batch: int = 8, max_wait_ms: float = 2.0, slots: Optional[int] = None, max_frame_bytes: int = _MAX_FRAME_BYTES):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait_sec = max_wait_ms / 1000.0
+        self.config = config
+        self.slots = SharedFrameSlots(slots or workers * max_batch * 2, max_frame_bytes)
+        self._ctx = mp.get_context("spawn")
+        self._tasks: List = [None] * workers
+        self._procs: List = [None] * workers
+        # Result pipe per worker; None once a worker is retired for good
+        self._conns: List = [None] * workers
+        for w in range(workers):
+            self._spawn(w)
+        for conn in self._conns:
+            try:
+                _, status, _, error, _ = conn.recv()
+            except (EOFError, OSError) as exc:
+                status, error = "failed", repr(exc)
+            if status != "ready":
+                self.close()
+                raise RuntimeError(f"inference worker failed to start: {error}")
+        self._pending: "queue.Queue[Tuple[int, int, Tuple[int, ...], str]]" = queue.Queue()
+        self._futures: Dict[int, Tuple[Future, int]] = {}
+        self._lock = threading.Lock()
+        # Idle (worker, generation) pairs. The generation goes up with every
+        # replacement, so entries left behind by a dead worker are skipped.
+        self._idle: "queue.Queue[Tuple[int, int]]" = queue.Queue()
+        self._gen = [0] * workers
+        self._alive = [True] * workers
+        self._inflight: Dict[int, Tuple[int, List[int]]] = {}
+        for w in range(workers):
+            self._idle.put((w, 0))
+        self._ids = itertools.count()
+        self._closed = False
+        self.batches = 0
+        self.frames = 0
+        self.worker_sec = 0.0
+        self.restarts = 0
+        self._dispatcher = threading.Thread(target=self._dispatch, name="pool-dispatch", daemon=True)
+        self._collector = threading.Thread(target=self._collect, name="pool-collect", daemon=True)
+        self._dispatcher.start()
+        self._collector.start()
+
+    def _spawn(self, w: int):
+        # A fresh task queue, so a replacement never picks up its predecessor's batch
+        self._tasks[w] = self._ctx.Queue()
+        recv, send = self._ctx.Pipe(duplex=False)
+        self._procs[w] = self._ctx.Process(target=_worker_main, args=(w, self.config, self.slots.names, self._tasks[w], send), daemon=True)
+        self._procs[w].start()
+        # Only the worker holds the sending end, so its exit shows up as EOF here
+        send.close()
+        self._conns[w] = recv
+
+    def submit(self, frame: np.ndarray, timeout: Optional[float] = None) -> Future:
+        """Queue a frame; raises ``queue.Full`` if no slot frees up within ``timeout``."""
+        slot = self.slots.acquire(timeout)
+        if slot is None:
+            raise queue.Full("inference pool is saturated")
+        try:
+            shape, dtype = self.slots.write(slot, frame)
+        except Exception:
+            self.slots.release(slot)
+            raise
+        future: Future = Future()
+        req_id = next(self._ids)
+        with self._lock:
+            self._futures[req_id] = (future, slot)
+        self._pending.put((req_id, slot, shape, dtype))
+        return future
+
+    def detect(self, frame: np.ndarray, timeout: float = 5.0) -> List[Detection]:
+        return self.submit(frame, timeout=timeout).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "frames": self.frames,
+            "mean_batch": round(self.frames / self.batches, 2) if self.batches else 0.0,
+            "queued": self._pending.qsize(),
+            "worker_busy_sec": round(self.worker_sec, 3),
+            "worker_restarts": self.restarts,
+        }
+
+    def close(self):
+        self._closed = True
+        for tasks in self._tasks:
+            try:
+                tasks.put(None)
+            except Exception:
+                pass
+        for p in self._procs:
+            p.join(timeout=2)
+            if p.is_alive():
+                p.terminate()
+        for conn in self._conns:
+            if conn is not None:
+                conn.close()
+        self.slots.close()
+
+    def _dispatch(self):
+        while not self._closed:
+            try:
+                first = self._pending.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # Frames keep queueing while every worker is busy; that backlog becomes the next batch
+            worker = self._idle.get()
+            batch = [first]
+            deadline = time.perf_counter() + self.max_wait_sec
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._pending.get(timeout=max(0.0, deadline - time.perf_counter())) if len(batch) == 1 else self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            batch_id = next(self._ids)
+            while not self._send(worker, batch_id, batch):
+                worker = self._idle.get()
+
+    def _send(self, worker: Tuple[int, int], batch_id: int, batch) -> bool:
+        w, gen = worker
+        with self._lock:
+            if not self._alive[w] or gen != self._gen[w]:
+                return False  # died while idle; its replacement queues itself when ready
+            self._inflight[w] = (batch_id, [req_id for req_id, _, _, _ in batch])
+            self._tasks[w].put((batch_id, batch))
+            return True
+
+    def _collect(self):
+        while not self._closed:
+            conns = {conn: w for w, conn in enumerate(self._conns) if conn is not None}
+            for conn in mp.connection.wait(list(conns), timeout=0.5):
+                w = conns[conn]
+                try:
+                    worker, batch_id, req_ids, payload, elapsed = conn.recv()
+                except Exception:
+                    self._reap(w)
+                    continue
+                if batch_id == "ready":
+                    with self._lock:
+                        self._alive[worker] = True
+                        gen = self._gen[worker]
+                    self._idle.put((worker, gen))
+                    continue
+                if batch_id == "failed":
+                    # The replacement couldn't load its model; run with one worker fewer
+                    conn.close()
+                    self._conns[w] = None
+                    continue
+                with self._lock:
+                    # A result for a batch that was already failed is stale
+                    if self._inflight.get(worker, (None,))[0] != batch_id:
+                        continue
+                    del self._inflight[worker]
+                    gen = self._gen[worker]
+                self._idle.put((worker, gen))
+                self.batches += 1
+                self.frames += len(req_ids)
+                self.worker_sec += elapsed
+                if isinstance(payload, str):
+                    self._finish(req_ids, RuntimeError(payload))
+                else:
+                    self._finish(req_ids, [[Detection(name, conf, tuple(box)) for name, conf, box in per_frame] for per_frame in payload])
+
+    def _finish(self, req_ids: List[int], outcome):
+        """Resolve the futures for ``req_ids`` and free their slots; ``outcome`` is an exception or per-frame results."""
+        for i, req_id in enumerate(req_ids):
+            with self._lock:
+                entry = self._futures.pop(req_id, None)
+            if entry is None:
+                continue
+            future, slot = entry
+            self.slots.release(slot)
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome[i])
+
+    def _reap(self, w: int):
+        # Worker ``w`` exited: fail the batch it held, free its slots and start a replacement
+        if self._closed:
+            return
+        proc = self._procs[w]
+        proc.join(timeout=1.0)
+        with self._lock:
+            self._alive[w] = False
+            self._gen[w] += 1
+            _, req_ids = self._inflight.pop(w, (None, []))
+        self._finish(req_ids, RuntimeError(f"inference worker exited with code {proc.exitcode}"))
+        self._conns[w].close()
+        self.restarts += 1
+        self._spawn(w)
+
+
+class PooledBackend:
+    """Detector for a per-client VisionLoop that runs inference on the shared pool."""
+
+    def __init__(self, pool: InferencePool, timeout: float = 5.0):
+        self.pool = pool
+        self.timeout = timeout
+        self.last_timings: Dict[str, float] = {}
+
+    def detect(self, frame) -> List[Detection]:
+        t0 = time.perf_counter()
+        dets = self.pool.detect(frame, timeout=self.timeout)
+        self.last_timings = {"inference": time.perf_counter() - t0}
+        return dets
+
+
+class _ClientSession:
+    def __init__(self, pool: InferencePool):
+        self.alerts: List[str] = []
+        self.vision = VisionLoop(enabled=True, voice_say=self.alerts.append, demo_mode=False, backend=PooledBackend(pool))
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.last_seen = time.monotonic()
+
+
+class NavigationServer:
+    """HTTP backend for thin clients: routes from one shared Router and cache, obstacle
+    alerts from a per-client vision pipeline whose inference runs on the shared pool.
+
+    POST /routes         {"origin": ..., "destination": ...}
+    POST /frames?session=ID   JPEG/PNG body, or raw uint8 with an X-Frame-Shape: h,w,c header
+    GET  /metrics        Prometheus text
+    GET  /health
+    """
+
+    def __init__(self, router: Router, pool: InferencePool, session_ttl_sec: float = 300.0, max_body_bytes: int = _MAX_FRAME_BYTES):
+        self.router = router
+        self.pool = pool
+        self.session_ttl_sec = session_ttl_sec
+        # Nothing a client sends legitimately is bigger than a raw frame
+        self.max_body_bytes = max_body_bytes
+        self._sessions: Dict[str, _ClientSession] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def routes(self, origin: str, destination: str) -> Dict[str, object]:
+        with tracing.span("server.routes"):
+            options = self.router.get_routes(origin or "current location", destination)
+        tracing.count("server_requests", endpoint="routes")
+        return {"options": [asdict(o) for o in options]}
+
+    def frame(self, session_id: str, frame: np.ndarray) -> Dict[str, object]:
+        session = self._session(session_id)
+        with tracing.span("server.frame"), session.lock:
+            session.seq += 1
+            session.alerts.clear()
+            alert = session.vision.handle_frame(frame, time.perf_counter(), session.seq)
+            tracks = [{"name": t.name, "box": [round(v, 1) for v in t.box]} for t in session.vision.tracker.tracks if not t.misses]
+        tracing.count("server_requests", endpoint="frames")
+        return {"alert": alert, "obstacle": session.vision.obstacle_active, "tracks": tracks}
+
+    def metrics_text(self) -> str:
+        lines = [f"blindnav_sessions {len(self._sessions)}"]
+        for key, value in self.pool.stats().items():
+            lines.append(f"blindnav_pool_{key} {value}")
+        tracer = tracing.get_tracer()
+        return "\n".join(lines) + "\n" + (tracer.prometheus_text() if tracer is not None else "")
+
+    def _session(self, session_id: str) -> _ClientSession:
+        now = time.monotonic()
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _ClientSession(self.pool)
+            session.last_seen = now
+            if now - self._last_sweep > 30.0:
+                self._last_sweep = now
+                for sid in [s for s, c in self._sessions.items() if now - c.last_seen > self.session_ttl_sec]:
+                    del self._sessions[sid]
+            return session
+
+    def serve(self, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+        app = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, so a client reuses one connection
+
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/health":
+                    self._send(200, {"ok": True})
+                elif path == "/metrics":
+                    self._send_text(200, app.metrics_text())
+                else:
+                    self._send(404, {"error": "not found"})
+
+            def do_POST(self):
+                url = urlparse(self.path)
+                try:
+                    length = int(self.headers.get("Content-Length") or 0)
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= app.max_body_bytes:
+                    # The body is left unread, so this connection can't be reused
+                    self.close_connection = True
+                    self._send(413, {"error": f"body must be at most {app.max_body_bytes} bytes"})
+                    return
+                body = self.rfile.read(length)
+                try:
+                    if url.path == "/routes":
+                        req = json.loads(body or b"{}")
+                        self._send(200, app.routes(req.get("origin", ""), req.get("destination", "")))
+                    elif url.path == "/frames":
+                        session_id = parse_qs(url.query).get("session", [""])[0]
+                        frame = _decode_frame(body, self.headers.get("X-Frame-Shape", ""))
+                        if not session_id or frame is None:
+                            self._send(400, {"error": "need ?session= and a decodable frame"})
+                            return
+                        self._send(200, app.frame(session_id, frame))
+                    else:
+                        self._send(404, {"error": "not found"})
+                except queue.Full:
+                    self._send(503, {"error": "busy"})
+                except Exception as exc:
+                    self._send(500, {"error": repr(exc)})
+
+            def _send(self, status: int, payload):
+                self._send_text(status, json.dumps(payload), "application/json")
+
+            def _send_text(self, status: int, text: str, content_type: str = "text/plain; version=0.0.4"):
+                data = text.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
+
+
+def _decode_frame(body: bytes, shape_header: str) -> Optional[np.ndarray]:
+    if shape_header:
+        try:
+            shape = tuple(int(v) for v in shape_header.split(","))
+            return np.frombuffer(body, dtype=np.uint8).reshape(shape)
+        except ValueError:
+            return None
+    if not body:
+        return None
+    return cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def run_load(host: str, port: int, clients: int = 10, seconds: float = 10.0, fps: float = 5.0, frame_hw: Tuple[int, int] = (240, 320)) -> Dict[str, object]:
+    """Drive the server with ``clients`` simulated phones: one route request each, then frames at ``fps``."""
+    latencies: Dict[str, List[float]] = {"routes": [], "frames": []}
+    errors: Dict[str, int] = {}
+    lock = threading.Lock()
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (frame_hw[0], frame_hw[1], 3), dtype=np.uint8)
+    shape = f"{frame_hw[0]},{frame_hw[1]},3"
+    stop_at = time.perf_counter() + seconds
+
+    def request(conn, method: str, path: str, body: bytes, headers: Dict[str, str], kind: str):
+        t0 = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+            status = resp.status
+        except Exception as exc:
+            status = type(exc).__name__
+            conn.close()
+        with lock:
+            if status == 200:
+                latencies[kind].append(time.perf_counter() - t0)
+            else:
+                errors[f"{kind}:{status}"] = errors.get(f"{kind}:{status}", 0) + 1
+
+    def client(index: int):
+        session = uuid.uuid4().hex
+        conn = http.client.HTTPConnection(host, port, timeout=30)
+        request(conn, "POST", "/routes", json.dumps({"destination": f"place {index % 7}"}).encode(), {"Content-Type": "application/json"}, "routes")
+        seq = 0
+        next_at = time.perf_counter()
+        while time.perf_counter() < stop_at:
+            # Shift the image a little each frame so the motion gate sees a live scene
+            frame = np.roll(base, seq * 3, axis=1)
+            request(conn, "POST", f"/frames?session={session}", frame.tobytes(), {"X-Frame-Shape": shape, "Content-Type": "application/octet-stream"}, "frames")
+            seq += 1
+            next_at = max(next_at + 1.0 / fps, time.perf_counter())
+            time.sleep(max(0.0, next_at - time.perf_counter()))
+        conn.close()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(i,), daemon=True) for i in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    report: Dict[str, object] = {"clients": clients, "seconds": round(wall, 2), "errors": errors}
+    for kind, values in latencies.items():
+        ordered = sorted(values)
+        report[kind] = {
+            "count": len(ordered),
+            "per_sec": round(len(ordered) / wall, 1) if wall else 0.0,
+            "p50_ms": round(1000 * ordered[len(ordered) // 2], 2) if ordered else 0.0,
+            "p99_ms": round(1000 * ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))], 2) if ordered else 0.0,
+        }
+    return report
+
+
+def _build(args) -> Tuple[NavigationServer, InferencePool]:
+    config = None
+    if args.backend != "none":
+        from vision_replay import parse_backend_spec
+
+        config = parse_backend_spec(args.backend)
+    pool = InferencePool(config, workers=args.workers, max_batch=args.max_batch)
+    cache = RouteCache(path=ROUTE_CACHE_PATH, max_entries=ROUTE_CACHE_SIZE)
+    router = Router(
+        demo_mode=not (GOOGLE_MAPS_API_KEY or ORS_API_KEY),
+        google_key=GOOGLE_MAPS_API_KEY,
+        ors_key=ORS_API_KEY,
+        cache=cache,
+        deadline_sec=ROUTE_DEADLINE_SEC,
+    )
+    return NavigationServer(router, pool), pool
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-client navigation backend")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("serve", "load"):
+        p = sub.add_parser(name)
+        p.add_argument("--host", default="127.0.0.1")
+        p.add_argument("--port", type=int, default=8080)
+        p.add_argument("--backend", default="ultralytics:yolov8n.pt", help="kind:model[:size[:roi]], or none for a stub detector")
+        p.add_argument("--workers", type=int, default=2, help="inference worker processes")
+        p.add_argument("--max-batch", type=int, default=8)
+    p_load = sub.choices["load"]
+    p_load.add_argument("--clients", type=int, default=10)
+    p_load.add_argument("--seconds", type=float, default=10.0)
+    p_load.add_argument("--fps", type=float, default=5.0)
+    p_load.add_argument("--spawn", action="store_true", help="start a server in this process first")
+    args = parser.parse_args(argv)
+
+    tracing.enable()
+    if args.command == "serve":
+        app, pool = _build(args)
+        httpd = app.serve(args.host, args.port)
+        print(f"listening on http://{args.host}:{args.port}")
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            httpd.server_close()
+            pool.close()
+        return 0
+
+    httpd = pool = None
+    if args.spawn:
+        app, pool = _build(args)
+        httpd = app.serve(args.host, args.port)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        report = run_load(args.host, args.port, clients=args.clients, seconds=args.seconds, fps=args.fps)
+        if pool is not None:
+            report["pool"] = pool.stats()
+        print(json.dumps(report, indent=2))
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+        if pool is not None:
+            pool.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Deque, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import GOOGLE_MAPS_API_KEY, ORS_API_KEY
+from guidance import GuidanceScheduler
+from inference import Detection, create_backend
+from main import choose_route, guidance_loop
+from routing import Router
+from speech import Transcript
+from tts_queue import ALERT, PROMPT
+from vision import VisionLoop
+
+try:
+    import resource  # not available on Windows
+except Exception:
+    resource = None  # type: ignore
+
+_ANSWERS = ("one", "two", "three", "walking", "driving", "the first one", "bus")
+
+
+class VirtualClock:
+    """Session time that runs ``1 / scale`` times faster than the wall clock."""
+
+    def __init__(self, scale: float):
+        self.scale = scale
+        self._t0 = time.perf_counter()
+
+    def now(self) -> float:
+        return (time.perf_counter() - self._t0) / self.scale
+
+
+class ScriptedVoice:
+    """Stands in for VoiceIO: answers prompts from a script and times how fast the session responds.
+
+    A response latency is the time from an answer being heard to the next
+    thing the session says.
+    """
+
+    def __init__(self, answers: Sequence[str]):
+        self.answers: Deque[str] = deque(answers)
+        self.said = 0
+        self.alerts = 0
+        self.response_latencies: List[float] = []
+        self._answered_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def say(self, text: str, wait: bool = True, priority: int = PROMPT, key: Optional[str] = None, max_age_sec: Optional[float] = None) -> Future:
+        now = time.perf_counter()
+        with self._lock:
+            self.said += 1
+            if priority == ALERT:
+                self.alerts += 1
+            if self._answered_at is not None:
+                self.response_latencies.append(now - self._answered_at)
+                self._answered_at = None
+        future: Future = Future()
+        future.set_result(True)
+        return future
+
+    def alert(self, text: str) -> Future:
+        return self.say(text, wait=False, priority=ALERT)
+
+    def cancel(self, key: str) -> bool:
+        return False
+
+    def ask(self, prompt: str, timeout: Optional[int] = None, grammar: Optional[List[str]] = None) -> str:
+        return self.ask_transcript(prompt, timeout=timeout, grammar=grammar).text
+
+    def ask_transcript(self, prompt: str, timeout: Optional[int] = None, grammar: Optional[List[str]] = None) -> Transcript:
+        self.say(prompt)
+        with self._lock:
+            text = self.answers.popleft() if self.answers else "go"
+            self._answered_at = time.perf_counter()
+        return Transcript(text, True)
+
+
+class ScriptedBackend:
+    """Detector stand-in: a person walks into view for ``duration_sec`` every ``period_sec`` of session time."""
+
+    def __init__(self, clock: VirtualClock, period_sec: float = 90.0, duration_sec: float = 30.0, offset_sec: float = 0.0):
+        self.clock = clock
+        self.period_sec = period_sec
+        self.duration_sec = duration_sec
+        self.offset_sec = offset_sec
+        self.last_timings: Dict[str, float] = {}
+
+    def detect(self, frame) -> List[Detection]:
+        phase = (self.clock.now() + self.offset_sec) % self.period_sec
+        if phase >= self.duration_sec:
+            return []
+        h, w = frame.shape[:2]
+        half = (0.1 + 0.3 * phase / self.duration_sec) * min(h, w)
+        cx, cy = w / 2.0, h / 2.0
+        return [Detection("person", 0.9, (cx - half, cy - half, cx + half, cy + half))]
+
+
+class FrameFeeder:
+    """Delivers replayed frames to every session's vision pipeline at ``fps`` real frames per second.
+
+    Sessions are split across ``workers`` threads; a shard that falls behind
+    skips ahead rather than queueing, as a live camera would.
+    """
+
+    def __init__(self, frames: Sequence[np.ndarray], fps: float, workers: int):
+        self.frames = frames
+        self.interval = 1.0 / fps
+        self._shards: List[List[list]] = [[] for _ in range(max(1, workers))]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._next = 0
+        self.frame_times: Deque[float] = deque(maxlen=100000)
+        self._threads = [threading.Thread(target=self._run, args=(shard,), daemon=True) for shard in self._shards]
+        for t in self._threads:
+            t.start()
+
+    def add(self, vision: VisionLoop, clock: VirtualClock) -> list:
+        entry = [vision, clock, 0]
+        with self._lock:
+            self._shards[self._next % len(self._shards)].append(entry)
+            self._next += 1
+        return entry
+
+    def remove(self, entry: list):
+        with self._lock:
+            for shard in self._shards:
+                if entry in shard:
+                    shard.remove(entry)
+
+    def close(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=2)
+
+    def _run(self, shard: List[list]):
+        next_at = time.perf_counter()
+        while not self._stop.is_set():
+            with self._lock:
+                entries = list(shard)
+            for entry in entries:
+                vision, clock, seq = entry
+                seq += 1
+                entry[2] = seq
+                t0 = time.perf_counter()
+                try:
+                    vision.handle_frame(self.frames[seq % len(self.frames)], clock.now(), seq)
+                except Exception:
+                    pass
+                self.frame_times.append(time.perf_counter() - t0)
+            next_at = max(next_at + self.interval, time.perf_counter())
+            self._stop.wait(max(0.0, next_at - time.perf_counter()))
+
+
+def synthetic_frames(count: int = 16, size=(120, 160), seed: int = 0) -> List[np.ndarray]:
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 255, (size[0], size[1], 3), dtype=np.uint8) for _ in range(count)]
+
+
+def load_frames(source: str, limit: int = 100) -> List[np.ndarray]:
+    from vision_replay import iter_frames
+
+    frames = []
+    for _, _, frame in iter_frames(source):
+        frames.append(frame)
+        if len(frames) >= limit:
+            break
+    return frames
+
+
+def run_session(index: int, router: Router, feeder: FrameFeeder, scheduler: GuidanceScheduler, scale: float, backend_spec: str, origin: str, destination: str) -> Dict[str, object]:
+    rng = random.Random(index)
+    voice = ScriptedVoice([rng.choice(_ANSWERS), rng.choice(("wait", "go")), "go"])
+    clock = VirtualClock(scale)
+    if backend_spec:
+        from vision_replay import parse_backend_spec
+
+        backend = create_backend(parse_backend_spec(backend_spec))
+    else:
+        backend = ScriptedBackend(clock, offset_sec=rng.uniform(0, 90))
+    vision = VisionLoop(enabled=True, voice_say=lambda text: voice.say(text, wait=False), voice_alert=voice.alert, demo_mode=False, backend=backend, clock=clock.now)
+    started = time.perf_counter()
+    options = router.get_routes(origin, destination)
+    selection = choose_route(voice, options)
+    entry = feeder.add(vision, clock)
+    try:
+        arrived = guidance_loop(voice, selection, vision=vision, demo_mode=False, scheduler=scheduler, time_scale=scale)
+    finally:
+        feeder.remove(entry)
+    return {
+        "arrived": arrived,
+        "wall_sec": time.perf_counter() - started,
+        "route_minutes": selection.duration_min,
+        "response": voice.response_latencies,
+        # Vision latencies are on the session clock; convert back to real seconds
+        "alert": [v * scale for v in vision.alert_latencies],
+        "alerts": voice.alerts,
+        "frames": vision.frames_processed,
+    }
+
+
+def run_level(sessions: int, scale: float, fps: float, frames: Sequence[np.ndarray], backend_spec: str = "", origin: str = "current location", destination: str = "central park") -> Dict[str, object]:
+    """Run ``sessions`` concurrent sessions to completion and summarize the load."""
+    router = Router(demo_mode=not (GOOGLE_MAPS_API_KEY or ORS_API_KEY), google_key=GOOGLE_MAPS_API_KEY, ors_key=ORS_API_KEY)
+    scheduler = GuidanceScheduler(max_workers=max(4, min(64, sessions)))
+    feeder = FrameFeeder(frames, fps, workers=os.cpu_count() or 1)
+    _warm_up(frames)
+    sampler = _RssSampler()
+    baseline = _rss_bytes()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=sessions, thread_name_prefix="session") as pool:
+            results = list(pool.map(lambda i: run_session(i, router, feeder, scheduler, scale, backend_spec, origin, destination), range(sessions)))
+    finally:
+        cpu = time.process_time() - cpu0
+        wall = time.perf_counter() - wall0
+        peak = sampler.stop()
+        feeder.close()
+        scheduler.close()
+    cores_used = cpu / wall if wall > 0 else 0.0
+    response = [v for r in results for v in r["response"]]
+    alert = [v for r in results for v in r["alert"]]
+    return {
+        "sessions": sessions,
+        "completed": sum(1 for r in results if r["arrived"]),
+        "wall_sec": round(wall, 2),
+        "cpu_sec": round(cpu, 2),
+        "cores_used": round(cores_used, 2),
+        "sessions_per_core": round(sessions / cores_used, 1) if cores_used > 0 else None,
+        "response_p50_ms": _percentile_ms(response, 0.5),
+        "response_p99_ms": _percentile_ms(response, 0.99),
+        "alert_p50_ms": _percentile_ms(alert, 0.5),
+        "alert_p99_ms": _percentile_ms(alert, 0.99),
+        "frame_p50_ms": _percentile_ms(list(feeder.frame_times), 0.5),
+        "frame_p99_ms": _percentile_ms(list(feeder.frame_times), 0.99),
+        "frames": sum(r["frames"] for r in results),
+        "alerts": sum(r["alerts"] for r in results),
+        "memory_per_session_kb": round(max(0, peak - baseline) / 1024.0 / sessions, 1) if peak else None,
+    }
+
+
+def _warm_up(frames: Sequence[np.ndarray]):
+    # Lazy imports and first-call costs shouldn't count against the first session
+    clock = VirtualClock(1.0)
+    vision = VisionLoop(enabled=True, voice_say=lambda text: None, demo_mode=False, backend=ScriptedBackend(clock), clock=clock.now)
+    for seq, frame in enumerate(frames[:3], start=1):
+        vision.handle_frame(frame, clock.now(), seq)
+
+
+class _RssSampler:
+    def __init__(self, interval_sec: float = 0.1):
+        self.peak = _rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval_sec,), daemon=True)
+        self._thread.start()
+
+    def _run(self, interval_sec: float):
+        while not self._stop.wait(interval_sec):
+            self.peak = max(self.peak, _rss_bytes())
+
+    def stop(self) -> int:
+        self._stop.set()
+        self._thread.join(timeout=1)
+        return max(self.peak, _rss_bytes())
+
+
+def _rss_bytes() -> int:
+    """Current resident set size; falls back to the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/statm", "r") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    return 0
+
+
+def _percentile_ms(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0, 3)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Drive many headless navigation sessions at once and report the load")
+    parser.add_argument("--sessions", default="1,10,50", help="comma-separated session counts to run, one level after another")
+    parser.add_argument("--time-scale", type=float, default=0.01, help="real seconds per session second (0.01: 100 session seconds pass per real second)")
+    parser.add_argument("--fps", type=float, default=10.0, help="camera frames per real second per session")
+    parser.add_argument("--frames", default="", help="video or image folder to replay (default: synthetic frames)")
+    parser.add_argument("--backend", default="", help="kind:model[:size[:roi]] for real inference (default: scripted detections)")
+    parser.add_argument("--destination", default="central park")
+    parser.add_argument("--out", default="", help="write the JSON report here as well")
+    args = parser.parse_args(argv)
+
+    frames = load_frames(args.frames) if args.frames else synthetic_frames()
+    rows = []
+    for n in (int(s) for s in args.sessions.split(",") if s.strip()):
+        rows.append(run_level(n, args.time_scale, args.fps, frames, backend_spec=args.backend, destination=args.destination))
+        sys.stderr.write(json.dumps(rows[-1]) + "\n")
+    text = json.dumps({"cores": os.cpu_count(), "time_scale": args.time_scale, "levels": rows}, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,429 @@
+from __future__ import annotations
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from startup import lazy_import
+
+vosk = lazy_import("vosk")
+
+RATE = 16000
+CHUNK = 1600  # 100 ms of 16-bit mono
+
+Chunk = Tuple[bytes, float]  # (pcm, perf_counter time the chunk finished)
+
+
+class MicrophoneSource:
+    """One long-lived input stream, read continuously on its own thread.
+
+    Chunks wait in a bounded queue; when the consumer falls behind the oldest
+    audio is dropped rather than letting PyAudio overflow.
+    """
+
+    def __init__(self, rate: int = RATE, chunk: int = CHUNK, max_queued_sec: float = 5.0):
+        import pyaudio  # provided by SpeechRecognition dependency stack
+
+        self.rate = rate
+        self.chunk = chunk
+        self._queue: "queue.Queue[Chunk]" = queue.Queue(maxsize=max(1, int(max_queued_sec * rate / chunk)))
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(format=pyaudio.paInt16, channels=1, rate=rate, input=True, frames_per_buffer=chunk)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mic", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                data = self._stream.read(self.chunk, exception_on_overflow=False)
+            except Exception:
+                time.sleep(0.05)
+                continue
+            item = (data, time.perf_counter())
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self._queue.put_nowait(item)
+
+    def read(self, timeout: float = 1.0) -> Optional[Chunk]:
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self._closed.set()
+        self._thread.join(timeout=1)
+        try:
+            self._stream.stop_stream()
+            self._stream.close()
+        finally:
+            self._pa.terminate()
+
+
+class WavSource:
+    """Feeds 16 kHz mono 16-bit WAV files in place of the microphone.
+
+    Each file is followed by ``tail_silence_sec`` of silence so endpointing can
+    fire. With ``realtime`` chunks are paced at the audio rate; otherwise they
+    are delivered as fast as they are read.
+    """
+
+    def __init__(self, paths: List[str], chunk: int = CHUNK, realtime: bool = False, tail_silence_sec: float = 1.5):
+        self.rate = RATE
+        self.chunk = chunk
+        self.realtime = realtime
+        self._pending: Deque[bytes] = deque()
+        silence = b"\x00\x00" * int(tail_silence_sec * RATE)
+        for path in paths:
+            with wave.open(path, "rb") as wf:
+                if wf.getframerate() != RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+                    raise ValueError(f"{path}: expected 16 kHz mono 16-bit PCM")
+                pcm = wf.readframes(wf.getnframes()) + silence
+            step = chunk * 2
+            self._pending.extend(pcm[i:i + step] for i in range(0, len(pcm), step))
+        self._next_due: Optional[float] = None
+
+    def read(self, timeout: float = 1.0) -> Optional[Chunk]:
+        if not self._pending:
+            return None
+        data = self._pending.popleft()
+        if self.realtime:
+            now = time.perf_counter()
+            self._next_due = (self._next_due or now) + len(data) / 2 / RATE
+            if self._next_due > now:
+                time.sleep(self._next_due - now)
+        return data, time.perf_counter()
+
+    def close(self):
+        self._pending.clear()
+
+
+class EnergyVAD:
+    """Speech/non-speech per chunk from RMS energy against a running noise floor."""
+
+    def __init__(self, threshold_ratio: float = 3.0, min_rms: float = 300.0, noise_alpha: float = 0.05):
+        self.threshold_ratio = threshold_ratio
+        self.min_rms = min_rms
+        self.noise_alpha = noise_alpha
+        self.noise = min_rms / threshold_ratio
+
+    def is_speech(self, pcm: bytes) -> bool:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples))) if samples.size else 0.0
+        speech = rms > max(self.min_rms, self.threshold_ratio * self.noise)
+        if not speech:
+            self.noise += self.noise_alpha * (rms - self.noise)
+        return speech
+
+
+@dataclass
+class Transcript:
+    text: str
+    final: bool
+    # Mean per-word recognizer confidence (1.0 when the engine gives none)
+    confidence: float = 1.0
+    # Seconds of trailing silence needed to end the utterance, and decoding time after that
+    endpoint_delay_sec: float = 0.0
+    decode_sec: float = 0.0
+
+    @property
+    def latency_sec(self) -> float:
+        """End of speech to final text."""
+        return self.endpoint_delay_sec + self.decode_sec
+
+
+class StreamingRecognizer:
+    """Long-lived Vosk recognizer over a continuous audio source.
+
+    ``listen`` yields partial transcripts as they change and ends with the
+    final one as soon as the VAD sees ``end_silence_ms`` of silence after
+    speech, or Kaldi's own endpointer fires first. Audio captured while
+    muted (i.e. while the assistant is talking) is thrown away.
+
+    A prompt can pass a ``grammar`` (list of phrases) to restrict decoding;
+    one recognizer is kept per distinct grammar so switching costs nothing.
+    ``recognizer_factory`` replaces ``vosk.KaldiRecognizer``, called with the
+    same arguments.
+    """
+
+    def __init__(
+        self,
+        model,
+        source,
+        vad: Optional[EnergyVAD] = None,
+        start_ms: int = 200,
+        end_silence_ms: int = 600,
+        preroll_ms: int = 300,
+        max_utterance_sec: float = 10.0,
+        echo_tail_sec: float = 0.2,
+        recognizer_factory: Optional[Callable[..., object]] = None,
+    ):
+        self.source = source
+        self.rate = getattr(source, "rate", RATE)
+        self.vad = vad or EnergyVAD()
+        self.start_ms = start_ms
+        self.end_silence_ms = end_silence_ms
+        self.preroll_ms = preroll_ms
+        self.max_utterance_sec = max_utterance_sec
+        self.echo_tail_sec = echo_tail_sec
+        self._model = model
+        self._new_recognizer = recognizer_factory or (lambda *args: vosk.KaldiRecognizer(*args))
+        self._recognizers: Dict[str, object] = {}
+        self._recognizer_for(None)
+        self._mute_depth = 0
+        self._unmuted_at = 0.0
+        self._lock = threading.Lock()
+        self.latencies: Deque[float] = deque(maxlen=200)
+
+    def mute(self):
+        with self._lock:
+            self._mute_depth += 1
+
+    def unmute(self):
+        with self._lock:
+            self._mute_depth = max(0, self._mute_depth - 1)
+            if not self._mute_depth:
+                self._unmuted_at = time.perf_counter() + self.echo_tail_sec
+
+    def _audible(self, captured_at: float) -> bool:
+        with self._lock:
+            return not self._mute_depth and captured_at > self._unmuted_at
+
+    def _recognizer_for(self, grammar: Optional[List[str]]):
+        key = json.dumps(sorted(set(grammar))) if grammar else ""
+        rec = self._recognizers.get(key)
+        if rec is None:
+            if grammar:
+                rec = self._new_recognizer(self._model, self.rate, json.dumps(list(grammar) + ["[unk]"]))
+            else:
+                rec = self._new_recognizer(self._model, self.rate)
+            try:
+                rec.SetWords(True)  # per-word confidences in the final result
+            except Exception:
+                pass
+            self._recognizers[key] = rec
+        return rec
+
+    def recognize(self, timeout: Optional[float] = None, grammar: Optional[List[str]] = None) -> Transcript:
+        final = Transcript("", True)
+        for t in self.listen(timeout, grammar=grammar):
+            if t.final:
+                final = t
+        return final
+
+    def listen(self, timeout: Optional[float] = None, grammar: Optional[List[str]] = None) -> Iterator[Transcript]:
+        """Yield partials for one utterance, then a final transcript ("" if nobody spoke).
+
+        ``timeout`` bounds the wait, in seconds of audio, for speech to begin.
+        """
+        rec = self._recognizer_for(grammar)
+        chunk_ms = 1000.0 * getattr(self.source, "chunk", CHUNK) / self.rate
+        preroll: Deque[bytes] = deque(maxlen=max(1, int(self.preroll_ms / chunk_ms)))
+        waited_ms = speech_ms = silence_ms = utterance_ms = 0.0
+        in_utterance = False
+        last_partial = ""
+        while True:
+            item = self.source.read(timeout=1.0)
+            if item is None:
+                if in_utterance:
+                    break  # source ran dry mid-utterance
+                yield Transcript("", True)
+                return
+            pcm, captured_at = item
+            if not self._audible(captured_at):
+                preroll.clear()
+                speech_ms = 0.0
+                continue
+            speech = self.vad.is_speech(pcm)
+            if not in_utterance:
+                preroll.append(pcm)
+                waited_ms += chunk_ms
+                speech_ms = speech_ms + chunk_ms if speech else 0.0
+                if speech_ms >= self.start_ms:
+                    in_utterance = True
+                    for buffered in preroll:
+                        rec.AcceptWaveform(buffered)
+                    preroll.clear()
+                elif timeout is not None and waited_ms >= timeout * 1000.0:
+                    yield Transcript("", True)
+                    return
+                continue
+            utterance_ms += chunk_ms
+            silence_ms = 0.0 if speech else silence_ms + chunk_ms
+            fed_at = time.perf_counter()
+            if rec.AcceptWaveform(pcm):
+                # Kaldi's endpointer beat the VAD
+                yield self._finish(rec, rec.Result(), silence_ms, fed_at)
+                return
+            partial = _text(rec.PartialResult(), "partial")
+            if partial and partial != last_partial:
+                last_partial = partial
+                yield Transcript(partial, False)
+            if silence_ms >= self.end_silence_ms or utterance_ms >= self.max_utterance_sec * 1000.0:
+                break
+        endpoint_at = time.perf_counter()
+        yield self._finish(rec, rec.FinalResult(), silence_ms, endpoint_at)
+
+    def _finish(self, rec, result_json: str, silence_ms: float, endpoint_at: float) -> Transcript:
+        text, confidence = _final(result_json)
+        t = Transcript(text, True, confidence, endpoint_delay_sec=silence_ms / 1000.0, decode_sec=time.perf_counter() - endpoint_at)
+        try:
+            rec.Reset()
+        except Exception:
+            pass
+        self.latencies.append(t.latency_sec)
+        return t
+
+    def close(self):
+        self.source.close()
+
+
+def _text(result_json: str, key: str) -> str:
+    try:
+        return json.loads(result_json).get(key, "").strip()
+    except Exception:
+        return ""
+
+
+def _final(result_json: str) -> Tuple[str, float]:
+    """Text and mean word confidence of a Vosk final result; "[unk]" words count as zero."""
+    try:
+        obj = json.loads(result_json)
+    except Exception:
+        return "", 0.0
+    words = obj.get("result") or []
+    text = " ".join(w for w in obj.get("text", "").split() if w != "[unk]")
+    if not words:
+        return text, 1.0 if text else 0.0
+    confs = [0.0 if w.get("word") == "[unk]" else float(w.get("conf", 1.0)) for w in words]
+    return text, sum(confs) / len(confs)
+
+
+def transcribe_files(model_path: str, paths: List[str], realtime: bool = False) -> List[dict]:
+    """Run the WAVs through one persistent recognizer, as if spoken in turn into the mic."""
+    rec = StreamingRecognizer(vosk.Model(model_path), WavSource(paths, realtime=realtime))
+    out = []
+    for path in paths:
+        partials = 0
+        final = Transcript("", True)
+        start = time.perf_counter()
+        for t in rec.listen():
+            if t.final:
+                final = t
+            else:
+                partials += 1
+        out.append({
+            "file": path,
+            "text": final.text,
+            "partials": partials,
+            "endpoint_delay_ms": round(final.endpoint_delay_sec * 1000, 1),
+            "decode_ms": round(final.decode_sec * 1000, 1),
+            "latency_ms": round(final.latency_sec * 1000, 1),
+            "wall_ms": round((time.perf_counter() - start) * 1000, 1),
+        })
+    return out
+
+
+class _CountingRecognizer:
+    """Stand-in for ``vosk.KaldiRecognizer`` whose final text is the seconds of audio it was fed."""
+
+    def __init__(self, *args):
+        self.samples = 0
+
+    def SetWords(self, enabled: bool):
+        pass
+
+    def AcceptWaveform(self, pcm: bytes) -> bool:
+        self.samples += len(pcm) // 2
+        return False
+
+    def PartialResult(self) -> str:
+        return "{}"
+
+    def FinalResult(self) -> str:
+        return json.dumps({"text": f"{self.samples / RATE:.1f}"})
+
+    def Reset(self):
+        self.samples = 0
+
+
+def _write_wav(path: str, segments: List[Tuple[float, float]]):
+    """16 kHz mono WAV of (seconds, amplitude) segments: 0 is silence, otherwise a 440 Hz tone."""
+    parts = []
+    for seconds, amplitude in segments:
+        t = np.arange(int(seconds * RATE)) / RATE
+        parts.append((amplitude * np.sin(2 * np.pi * 440.0 * t)).astype(np.int16))
+    with wave.open(path, "wb") as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes(np.concatenate(parts).tobytes())
+
+
+def speech_check(model_path: str = "", wav: str = "", expect: str = "") -> List[str]:
+    """Pass/fail checks of endpointing and muting on synthetic WAVs; returns the failures.
+
+    Without a Vosk model a stand-in recognizer takes its place, so only the
+    VAD endpointing and mute handling are exercised. With ``model_path``,
+    ``wav`` is also transcribed and must contain ``expect``.
+    """
+    failures: List[str] = []
+    tone_sec = 0.8
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.wav")
+        _write_wav(path, [(0.4, 0), (tone_sec, 8000)])
+
+        # Each utterance ends after end_silence_ms of quiet and carries its speech, not the silence before it
+        rec = StreamingRecognizer(None, WavSource([path, path]), recognizer_factory=_CountingRecognizer)
+        for i in range(2):
+            final = rec.recognize()
+            fed = float(final.text or 0)
+            if abs(final.endpoint_delay_sec - rec.end_silence_ms / 1000.0) > 1e-6:
+                failures.append(f"utterance {i + 1} ended after {final.endpoint_delay_sec:.2f} s of silence, expected {rec.end_silence_ms / 1000.0:.2f}")
+            if not tone_sec <= fed <= tone_sec + (rec.preroll_ms + rec.end_silence_ms) / 1000.0:
+                failures.append(f"utterance {i + 1} fed {fed:.1f} s of audio for a {tone_sec} s tone")
+        if rec.recognize().text:
+            failures.append("a drained source still produced an utterance")
+
+        # Audio heard while muted (the assistant talking) never reaches the recognizer
+        rec = StreamingRecognizer(None, WavSource([path]), recognizer_factory=_CountingRecognizer)
+        rec.mute()
+        if rec.recognize().text:
+            failures.append("audio captured while muted started an utterance")
+
+    if model_path:
+        final = StreamingRecognizer(vosk.Model(model_path), WavSource([wav])).recognize()
+        if expect.lower() not in final.text.lower():
+            failures.append(f"{wav}: heard {final.text!r}, expected {expect!r}")
+    return failures
+
+
+if __name__ == "__main__":
+    # python speech.py <vosk-model-dir> utterance1.wav [utterance2.wav ...] [--realtime]
+    # python speech.py check [<vosk-model-dir> <file.wav> <expected text>]
+    if sys.argv[1:2] == ["check"]:
+        failures = speech_check(*sys.argv[2:5])
+        for failure in failures:
+            sys.stdout.write(f"FAIL: {failure}\n")
+        sys.stdout.write("ok\n" if not failures else "")
+        sys.exit(1 if failures else 0)
+    args = [a for a in sys.argv[1:] if a != "--realtime"]
+    if len(args) < 2:
+        print("usage: speech.py <vosk-model-dir> <file.wav> ... [--realtime]")
+        sys.exit(2)
+    print(json.dumps(transcribe_files(args[0], args[1:], realtime="--realtime" in sys.argv), indent=2))
@@ -0,0 +1,93 @@
+from __future__ import annotations
+import importlib
+import importlib.util
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access.
+
+    Lets heavy optional dependencies (cv2, pyttsx3, vosk, ...) sit at module
+    level as usual without costing anything until a code path really uses them.
+    """
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        """True if the module is installed; checked without importing it."""
+        if self._module is not None:
+            return True
+        try:
+            return importlib.util.find_spec(self._name) is not None
+        except Exception:
+            return False
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+
+def lazy_import(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+class StartupTimer:
+    """Records named startup phases from any thread against one start time.
+
+    ``mark`` notes milestones such as the first prompt or first detection; the
+    report lists every phase and, per milestone, the phases finished before it.
+    """
+
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.phases: List[Dict[str, object]] = []
+        self.milestones: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name: str, start: float, end: float):
+        with self._lock:
+            self.phases.append({"name": name, "start": start - self.t0, "end": end - self.t0, "thread": threading.current_thread().name})
+
+    def mark(self, milestone: str):
+        """Record the first time ``milestone`` is reached; later calls are ignored."""
+        now = time.perf_counter() - self.t0
+        with self._lock:
+            self.milestones.setdefault(milestone, now)
+
+    def report(self) -> Dict[str, object]:
+        with self._lock:
+            phases = sorted(self.phases, key=lambda p: p["start"])
+            milestones = dict(self.milestones)
+        out: Dict[str, object] = {
+            "phases": [
+                {"name": p["name"], "start_ms": round(p["start"] * 1000, 1), "duration_ms": round((p["end"] - p["start"]) * 1000, 1), "thread": p["thread"]}
+                for p in phases
+            ]
+        }
+        for milestone, at in sorted(milestones.items(), key=lambda kv: kv[1]):
+            out[milestone] = {
+                "at_ms": round(at * 1000, 1),
+                "after": [p["name"] for p in phases if p["end"] <= at],
+            }
+        return out
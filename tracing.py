@@ -0,0 +1,219 @@
+from __future__ import annotations
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+# None while tracing is off; every entry point checks this first so disabled tracing costs one global lookup
+_tracer: Optional["Tracer"] = None
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+LabelKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+class Tracer:
+    """Collects spans and counters from any thread.
+
+    Spans are kept as Chrome trace "complete" events (bounded by
+    ``max_events``) and also folded into per-name count/total/max so the
+    summary and Prometheus export stay exact however long the session runs.
+    """
+
+    def __init__(self, max_events: int = 200000):
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+        self.events: Deque[dict] = deque(maxlen=max_events)
+        self.spans: Dict[str, List[float]] = {}  # name -> [count, total_sec, max_sec]
+        self.counters: Dict[LabelKey, float] = {}
+        self.threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, args: Optional[dict] = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), args)
+
+    def record(self, name: str, start: float, end: float, args: Optional[dict] = None):
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": round((start - self.t0) * 1e6, 1),
+            "dur": round((end - start) * 1e6, 1),
+            "pid": self.pid,
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        dur = end - start
+        with self._lock:
+            self.events.append(event)
+            self.threads.setdefault(thread.ident, thread.name)
+            agg = self.spans.get(name)
+            if agg is None:
+                self.spans[name] = [1, dur, dur]
+            else:
+                agg[0] += 1
+                agg[1] += dur
+                agg[2] = max(agg[2], dur)
+
+    def count(self, name: str, value: float = 1.0, labels: Optional[Dict[str, str]] = None):
+        key = (name, tuple(sorted((k, str(v)) for k, v in (labels or {}).items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def chrome_trace(self) -> dict:
+        with self._lock:
+            events = list(self.events)
+            threads = dict(self.threads)
+        meta = [{"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}} for tid, name in threads.items()]
+        return {"traceEvents": meta + events, "displayTimeUnit": "ms"}
+
+    def prometheus_text(self, prefix: str = "blindnav") -> str:
+        with self._lock:
+            spans = {k: list(v) for k, v in self.spans.items()}
+            counters = dict(self.counters)
+        lines = [
+            f"# TYPE {prefix}_span_seconds summary",
+        ]
+        for name, (count, total, _) in sorted(spans.items()):
+            lines.append(f'{prefix}_span_seconds_count{{span="{name}"}} {int(count)}')
+            lines.append(f'{prefix}_span_seconds_sum{{span="{name}"}} {total:.6f}')
+        lines.append(f"# TYPE {prefix}_span_seconds_max gauge")
+        for name, (_, _, peak) in sorted(spans.items()):
+            lines.append(f'{prefix}_span_seconds_max{{span="{name}"}} {peak:.6f}')
+        for metric in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {prefix}_{metric}_total counter")
+            for (name, labels), value in sorted(counters.items()):
+                if name != metric:
+                    continue
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{prefix}_{metric}_total{{{label_text}}} {value:g}" if label_text else f"{prefix}_{metric}_total {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> List[Dict[str, float]]:
+        """Per-span totals, largest first."""
+        with self._lock:
+            spans = {k: list(v) for k, v in self.spans.items()}
+        rows = [
+            {"span": name, "count": int(c), "total_ms": round(t * 1000, 1), "mean_ms": round(t * 1000 / c, 2), "max_ms": round(m * 1000, 1)}
+            for name, (c, t, m) in spans.items()
+        ]
+        return sorted(rows, key=lambda r: -r["total_ms"])
+
+
+def enable(max_events: int = 200000) -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer(max_events=max_events)
+    return _tracer
+
+
+def disable():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, **args):
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, args or None)
+
+
+def record(name: str, start: float, end: float):
+    """Add a span measured elsewhere on the ``time.perf_counter`` clock."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.record(name, start, end)
+
+
+def count(name: str, value: float = 1.0, **labels):
+    tracer = _tracer
+    if tracer is not None:
+        tracer.count(name, value, labels)
+
+
+def traced(name: str):
+    """Decorator form of ``span``."""
+
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                tracer.record(name, start, time.perf_counter())
+
+        return inner
+
+    return wrap
+
+
+def write_chrome_trace(path: str):
+    """Write the trace for chrome://tracing or https://ui.perfetto.dev."""
+    if _tracer is not None:
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(_tracer.chrome_trace(), fh)
+
+
+def write_prometheus(path: str):
+    if _tracer is not None:
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(_tracer.prometheus_text())
+
+
+def serve_prometheus(port: int, host: str = "127.0.0.1"):
+    """Serve the current metrics at http://host:port/metrics from a daemon thread."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics" or _tracer is None:
+                self.send_error(404)
+                return
+            body = _tracer.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+def format_summary(rows: List[Dict[str, float]]) -> str:
+    lines = [f"{'span':32} {'count':>7} {'total ms':>10} {'mean ms':>9} {'max ms':>9}"]
+    for r in rows:
+        lines.append(f"{r['span']:32} {r['count']:>7} {r['total_ms']:>10.1f} {r['mean_ms']:>9.2f} {r['max_ms']:>9.1f}")
+    return "\n".join(lines)
@@ -0,0 +1,169 @@
+from __future__ import annotations
+import itertools
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from inference import Detection
+
+Box = Tuple[float, float, float, float]
+
+
+def iou(a: Box, b: Box) -> float:
+    ix = max(0.0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0.0, min(a[3], b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+class Track:
+    """One object followed across frames with a constant-velocity Kalman filter.
+
+    State is (cx, cy, w, h) plus their rates of change per second, so ``vh``
+    directly gives how fast the object is growing in view.
+    """
+
+    _ids = itertools.count(1)
+
+    def __init__(self, det: Detection, process_noise: float = 1.0, measurement_noise: float = 4.0):
+        self.id = next(Track._ids)
+        self.name = det.name
+        self.confidence = det.confidence
+        x1, y1, x2, y2 = det.box
+        self.x = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1, 0, 0, 0, 0], dtype=np.float64)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 1000.0, 1000.0, 1000.0, 1000.0])
+        self.q = process_noise
+        self.R = np.eye(4) * measurement_noise
+        self.hits = 1
+        self.misses = 0
+        self.age = 0.0
+        self.announced = False
+        self.approach_announced = False
+
+    @property
+    def box(self) -> Box:
+        cx, cy, w, h = self.x[:4]
+        return cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2
+
+    @property
+    def growth_rate(self) -> float:
+        """Relative height growth per second; positive means the object is getting closer."""
+        h = self.x[3]
+        return float(self.x[7] / h) if h > 1e-6 else 0.0
+
+    @property
+    def time_to_contact(self) -> Optional[float]:
+        """Seconds until contact, estimated from box growth (h / dh/dt); None if not approaching."""
+        g = self.growth_rate
+        return 1.0 / g if g > 1e-6 else None
+
+    def predict(self, dt: float):
+        F = np.eye(8)
+        F[0, 4] = F[1, 5] = F[2, 6] = F[3, 7] = dt
+        Q = np.eye(8) * self.q * max(dt, 1e-3)
+        self.x = F @ self.x
+        self.x[2] = max(self.x[2], 1.0)
+        self.x[3] = max(self.x[3], 1.0)
+        self.P = F @ self.P @ F.T + Q
+        self.age += dt
+
+    def update(self, det: Detection):
+        x1, y1, x2, y2 = det.box
+        z = np.array([(x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1])
+        H = np.zeros((4, 8))
+        H[0, 0] = H[1, 1] = H[2, 2] = H[3, 3] = 1.0
+        S = H @ self.P @ H.T + self.R
+        K = self.P @ H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ (z - H @ self.x)
+        self.P = (np.eye(8) - K @ H) @ self.P
+        self.confidence = det.confidence
+        self.hits += 1
+        self.misses = 0
+
+
+class IoUTracker:
+    """Associates detections with existing tracks by greedy same-class IoU matching.
+
+    Between detection rounds ``predict`` moves every track forward so callers
+    can skip the detector on most frames. Tracks unmatched for ``max_misses``
+    detection rounds are dropped.
+    """
+
+    def __init__(self, iou_threshold: float = 0.3, max_misses: int = 3):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks: List[Track] = []
+
+    def predict(self, dt: float) -> List[Track]:
+        for t in self.tracks:
+            t.predict(dt)
+        return self.tracks
+
+    def update(self, detections: Iterable[Detection], dt: float) -> List[Track]:
+        """Predict by ``dt`` then fold in a fresh set of detections; returns newly created tracks."""
+        self.predict(dt)
+        detections = list(detections)
+        pairs = []
+        for ti, t in enumerate(self.tracks):
+            for di, d in enumerate(detections):
+                if t.name == d.name:
+                    v = iou(t.box, d.box)
+                    if v >= self.iou_threshold:
+                        pairs.append((v, ti, di))
+        pairs.sort(reverse=True)
+        used_t, used_d = set(), set()
+        for _, ti, di in pairs:
+            if ti in used_t or di in used_d:
+                continue
+            used_t.add(ti)
+            used_d.add(di)
+            self.tracks[ti].update(detections[di])
+        for ti, t in enumerate(self.tracks):
+            if ti not in used_t:
+                t.misses += 1
+        self.tracks = [t for t in self.tracks if t.misses <= self.max_misses]
+        new = [Track(d) for di, d in enumerate(detections) if di not in used_d]
+        self.tracks.extend(new)
+        return new
+
+
+class ApproachAlerts:
+    """Turns tracks into spoken alerts: once per new hazard, and again if it starts approaching.
+
+    A track counts as approaching when its time-to-contact drops below
+    ``ttc_threshold_sec`` after at least ``min_hits`` detections, so one noisy
+    box doesn't produce a false "approaching".
+    """
+
+    def __init__(self, classes: Iterable[str], ttc_threshold_sec: float = 3.0, min_hits: int = 2):
+        self.classes = set(classes)
+        self.ttc_threshold_sec = ttc_threshold_sec
+        self.min_hits = min_hits
+
+    def active(self, tracks: Iterable[Track]) -> bool:
+        """True while any hazard-class track is still being detected."""
+        return any(t.name in self.classes and not t.misses for t in tracks)
+
+    def check(self, tracks: Iterable[Track]) -> Optional[str]:
+        """Return the most urgent pending alert, if any; others wait for the next frame."""
+        best: Optional[Tuple[float, str, Track, bool]] = None
+        for t in tracks:
+            if t.name not in self.classes or t.misses:
+                continue
+            ttc = t.time_to_contact
+            if t.hits >= self.min_hits and ttc is not None and ttc < self.ttc_threshold_sec and not t.approach_announced:
+                candidate = (ttc, f"{t.name} approaching", t, True)
+            elif not t.announced:
+                candidate = (float("inf"), f"{t.name} ahead", t, False)
+            else:
+                continue
+            if best is None or candidate[0] < best[0]:
+                best = candidate
+        if best is None:
+            return None
+        _, msg, track, approaching = best
+        track.announced = True
+        if approaching:
+            track.approach_announced = True
+        return msg
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional
+
+# Lower value speaks first
+ALERT = 0  # safety: obstacles, off-route
+PROMPT = 1  # questions and instructions the user needs
+ROUTINE = 2  # periodic updates such as "N minutes remaining"
+
+PRIORITY_NAMES = {ALERT: "alert", PROMPT: "prompt", ROUTINE: "routine"}
+
+_IDLE = object()
+
+
+@dataclass(order=True)
+class SpeechItem:
+    priority: int
+    seq: int
+    text: str = field(compare=False)
+    key: Optional[str] = field(compare=False, default=None)
+    expires_at: Optional[float] = field(compare=False, default=None)
+    enqueued_at: float = field(compare=False, default=0.0)
+    future: Future = field(compare=False, default_factory=Future)
+    cancelled: bool = field(compare=False, default=False)
+    attempts: int = field(compare=False, default=0)
+
+
+class SpeechQueue:
+    """Single speech worker fed by a priority queue.
+
+    ``submit`` never blocks; it returns a future that resolves to True once
+    the text has been spoken and False if it was dropped. A pending item is
+    dropped when a newer one with the same ``key`` replaces it or when it
+    outlives ``max_age_sec``. Submitting a higher-priority item while a
+    lower one is playing calls ``interrupt``; an interrupted prompt is
+    spoken again afterwards, an interrupted routine message is dropped.
+    ``interrupt`` and ``reset_interrupt`` run under the queue lock, so they
+    must not block: ``reset_interrupt`` is called just before each item is
+    handed to ``speak``, so an interrupt always targets the item playing.
+
+    ``on_idle`` is called on the worker whenever nothing is queued; it should
+    do one short unit of background work and return True while more remains.
+    """
+
+    def __init__(
+        self,
+        speak: Callable[[str], bool],
+        interrupt: Optional[Callable[[], None]] = None,
+        on_idle: Optional[Callable[[], bool]] = None,
+        reset_interrupt: Optional[Callable[[], None]] = None,
+    ):
+        # speak returns False if playback was interrupted
+        self._speak = speak
+        self._interrupt = interrupt
+        self._reset_interrupt = reset_interrupt
+        self._on_idle = on_idle
+        self._idle_work = on_idle is not None
+        self._heap: List[SpeechItem] = []
+        self._by_key: Dict[str, SpeechItem] = {}
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current: Optional[SpeechItem] = None
+        self._closed = False
+        self.max_depth = 0
+        self.dropped = 0
+        self.interrupted = 0
+        self.latencies: Dict[int, Deque[float]] = {p: deque(maxlen=500) for p in PRIORITY_NAMES}
+        self._thread = threading.Thread(target=self._run, name="speech", daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        with self._cond:
+            return self._depth_locked()
+
+    def submit(self, text: str, priority: int = PROMPT, key: Optional[str] = None, max_age_sec: Optional[float] = None) -> Future:
+        now = time.perf_counter()
+        item = SpeechItem(priority, next(self._seq), text, key, now + max_age_sec if max_age_sec else None, now)
+        with self._cond:
+            if self._closed:
+                item.future.set_result(False)
+                return item.future
+            if key is not None:
+                stale = self._by_key.get(key)
+                if stale is not None and not stale.cancelled:
+                    self._drop(stale)
+                self._by_key[key] = item
+            heapq.heappush(self._heap, item)
+            self._idle_work = self._on_idle is not None
+            self.max_depth = max(self.max_depth, self._depth_locked())
+            # Decided under the lock so the interrupt can't land on the next item instead
+            if self._current is not None and priority < self._current.priority and self._interrupt is not None:
+                self._interrupt()
+            self._cond.notify()
+        return item.future
+
+    def cancel(self, key: str) -> bool:
+        """Drop the pending item with ``key``, if any."""
+        with self._cond:
+            item = self._by_key.pop(key, None)
+            if item is None or item.cancelled:
+                return False
+            self._drop(item)
+            return True
+
+    def close(self, timeout: float = 2.0):
+        with self._cond:
+            self._closed = True
+            for item in self._heap:
+                if not item.cancelled:
+                    self._drop(item)
+            self._heap.clear()
+            self._cond.notify()
+        self._thread.join(timeout=timeout)
+
+    def stats(self) -> Dict[str, float]:
+        out: Dict[str, float] = {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "dropped": self.dropped,
+            "interrupted": self.interrupted,
+        }
+        for p, name in PRIORITY_NAMES.items():
+            values = sorted(self.latencies[p])
+            out[f"{name}_latency_p50_ms"] = round(1000 * values[len(values) // 2], 1) if values else 0.0
+            out[f"{name}_latency_max_ms"] = round(1000 * values[-1], 1) if values else 0.0
+        return out
+
+    def _depth_locked(self) -> int:
+        return sum(1 for item in self._heap if not item.cancelled)
+
+    def _drop(self, item: SpeechItem):
+        item.cancelled = True
+        self.dropped += 1
+        if not item.future.done():
+            item.future.set_result(False)
+
+    def _next(self) -> Optional[SpeechItem]:
+        """Next item to speak; None when closed, _IDLE when there is idle work to do."""
+        with self._cond:
+            while True:
+                while self._heap and self._heap[0].cancelled:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    item = heapq.heappop(self._heap)
+                    if item.key is not None and self._by_key.get(item.key) is item:
+                        del self._by_key[item.key]
+                    if item.expires_at is not None and time.perf_counter() > item.expires_at:
+                        self._drop(item)
+                        continue
+                    if self._reset_interrupt is not None:
+                        self._reset_interrupt()
+                    self._current = item
+                    return item
+                if self._closed:
+                    return None
+                if self._idle_work:
+                    return _IDLE
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            if item is _IDLE:
+                try:
+                    more = self._on_idle()
+                except Exception:
+                    more = False
+                with self._cond:
+                    if not more:
+                        self._idle_work = False
+                continue
+            if not item.attempts:
+                self.latencies[item.priority].append(time.perf_counter() - item.enqueued_at)
+            item.attempts += 1
+            try:
+                finished = self._speak(item.text)
+            except Exception:
+                finished = True
+            with self._cond:
+                self._current = None
+                if finished is False:
+                    self.interrupted += 1
+                    if item.priority <= PROMPT and not self._closed:
+                        # Say it again once the alert is out of the way
+                        item.seq = next(self._seq)
+                        heapq.heappush(self._heap, item)
+                        if item.key is not None:
+                            self._by_key.setdefault(item.key, item)
+                        continue
+                    self._drop(item)
+                    continue
+            item.future.set_result(True)
@@ -0,0 +1,323 @@
+from __future__ import annotations
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from events import CAUTION, ObstacleChanged
+from tracing import count, span
+
+Dispatch = Callable[[Callable[[], None]], None]
+
+# Package name app.py is loaded under when this file runs as a script
+_SCRIPT_PACKAGE = "_blindnav"
+
+
+class UITask:
+    """Handle for background work started from the UI; ``cancel`` drops its result."""
+
+    def __init__(self, group: str):
+        self.group = group
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+
+class UIWorkerPool:
+    """Runs blocking work (routing, speech) off the UI thread and hands results back to it.
+
+    ``dispatch`` schedules a callable on the UI thread; the Kivy app passes
+    one built on ``Clock.schedule_once``. Work is grouped, usually by the
+    screen that asked for it, so leaving a screen cancels everything it
+    started: queued work never runs and finished work never calls back.
+    A request already in flight (an HTTP call) runs to the end, but its
+    result is dropped. Speech has its own single-thread lane so utterances
+    never overlap. ``inline=True`` runs everything on the calling thread,
+    which is the old blocking behaviour, for comparison.
+    """
+
+    def __init__(self, dispatch: Dispatch, max_workers: int = 4, inline: bool = False):
+        self.dispatch = dispatch
+        self.inline = inline
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ui-worker")
+        self._speech = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ui-speech")
+        self._groups: Dict[str, Set[UITask]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args, on_done: Optional[Callable[[Any], None]] = None, on_error: Optional[Callable[[Exception], None]] = None, group: str = "", speech: bool = False) -> UITask:
+        task = UITask(group)
+        if self.inline:
+            self._run(task, fn, args, on_done, on_error)
+            return task
+        with self._lock:
+            self._groups.setdefault(group, set()).add(task)
+        executor = self._speech if speech else self._pool
+        task.future = executor.submit(self._run, task, fn, args, on_done, on_error)
+        return task
+
+    def speak(self, say: Callable[[str], None], text: str, group: str = "") -> UITask:
+        return self.submit(say, text, group=group, speech=True)
+
+    def call_soon(self, fn: Callable[..., None], *args):
+        """Run ``fn`` on the UI thread; for callbacks arriving on other threads."""
+        if self.inline:
+            fn(*args)
+        else:
+            self.dispatch(lambda: fn(*args))
+
+    def cancel(self, group: str) -> int:
+        with self._lock:
+            tasks = self._groups.pop(group, set())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            count("ui_tasks_cancelled", len(tasks), group=group or "none")
+        return len(tasks)
+
+    def cancel_all(self) -> int:
+        with self._lock:
+            groups = list(self._groups)
+        return sum(self.cancel(group) for group in groups)
+
+    def shutdown(self):
+        self.cancel_all()
+        self._pool.shutdown(wait=False)
+        self._speech.shutdown(wait=False)
+
+    def _run(self, task: UITask, fn, args, on_done, on_error):
+        callback, value = None, None
+        try:
+            if task.cancelled:
+                return
+            try:
+                with span("ui.task", group=task.group, fn=getattr(fn, "__name__", "")):
+                    callback, value = on_done, fn(*args)
+            except Exception as exc:
+                callback, value = on_error, exc
+        finally:
+            if callback is None:
+                self._forget(task)
+            else:
+                self._deliver(task, callback, value)
+
+    def _deliver(self, task: UITask, callback, value):
+        def _on_ui():
+            # The task stays in its group until now, so leaving the screen after the work finished still drops the result
+            self._forget(task)
+            if not task.cancelled:
+                callback(value)
+
+        if self.inline:
+            _on_ui()
+        else:
+            self.dispatch(_on_ui)
+
+    def _forget(self, task: UITask):
+        with self._lock:
+            tasks = self._groups.get(task.group)
+            if tasks is not None:
+                tasks.discard(task)
+                if not tasks:
+                    del self._groups[task.group]
+
+
+class FrameStats:
+    """Frame times collected while driving the UI, summarised as jank."""
+
+    def __init__(self):
+        self.frames: List[float] = []
+
+    def add(self, seconds: float):
+        self.frames.append(seconds)
+
+    def report(self, budget_sec: float = 1.0 / 60.0) -> Dict[str, object]:
+        ordered = sorted(self.frames)
+        janky = [f for f in ordered if f > budget_sec]
+
+        def pct(p: float) -> float:
+            if not ordered:
+                return 0.0
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0, 3)
+
+        return {
+            "frames": len(ordered),
+            "budget_ms": round(budget_sec * 1000.0, 3),
+            "frame_p50_ms": pct(0.50),
+            "frame_p99_ms": pct(0.99),
+            "frame_max_ms": round(ordered[-1] * 1000.0, 3) if ordered else 0.0,
+            "janky_frames": len(janky),
+            "janky_pct": round(100.0 * len(janky) / len(ordered), 2) if ordered else 0.0,
+            "dropped_frames": int(sum(f // budget_sec for f in janky)),
+        }
+
+
+class _SlowRouter:
+    """Stands in for the live router: demo routes after a network-sized delay."""
+
+    def __init__(self, latency_sec: float):
+        from routing import Router
+
+        self.latency_sec = latency_sec
+        self._router = Router(demo_mode=True)
+
+    def get_routes(self, origin: str, destination: str):
+        time.sleep(self.latency_sec)
+        return self._router.get_routes(origin, destination)
+
+
+class _SlowTTS:
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def say(self, text: str):
+        time.sleep(self.seconds)
+
+
+def _load_app():
+    if __package__:
+        return importlib.import_module(".app", __package__)
+    # Run as a script: app.py uses package-relative imports, so load it as part
+    # of a package rooted at this directory
+    if _SCRIPT_PACKAGE not in sys.modules:
+        package = types.ModuleType(_SCRIPT_PACKAGE)
+        package.__path__ = [os.path.dirname(os.path.abspath(__file__))]
+        sys.modules[_SCRIPT_PACKAGE] = package
+    return importlib.import_module(f"{_SCRIPT_PACKAGE}.app")
+
+
+def _headless_app(route_latency_sec: float, speech_sec: float, inline: bool = False):
+    """Build the Kivy app on the mock GL backend with slow stand-ins for routing and speech."""
+    os.environ.setdefault("KIVY_NO_ARGS", "1")
+    os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+    os.environ.setdefault("KIVY_GL_BACKEND", "mock")
+    from kivy.config import Config
+
+    Config.set("graphics", "maxfps", "0")  # callers pace frames themselves
+    module = _load_app()
+    app = module.BlindNavKivyApp(router=_SlowRouter(route_latency_sec), tts=_SlowTTS(speech_sec), inline=inline)
+    app.root = app.build()
+    return app
+
+
+def jank_bench(seconds: float = 5.0, inline: bool = False, route_latency_sec: float = 0.4, speech_sec: float = 0.8, fps: float = 60.0, action_every_sec: float = 0.5) -> Dict[str, object]:
+    """Drive the Kivy app headless at ``fps`` while a scripted user taps through it.
+
+    Each frame runs the Kivy clock once, so the time measured is the UI
+    thread's own work: button handlers plus callbacks marshalled back from
+    the workers. Routing and speech are replaced by sleeps of realistic
+    length.
+    """
+    app = _headless_app(route_latency_sec, speech_sec, inline)
+    from kivy.clock import Clock
+
+    actions = [
+        lambda: app.on_find_routes("central park"),
+        lambda: app.start_guidance("walking"),
+        lambda: app._on_obstacle(ObstacleChanged(True, CAUTION, "Obstacle ahead. Please wait.")),
+        lambda: app.stop_guidance(),
+        lambda: app.on_find_routes("library"),
+        lambda: app.go_back(),
+    ]
+    stats = FrameStats()
+    budget = 1.0 / fps
+    start = time.perf_counter()
+    next_action = start
+    step = 0
+    try:
+        while time.perf_counter() - start < seconds:
+            frame_start = time.perf_counter()
+            if frame_start >= next_action:
+                actions[step % len(actions)]()
+                step += 1
+                next_action = frame_start + action_every_sec
+            Clock.tick()
+            elapsed = time.perf_counter() - frame_start
+            stats.add(elapsed)
+            time.sleep(max(0.0, budget - elapsed))
+    finally:
+        app.on_stop()
+    report = stats.report(budget)
+    report.update({"mode": "inline" if inline else "pool", "actions": step})
+    return report
+
+
+def ui_check(seconds: float = 3.0, max_janky_pct: float = 2.0, max_frame_ms: float = 50.0) -> List[str]:
+    """Headless pass/fail checks of the Kivy app; returns the failures, empty when all pass.
+
+    The scripted bench must stay within the jank limits with routing and
+    speech on the workers, and a route search abandoned by leaving its
+    screen must never reach the widgets.
+    """
+    failures: List[str] = []
+    report = jank_bench(seconds)
+    if report["janky_pct"] > max_janky_pct:
+        failures.append(f"{report['janky_pct']}% janky frames, limit {max_janky_pct}%")
+    if report["frame_max_ms"] > max_frame_ms:
+        failures.append(f"slowest frame {report['frame_max_ms']} ms, limit {max_frame_ms} ms")
+
+    from kivy.clock import Clock
+
+    app = _headless_app(route_latency_sec=0.2, speech_sec=0.0)
+    try:
+        app.on_find_routes("library")
+        app.start_guidance("walking")  # leaves the menu while the search is in flight
+        until = time.perf_counter() + 0.6
+        while time.perf_counter() < until:
+            Clock.tick()
+            time.sleep(0.01)
+        if app.options or app.sm.current != "guide":
+            failures.append("a cancelled route search still updated the UI")
+    finally:
+        app.on_stop()
+    return failures
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Measure UI frame-time jank of the Kivy app, headless")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="tap through the app with slow routing and speech and report frame times")
+    bench.add_argument("--seconds", type=float, default=5.0)
+    bench.add_argument("--route-latency", type=float, default=0.4, help="seconds each routing request takes")
+    bench.add_argument("--speech", type=float, default=0.8, help="seconds each utterance takes")
+    bench.add_argument("--compare", action="store_true", help="also run with routing and speech on the UI thread")
+    bench.add_argument("--out", type=str, default="")
+    check = sub.add_parser("check", help="headless pass/fail test: jank limits and cancellation; exits 1 on failure")
+    check.add_argument("--seconds", type=float, default=3.0)
+    check.add_argument("--max-janky-pct", type=float, default=2.0)
+    check.add_argument("--max-frame-ms", type=float, default=50.0)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "check":
+        failures = ui_check(args.seconds, args.max_janky_pct, args.max_frame_ms)
+        for failure in failures:
+            sys.stdout.write(f"FAIL: {failure}\n")
+        sys.stdout.write("ok\n" if not failures else "")
+        return 1 if failures else 0
+
+    results = [jank_bench(args.seconds, False, args.route_latency, args.speech)]
+    if args.compare:
+        results.append(jank_bench(args.seconds, True, args.route_latency, args.speech))
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    sys.stdout.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
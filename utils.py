@@ -1,9 +1,12 @@
+import math
 import time
 from datetime import datetime, timedelta
-from typing import Tuple, Dict, Any
+from typing import Tuple, Dict, Any, Optional, List
 
 import requests
 
+from tracing import traced
+
 
 def minutes_to_eta_str(minutes: int) -> str:
     if minutes <= 0:
@@ -18,6 +21,12 @@ def now_plus_minutes(minutes: int) -> str:
     return eta.strftime("%I:%M %p").lstrip("0")
 
 
+def describe_distance(meters: float) -> str:
+    if meters >= 1000:
+        return f"{meters / 1000.0:.1f} kilometers"
+    return f"{max(10, int(round(meters / 10.0)) * 10)} meters"
+
+
 def sleep_seconds(s: float):
     try:
         time.sleep(s)
@@ -25,6 +34,61 @@ def sleep_seconds(s: float):
         pass
 
 
+EARTH_RADIUS_M = 6371000.0
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bearing_deg(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dl = math.radians(lon2 - lon1)
+    x = math.sin(dl) * math.cos(p2)
+    y = math.cos(p1) * math.sin(p2) - math.sin(p1) * math.cos(p2) * math.cos(dl)
+    return (math.degrees(math.atan2(x, y)) + 360.0) % 360.0
+
+
+def parse_latlon(text: str) -> Optional[Tuple[float, float]]:
+    """Parse a "lat,lon" string; returns None for anything else."""
+    try:
+        lat_s, lon_s = text.split(",")
+        lat, lon = float(lat_s), float(lon_s)
+    except (AttributeError, ValueError):
+        return None
+    if -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+        return lat, lon
+    return None
+
+
+def decode_polyline(encoded: str) -> List[Tuple[float, float]]:
+    """Decode a Google encoded polyline into (lat, lon) pairs."""
+    points: List[Tuple[float, float]] = []
+    index = lat = lon = 0
+    while index < len(encoded):
+        for is_lon in (False, True):
+            result = shift = 0
+            while True:
+                b = ord(encoded[index]) - 63
+                index += 1
+                result |= (b & 0x1F) << shift
+                shift += 5
+                if b < 0x20:
+                    break
+            delta = ~(result >> 1) if result & 1 else result >> 1
+            if is_lon:
+                lon += delta
+            else:
+                lat += delta
+        points.append((lat / 1e5, lon / 1e5))
+    return points
+
+
+@traced("location.ip_lookup")
 def get_approx_location() -> Dict[str, Any]:
     """Return approximate location via IP geolocation.
 
@@ -1,26 +1,180 @@
 from __future__ import annotations
 import threading
 import time
-from typing import Optional
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
 
-try:
-    from ultralytics import YOLO  # optional
-except Exception:
-    YOLO = None  # type: ignore
+import numpy as np
 
-import cv2
+from events import CAUTION, DANGER, DROP_OLDEST, HAZARD, OBSTACLE, EventBus, ObstacleCoalescer
+from inference import BackendConfig, InferenceBackend, create_backend, warm_up
+from startup import StartupTimer, lazy_import
+from tracing import count, span
+from tracker import ApproachAlerts, IoUTracker
+
+cv2 = lazy_import("cv2")
+
+ALERT_CLASSES = ("person", "bicycle", "car", "motorcycle", "bus", "truck")
+
+
+def detect_alert(backend: InferenceBackend, frame) -> Optional[str]:
+    """Run the detector on one frame and return an alert for the first hazard class found."""
+    for det in backend.detect(frame):
+        if det.name in ALERT_CLASSES:
+            return f"{det.name} ahead"
+    return None
+
+
+class MotionGate:
+    """Cheap change detector that decides whether a frame is worth a full inference.
+
+    Frames are reduced to small grayscale images and compared with the frame
+    the detector last saw. A pixel counts as changed when it differs by more
+    than ``k`` times the running sensor-noise level (the mean frame-to-frame
+    difference, tracked as an EMA), and inference runs when at least
+    ``min_changed_fraction`` of pixels changed or ``max_stale_sec`` has passed.
+    """
+
+    def __init__(
+        self,
+        size: Tuple[int, int] = (80, 60),
+        k: float = 4.0,
+        min_pixel_delta: float = 10.0,
+        min_changed_fraction: float = 0.01,
+        max_stale_sec: float = 1.0,
+        noise_alpha: float = 0.05,
+    ):
+        self.size = size
+        self.k = k
+        self.min_pixel_delta = min_pixel_delta
+        self.min_changed_fraction = min_changed_fraction
+        self.max_stale_sec = max_stale_sec
+        self.noise_alpha = noise_alpha
+        self._reference: Optional[np.ndarray] = None
+        self._previous: Optional[np.ndarray] = None
+        self._noise = 0.0
+        self._last_infer = 0.0
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def skip_ratio(self) -> float:
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def should_infer(self, frame, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        small = self._downscale(frame)
+        self.frames += 1
+        if self._previous is not None:
+            step = float(np.abs(small - self._previous).mean())
+            self._noise += self.noise_alpha * (step - self._noise)
+        self._previous = small
+        run = self._reference is None or now - self._last_infer >= self.max_stale_sec
+        if not run:
+            threshold = max(self.min_pixel_delta, self.k * self._noise)
+            changed = float((np.abs(small - self._reference) > threshold).mean())
+            run = changed >= self.min_changed_fraction
+        if run:
+            self._reference = small
+            self._last_infer = now
+        else:
+            self.skipped += 1
+        return run
+
+    def _downscale(self, frame) -> np.ndarray:
+        if frame.ndim == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+
+class LatestFrameBuffer:
+    """Single-slot frame buffer between the capture and inference threads.
+
+    ``put`` always overwrites, so a slow consumer only ever sees the freshest
+    frame; frames it never picked up are counted in ``dropped``.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._frame = None
+        self._captured_at = 0.0
+        self._seq = 0
+        self._taken_seq = 0
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, frame, captured_at: float):
+        with self._cond:
+            if self._seq > self._taken_seq:
+                self.dropped += 1
+            self._frame = frame
+            self._captured_at = captured_at
+            self._seq += 1
+            self._cond.notify_all()
+
+    def get(self, last_seq: int, timeout: Optional[float] = None) -> Optional[Tuple[int, object, float]]:
+        """Wait for a frame newer than ``last_seq``; returns (seq, frame, captured_at) or None."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > last_seq or self._closed, timeout=timeout):
+                return None
+            if self._seq <= last_seq:
+                return None
+            self._taken_seq = self._seq
+            return self._seq, self._frame, self._captured_at
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
 
 
 class VisionLoop:
-    def __init__(self, enabled: bool, voice_say, demo_mode: bool = True, obstacle_event: Optional[threading.Event] = None, on_obstacle: Optional[callable] = None):
+    def __init__(self, enabled: bool, voice_say, demo_mode: bool = True, obstacle_event: Optional[threading.Event] = None, on_obstacle: Optional[callable] = None, on_clear: Optional[Callable[[], None]] = None, clear_after_sec: float = 2.0, camera_index: int = 0, motion_gate: Optional[MotionGate] = None, backend_config: Optional[BackendConfig] = None, detect_every: int = 3, backend: Optional[InferenceBackend] = None, clock: Callable[[], float] = time.perf_counter, startup: Optional[StartupTimer] = None, voice_alert=None, bus: Optional[EventBus] = None, threaded_alerts: bool = False):
         self.enabled = enabled
         self.voice_say = voice_say
+        # Hazard alerts may go to a separate, higher-priority channel than status messages
+        self.voice_alert = voice_alert or voice_say
         self.demo_mode = demo_mode
+        self.camera_index = camera_index
         self._thread: Optional[threading.Thread] = None
+        self._capture_thread: Optional[threading.Thread] = None
         self._stop = threading.Event()
-        self._model = None
-        self._obstacle_event = obstacle_event
-        self._on_obstacle = on_obstacle
+        self._model: Optional[InferenceBackend] = backend
+        self._model_ready = threading.Event()
+        self._warm_thread: Optional[threading.Thread] = None
+        self.startup = startup or StartupTimer()
+        self.clock = clock
+        self.backend_config = backend_config or BackendConfig()
+        # Hazards go out on the bus; the coalescer turns them into obstacle set/clear
+        # transitions, and the path counts as clear once nothing was seen for clear_after_sec
+        self.bus = bus or EventBus()
+        self.coalescer = ObstacleCoalescer(self.bus, clear_after_sec)
+        # Speech is one subscriber among others; threaded, a slow TTS never holds up the camera
+        self.bus.subscribe(HAZARD, lambda e: self.voice_alert(e.message), name="speech", max_queue=2, policy=DROP_OLDEST, threaded=threaded_alerts)
+        if obstacle_event is not None:
+            self.bus.subscribe(OBSTACLE, lambda e: obstacle_event.set() if e.active else obstacle_event.clear(), name="obstacle_event", threaded=False)
+        if on_obstacle is not None:
+            self.bus.subscribe(OBSTACLE, lambda e: e.active and on_obstacle(e.message), name="on_obstacle", threaded=False)
+        if on_clear is not None:
+            self.bus.subscribe(OBSTACLE, lambda e: e.active or on_clear(), name="on_clear", threaded=False)
+        self._buffer = LatestFrameBuffer()
+        self.motion_gate = motion_gate if motion_gate is not None else MotionGate()
+        # Full detection runs every Nth frame; the tracker carries objects in between
+        self.detect_every = max(1, detect_every)
+        self.tracker = IoUTracker()
+        self.approach_alerts = ApproachAlerts(ALERT_CLASSES)
+        self.inferences = 0
+        # Seconds from frame capture to the decision on that frame, and to each alert
+        self.frame_latencies: Deque[float] = deque(maxlen=500)
+        self.alert_latencies: Deque[float] = deque(maxlen=500)
+        self.frames_captured = 0
+        self.frames_processed = 0
+        self._last_captured: Optional[float] = None
+        self._last_demo_alert = float("-inf")
+
+    @property
+    def obstacle_active(self) -> bool:
+        return self.coalescer.active
 
     def start(self):
         if not self.enabled:
@@ -28,69 +182,139 @@ class VisionLoop:
         if self._thread and self._thread.is_alive():
             return
         self._stop.clear()
+        self._buffer = LatestFrameBuffer()
         self._thread = threading.Thread(target=self._run, daemon=True)
         self._thread.start()
 
     def stop(self):
         self._stop.set()
+        self._buffer.close()
         if self._thread and self._thread.is_alive():
             self._thread.join(timeout=2)
 
+    def stats(self) -> Dict[str, float]:
+        return {
+            "frames_captured": self.frames_captured,
+            "frames_processed": self.frames_processed,
+            "frames_dropped": self._buffer.dropped,
+            "inferences": self.inferences,
+            "inference_skip_ratio": round(self.motion_gate.skip_ratio, 3),
+            "frame_latency_p50_ms": _percentile_ms(self.frame_latencies, 0.5),
+            "frame_latency_p95_ms": _percentile_ms(self.frame_latencies, 0.95),
+            "alert_latency_p50_ms": _percentile_ms(self.alert_latencies, 0.5),
+            "alert_latency_p95_ms": _percentile_ms(self.alert_latencies, 0.95),
+        }
+
+    def warm_up(self):
+        """Load the detector and run a dummy inference in the background, ahead of the camera."""
+        if self.demo_mode or self._warm_thread is not None:
+            return
+        self._warm_thread = threading.Thread(target=self._load_model, name="vision-warm-up", daemon=True)
+        self._warm_thread.start()
+
     def _load_model(self):
-        if YOLO and not self.demo_mode:
-            try:
-                self._model = YOLO("yolov8n.pt")  # small CPU-friendly model
-            except Exception:
-                self._model = None
+        try:
+            if self._model is None:
+                with self.startup.phase("vision_model_load"):
+                    model = create_backend(self.backend_config)
+                with self.startup.phase("vision_warm_up"):
+                    warm_up(model)
+                self._model = model
+        except Exception:
+            self._model = None
+        finally:
+            self._model_ready.set()
+
+    def _capture(self, cap):
+        # Read as fast as the camera delivers so its internal queue never backs up
+        while not self._stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                time.sleep(0.05)
+                continue
+            if not self.frames_captured:
+                self.startup.mark("first_frame")
+            self.frames_captured += 1
+            self._buffer.put(frame, self.clock())
+
+    def handle_frame(self, frame, captured_at: float, seq: int) -> Optional[str]:
+        """Run one frame through gate, detector, tracker and alert policy; publishes and returns any alert.
+
+        ``captured_at`` is on ``self.clock``, which replays point at video time.
+        """
+        with span("vision.frame"):
+            alert_msg = self._decide(frame, captured_at, seq)
+        now = self.clock()
+        self.frames_processed += 1
+        self.frame_latencies.append(now - captured_at)
+        if alert_msg or (self._model is not None and self.approach_alerts.active(self.tracker.tracks)):
+            self.coalescer.keep_alive(captured_at)
+        if alert_msg:
+            self.alert_latencies.append(now - captured_at)
+            count("vision_alerts")
+            self.coalescer.hazard(alert_msg, CAUTION if self._model is None else DANGER, captured_at)
+        else:
+            self.coalescer.tick(captured_at)
+        return alert_msg
+
+    def _decide(self, frame, captured_at: float, seq: int) -> Optional[str]:
+        if self._model is None:
+            # Demo heuristic: simple motion alert every few seconds
+            if captured_at - self._last_demo_alert > 6:
+                self._last_demo_alert = captured_at
+                return "Stay alert. Checking surroundings."
+            return None
+        dt = captured_at - self._last_captured if self._last_captured is not None else 0.0
+        self._last_captured = captured_at
+        # Detect on every Nth frame unless the scene is static; track in between
+        due = (seq - 1) % self.detect_every == 0
+        if due and self.motion_gate.should_infer(frame, now=captured_at):
+            with span("vision.inference"):
+                detections = self._model.detect(frame)
+            self.tracker.update(detections, dt)
+            if not self.inferences:
+                self.startup.mark("first_detection")
+            self.inferences += 1
+        else:
+            self.tracker.predict(dt)
+        return self.approach_alerts.check(self.tracker.tracks)
 
     def _run(self):
+        # Model loading overlaps with the announcement and opening the camera
+        self.warm_up()
         # announce start
         self.voice_say("Starting vision safety. Camera on.")
-        self._load_model()
-        cap = cv2.VideoCapture(0)
+        with self.startup.phase("camera_open"):
+            cap = cv2.VideoCapture(self.camera_index)
         if not cap.isOpened():
             self.voice_say("Warning. Could not access camera.")
             return
-        last_alert = 0.0
+        try:
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        except Exception:
+            pass
+        self._capture_thread = threading.Thread(target=self._capture, args=(cap,), daemon=True)
+        self._capture_thread.start()
+        if not self.demo_mode:
+            self._model_ready.wait()
+        last_seq = 0
         try:
             while not self._stop.is_set():
-                ret, frame = cap.read()
-                if not ret:
-                    time.sleep(0.1)
+                item = self._buffer.get(last_seq, timeout=0.5)
+                if item is None:
                     continue
-                alert_msg = None
-                if self._model is not None:
-                    # Real detection
-                    results = self._model(frame, verbose=False)
-                    names = self._model.names if hasattr(self._model, "names") else {}
-                    for r in results:
-                        if getattr(r, "boxes", None) is not None:
-                            for b in r.boxes:
-                                cls = int(b.cls[0]) if hasattr(b, "cls") else None
-                                name = names.get(cls, "object") if isinstance(names, dict) else "object"
-                                if name in ("person", "bicycle", "car", "motorbike", "bus", "truck"):
-                                    alert_msg = f"{name} ahead"
-                                    break
-                        if alert_msg:
-                            break
-                else:
-                    # Demo heuristic: simple motion alert every few seconds
-                    now = time.time()
-                    if now - last_alert > 6:
-                        alert_msg = "Stay alert. Checking surroundings."
-                        last_alert = now
-                if alert_msg:
-                    self.voice_say(alert_msg)
-                    # Signal obstacle to main loop
-                    if self._obstacle_event:
-                        self._obstacle_event.set()
-                    if self._on_obstacle:
-                        try:
-                            self._on_obstacle(alert_msg)
-                        except Exception:
-                            pass
-                # Keep frame rate modest
-                time.sleep(0.2)
+                last_seq, frame, captured_at = item
+                self.handle_frame(frame, captured_at, last_seq)
         finally:
+            self._stop.set()
+            if self._capture_thread is not None:
+                self._capture_thread.join(timeout=1)
             cap.release()
             self.voice_say("Vision safety stopped.")
+
+
+def _percentile_ms(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0, 1)
@@ -0,0 +1,390 @@
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+
+from inference import BackendConfig, Detection, InferenceBackend, create_backend, parse_roi
+from tracker import iou
+from vision import MotionGate, VisionLoop, detect_alert
+
+try:
+    import resource  # not available on Windows
+except Exception:
+    resource = None  # type: ignore
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp")
+
+DetectFn = Callable[[object], Optional[str]]
+
+
+def iter_frames(source: str, fps: float = 10.0) -> Iterator[Tuple[int, float, object]]:
+    """Yield (index, timestamp_sec, frame) from a video file or a directory of images.
+
+    Image directories are read in name order at ``fps``; videos use their own clock.
+    """
+    if os.path.isdir(source):
+        files = sorted(f for f in os.listdir(source) if f.lower().endswith(IMAGE_EXTS))
+        for i, name in enumerate(files):
+            frame = cv2.imread(os.path.join(source, name))
+            if frame is not None:
+                yield i, i / fps, frame
+        return
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise IOError(f"cannot open {source}")
+    video_fps = cap.get(cv2.CAP_PROP_FPS) or fps
+    i = 0
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            yield i, i / video_fps, frame
+            i += 1
+    finally:
+        cap.release()
+
+
+def alert_episodes(alerts: List[Tuple[float, Optional[str]]]) -> List[Tuple[float, float, str]]:
+    """Collapse per-frame alerts into (start, end, message) runs of the same message."""
+    episodes: List[Tuple[float, float, str]] = []
+    prev_ts = None
+    for ts, msg in alerts:
+        if msg and episodes and episodes[-1][2] == msg and episodes[-1][1] == prev_ts:
+            episodes[-1] = (episodes[-1][0], ts, msg)
+        elif msg:
+            episodes.append((ts, ts, msg))
+        prev_ts = ts
+    return episodes
+
+
+def compare_gate(source: str, detect: DetectFn, gate: Optional[MotionGate] = None, tolerance_sec: Optional[float] = None) -> Dict[str, object]:
+    """Replay ``source`` with and without the motion gate and report any alert the gate missed.
+
+    An ungated alert episode counts as caught when the gated run raises the same
+    alert within ``tolerance_sec`` (default: the gate's max staleness) of its start.
+    """
+    gate = gate or MotionGate()
+    tolerance = gate.max_stale_sec if tolerance_sec is None else tolerance_sec
+    baseline: List[Tuple[float, Optional[str]]] = []
+    gated: List[Tuple[float, str]] = []
+    for _, ts, frame in iter_frames(source):
+        msg = detect(frame)
+        baseline.append((ts, msg))
+        # The detector is deterministic, so a gated inference on this frame gives the same answer
+        if gate.should_infer(frame, now=ts) and msg:
+            gated.append((ts, msg))
+    missed = []
+    for start, end, msg in alert_episodes(baseline):
+        window_end = min(end, start + tolerance)
+        if not any(msg == m and start <= ts <= window_end for ts, m in gated):
+            missed.append({"start_sec": round(start, 3), "end_sec": round(end, 3), "alert": msg})
+    return {
+        "frames": gate.frames,
+        "skipped": gate.skipped,
+        "skip_ratio": round(gate.skip_ratio, 3),
+        "episodes": len(alert_episodes(baseline)),
+        "missed": missed,
+    }
+
+
+def match_count(found: List[Detection], reference: List[Detection], min_iou: float = 0.5) -> int:
+    """Greedy same-class matches between two detection lists."""
+    used = set()
+    matched = 0
+    for d in sorted(found, key=lambda d: -d.confidence):
+        best, best_iou = None, min_iou
+        for j, r in enumerate(reference):
+            if j in used or r.name != d.name:
+                continue
+            v = iou(d.box, r.box)
+            if v >= best_iou:
+                best, best_iou = j, v
+        if best is not None:
+            used.add(best)
+            matched += 1
+    return matched
+
+
+def compare_backends(source: str, configs: List[BackendConfig], max_frames: int = 300, warmup: int = 3) -> List[Dict[str, object]]:
+    """Run each backend over the same clip; report FPS and agreement with the first backend."""
+    frames = [f for i, _, f in iter_frames(source) if i < max_frames]
+    runs = []
+    for config in configs:
+        backend = create_backend(config)
+        for f in frames[:warmup]:
+            backend.detect(f)
+        dets: List[List[Detection]] = []
+        timings: List[float] = []
+        for f in frames:
+            start = time.perf_counter()
+            dets.append(backend.detect(f))
+            timings.append(time.perf_counter() - start)
+        runs.append((config, dets, timings))
+
+    reference = runs[0][1]
+    report = []
+    for config, dets, timings in runs:
+        matched = sum(match_count(d, r) for d, r in zip(dets, reference))
+        found = sum(len(d) for d in dets)
+        expected = sum(len(r) for r in reference)
+        precision = matched / found if found else 1.0
+        recall = matched / expected if expected else 1.0
+        ordered = sorted(timings)
+        report.append({
+            "backend": config.kind,
+            "model": config.model_path,
+            "input_size": config.input_size,
+            "roi": config.roi,
+            "frames": len(frames),
+            "fps": round(len(timings) / sum(timings), 2) if timings and sum(timings) else 0.0,
+            "mean_ms": round(1000 * sum(timings) / len(timings), 2) if timings else 0.0,
+            "p95_ms": round(1000 * ordered[int(0.95 * (len(ordered) - 1))], 2) if ordered else 0.0,
+            "agreement_f1": round(2 * precision * recall / (precision + recall), 3) if precision + recall else 0.0,
+        })
+    return report
+
+
+def parse_backend_spec(spec: str) -> BackendConfig:
+    """Parse "kind:model[:input_size[:roi]]", e.g. "onnx:yolov8n.onnx:320:path"."""
+    parts = spec.split(":")
+    config = BackendConfig(kind=parts[0], model_path=parts[1])
+    if len(parts) > 2 and parts[2]:
+        config.input_size = int(parts[2])
+    if len(parts) > 3:
+        config.roi = parse_roi(parts[3])
+    return config
+
+
+def load_ground_truth(path: str) -> List[Dict[str, object]]:
+    """Read annotated hazard events: a JSON list of {"start_sec", "end_sec"?, "label"?}.
+
+    An event without ``end_sec`` is taken to last 2 seconds; ``label`` (e.g. "car")
+    must appear in the alert text for it to count.
+    """
+    with open(path, "r", encoding="utf-8") as fh:
+        events = json.load(fh)
+    out = []
+    for e in events:
+        start = float(e["start_sec"])
+        out.append({"start_sec": start, "end_sec": float(e.get("end_sec", start + 2.0)), "label": e.get("label")})
+    return sorted(out, key=lambda e: e["start_sec"])
+
+
+def score_alerts(alerts: List[Tuple[float, str]], events: List[Dict[str, object]], grace_sec: float = 1.0) -> Dict[str, object]:
+    """Match (spoken_at, message) alerts to ground-truth events.
+
+    An event is caught by the first matching alert spoken between its start and
+    ``grace_sec`` after its end; the delay from the event start is its latency.
+    Alerts that match no event are counted as false alerts.
+    """
+    used = set()
+    latencies: List[float] = []
+    missed = []
+    for e in events:
+        hit = None
+        for i, (at, msg) in enumerate(alerts):
+            if i in used or at < e["start_sec"] or at > e["end_sec"] + grace_sec:
+                continue
+            if e["label"] and str(e["label"]).lower() not in msg.lower():
+                continue
+            hit = i
+            break
+        if hit is None:
+            missed.append(e)
+            continue
+        used.add(hit)
+        latencies.append(alerts[hit][0] - e["start_sec"])
+    for i, (at, msg) in enumerate(alerts):
+        # Repeat alerts inside an already-caught event are not false positives
+        if i not in used and any(e["start_sec"] <= at <= e["end_sec"] + grace_sec for e in events):
+            used.add(i)
+    return {
+        "events": len(events),
+        "caught": len(latencies),
+        "missed": missed,
+        "false_alerts": len(alerts) - len(used),
+        "latency_p50_ms": _percentile_ms(latencies, 0.5),
+        "latency_p95_ms": _percentile_ms(latencies, 0.95),
+        "latency_max_ms": round(1000 * max(latencies), 1) if latencies else 0.0,
+    }
+
+
+def bench_pipeline(
+    source: str,
+    backend: InferenceBackend,
+    detect_every: int = 3,
+    gate: Optional[MotionGate] = None,
+    ground_truth: Optional[List[Dict[str, object]]] = None,
+    drop_frames: bool = True,
+    fps: float = 10.0,
+) -> Dict[str, object]:
+    """Run the full VisionLoop pipeline headless over a clip and report where the time goes.
+
+    Frames arrive on the clip's own clock. With ``drop_frames`` a frame that
+    arrives while the previous one is still being processed waits in a
+    single slot and is overwritten by newer ones, as with the live camera, so
+    FPS and alert latency reflect what a user would get on this machine.
+    """
+    spoken: List[Tuple[float, str]] = []
+    offset = [0.0]
+
+    def clock() -> float:
+        return time.perf_counter() + offset[0]
+
+    loop = VisionLoop(
+        enabled=True,
+        voice_say=lambda msg: spoken.append((clock(), msg)),
+        demo_mode=False,
+        motion_gate=gate,
+        detect_every=detect_every,
+        backend=backend,
+        clock=clock,
+    )
+    stages: Dict[str, List[float]] = {k: [] for k in ("decode", "preprocess", "inference", "postprocess", "tracking")}
+    busy_until = 0.0
+    dropped = 0
+    processed = 0
+    work_sec = 0.0
+
+    def process(seq: int, ts: float, frame, start: float):
+        nonlocal busy_until, processed, work_sec
+        before = loop.inferences
+        t0 = time.perf_counter()
+        offset[0] = start - t0
+        loop.handle_frame(frame, ts, seq)
+        elapsed = time.perf_counter() - t0
+        detector = 0.0
+        if loop.inferences > before:
+            for name, sec in backend.last_timings.items():
+                stages[name].append(sec)
+                detector += sec
+        stages["tracking"].append(elapsed - detector)
+        busy_until = start + elapsed
+        processed += 1
+        work_sec += elapsed
+
+    tracemalloc.start()
+    wall_start = time.perf_counter()
+    pending = None
+    frames = iter_frames(source, fps=fps)
+    while True:
+        t0 = time.perf_counter()
+        item = next(frames, None)
+        if item is None:
+            break
+        stages["decode"].append(time.perf_counter() - t0)
+        idx, ts, frame = item
+        if drop_frames and pending is not None and ts >= busy_until:
+            # Consumer freed up before this frame arrived and took the waiting one
+            process(pending[0], pending[1], pending[2], busy_until)
+            pending = None
+        if drop_frames and ts < busy_until:
+            if pending is not None:
+                dropped += 1
+            pending = (idx + 1, ts, frame)
+            continue
+        process(idx + 1, ts, frame, ts)
+    if pending is not None:
+        process(pending[0], pending[1], pending[2], busy_until)
+    wall_sec = time.perf_counter() - wall_start
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report: Dict[str, object] = {
+        "source": source,
+        "backend": getattr(backend, "name", type(backend).__name__),
+        "detect_every": loop.detect_every,
+        "frames": len(stages["decode"]),
+        "frames_processed": processed,
+        "frames_dropped": dropped,
+        "inferences": loop.inferences,
+        "gate_skip_ratio": round(loop.motion_gate.skip_ratio, 3),
+        "pipeline_fps": round(processed / work_sec, 2) if work_sec else 0.0,
+        "wall_sec": round(wall_sec, 3),
+        "stages_ms": {name: _stage_summary(values) for name, values in stages.items()},
+        "frame_latency_p50_ms": _percentile_ms(loop.frame_latencies, 0.5),
+        "frame_latency_p95_ms": _percentile_ms(loop.frame_latencies, 0.95),
+        "memory": {
+            "traced_peak_mb": round(peak_traced / 1e6, 2),
+            # ru_maxrss is KiB on Linux and bytes on macOS
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1e6 if sys.platform == "darwin" else 1024.0), 1) if resource else None,
+        },
+        "alerts": [{"at_sec": round(at, 3), "alert": msg} for at, msg in spoken],
+    }
+    if ground_truth is not None:
+        report["ground_truth"] = score_alerts(spoken, ground_truth)
+    return report
+
+
+def _stage_summary(values: List[float]) -> Dict[str, float]:
+    return {
+        "count": len(values),
+        "mean": round(1000 * sum(values) / len(values), 3) if values else 0.0,
+        "p50": _percentile_ms(values, 0.5),
+        "p95": _percentile_ms(values, 0.95),
+    }
+
+
+def _percentile_ms(values, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000.0, 3)
+
+
+def _load_detector() -> DetectFn:
+    backend = create_backend(BackendConfig())
+    return lambda frame: detect_alert(backend, frame)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded frames through the vision pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gate = sub.add_parser("gate", help="check the motion gate misses no alerts")
+    p_gate.add_argument("source")
+    p_back = sub.add_parser("backends", help="compare inference backends on one clip")
+    p_back.add_argument("source")
+    p_back.add_argument("specs", nargs="+", help="kind:model[:size[:roi]]")
+    p_bench = sub.add_parser("bench", help="benchmark the full pipeline headless")
+    p_bench.add_argument("source")
+    p_bench.add_argument("--backend", default="", help="kind:model[:size[:roi]] (default: ultralytics yolov8n)")
+    p_bench.add_argument("--ground-truth", default="", help="JSON list of {start_sec, end_sec, label}")
+    p_bench.add_argument("--detect-every", type=int, default=3)
+    p_bench.add_argument("--no-gate", action="store_true", help="run the detector on every due frame")
+    p_bench.add_argument("--no-drop", action="store_true", help="process every frame instead of pacing to the clip")
+    p_bench.add_argument("--out", default="", help="write the JSON report here as well")
+    args = parser.parse_args(argv)
+
+    if args.command == "gate":
+        report = compare_gate(args.source, _load_detector())
+        print(json.dumps(report, indent=2))
+        return 1 if report["missed"] else 0
+    if args.command == "backends":
+        print(json.dumps(compare_backends(args.source, [parse_backend_spec(s) for s in args.specs]), indent=2))
+        return 0
+    config = parse_backend_spec(args.backend) if args.backend else BackendConfig()
+    report = bench_pipeline(
+        args.source,
+        create_backend(config),
+        detect_every=args.detect_every,
+        gate=MotionGate(max_stale_sec=0.0) if args.no_gate else None,
+        ground_truth=load_ground_truth(args.ground_truth) if args.ground_truth else None,
+        drop_frames=not args.no_drop,
+    )
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,27 +1,26 @@
 from __future__ import annotations
 import sys
 import threading
-from typing import Optional
+from concurrent.futures import Future
+from typing import Iterator, List, Optional
 
-import pyttsx3
+from phrase_cache import PcmPlayer, PhraseCache
+from speech import MicrophoneSource, StreamingRecognizer, Transcript
+from startup import StartupTimer, lazy_import
+from tracing import count, span
+from tts_queue import ALERT, PROMPT, SpeechQueue
 
-try:
-    import speech_recognition as sr  # optional
-except Exception:
-    sr = None  # type: ignore
-
-try:
-    from vosk import Model, KaldiRecognizer  # optional
-    import json
-except Exception:
-    Model = None  # type: ignore
-    KaldiRecognizer = None  # type: ignore
-    json = None  # type: ignore
+# Heavy, partly optional; imported on first use
+pyttsx3 = lazy_import("pyttsx3")
+sr = lazy_import("speech_recognition")
+vosk = lazy_import("vosk")
 
 
 class VoiceIO:
-    def __init__(self, stt_engine: str = "", vosk_model_path: str = ""):
-        self.tts = pyttsx3.init()
+    def __init__(self, stt_engine: str = "", vosk_model_path: str = "", startup: Optional[StartupTimer] = None, audio_source=None, phrase_cache_dir: str = "", phrase_cache_mb: int = 64):
+        self.startup = startup or StartupTimer()
+        with self.startup.phase("tts_init"):
+            self.tts = pyttsx3.init()
         # Tune for clarity and speed
         self.tts.setProperty("rate", 185)
         self.tts.setProperty("volume", 1.0)
@@ -29,36 +28,160 @@ class VoiceIO:
         self._stt_engine = stt_engine
         self._vosk_model_path = vosk_model_path
         self._vosk_model = None
-        if self._stt_engine == "vosk" and Model and vosk_model_path:
+        # One microphone stream and recognizer for the whole session; a WavSource can stand in for the mic
+        self._audio_source = audio_source
+        self._stream: Optional[StreamingRecognizer] = None
+        self._stt_ready = threading.Event()
+        self._warm_thread: Optional[threading.Thread] = None
+
+        # All speech goes through one worker so callers never block on audio unless they ask to
+        self._interrupt_requested = threading.Event()
+        try:
+            self.tts.connect("started-word", self._on_word)
+        except Exception:
+            pass
+        # Repeated phrases play from pre-rendered audio; rendering happens while the speech worker is idle
+        self.phrases: Optional[PhraseCache] = None
+        self.player = PcmPlayer()
+        if phrase_cache_dir and self.player.available:
             try:
-                self._vosk_model = Model(vosk_model_path)
+                voice_id = f"{self.tts.getProperty('voice')}|{self.tts.getProperty('rate')}"
             except Exception:
-                self._vosk_model = None
+                voice_id = ""
+            self.phrases = PhraseCache(self._render_to_file, phrase_cache_dir, voice_id=voice_id, max_disk_bytes=phrase_cache_mb * 1024 * 1024)
+        self.speech = SpeechQueue(
+            self._speak,
+            interrupt=self._interrupt_requested.set,
+            on_idle=self.phrases.render_next if self.phrases else None,
+            reset_interrupt=self._interrupt_requested.clear,
+        )
 
-        self._tts_lock = threading.Lock()
+    def warm_up(self):
+        """Load and exercise the speech recognizer in the background; ``ask`` waits for it."""
+        if self._warm_thread is None:
+            self._warm_thread = threading.Thread(target=self._load_stt, name="stt-warm-up", daemon=True)
+            self._warm_thread.start()
 
-    def say(self, text: str, wait: bool = True):
-        with self._tts_lock:
-            self.tts.say(text)
-            self.tts.runAndWait()
-        if not wait:
-            pass
+    def _load_stt(self):
+        try:
+            if self._stt_engine == "vosk" and self._vosk_model_path and vosk.available:
+                with self.startup.phase("vosk_model_load"):
+                    model = vosk.Model(self._vosk_model_path)
+                with self.startup.phase("vosk_warm_up"):
+                    # A short silent buffer pages in the acoustic model before the first real utterance
+                    rec = vosk.KaldiRecognizer(model, 16000)
+                    rec.AcceptWaveform(b"\x00\x00" * 1600)
+                    rec.FinalResult()
+                with self.startup.phase("microphone_open"):
+                    source = self._audio_source or MicrophoneSource()
+                self._vosk_model = model
+                self._stream = StreamingRecognizer(model, source)
+            elif self._stt_engine == "sr" and sr.available:
+                with self.startup.phase("speech_recognition_import"):
+                    sr.load()
+        except Exception:
+            self._vosk_model = None
+            self._stream = None
+        finally:
+            self._stt_ready.set()
+
+    def _vosk_ready(self) -> bool:
+        self.warm_up()
+        self._stt_ready.wait()
+        return self._stream is not None
+
+    def say(self, text: str, wait: bool = True, priority: int = PROMPT, key: Optional[str] = None, max_age_sec: Optional[float] = None) -> Future:
+        """Queue ``text`` for speech; with ``wait`` block until it has been spoken (or dropped).
+
+        ``key`` marks messages that supersede each other, e.g. ETA updates, so only
+        the newest pending one is spoken.
+        """
+        future = self.speech.submit(text, priority=priority, key=key, max_age_sec=max_age_sec)
+        if wait:
+            future.result()
+        return future
+
+    def alert(self, text: str) -> Future:
+        """Speak a safety alert ahead of anything queued, cutting off routine speech."""
+        return self.say(text, wait=False, priority=ALERT)
+
+    def cancel(self, key: str) -> bool:
+        """Withdraw a queued message, e.g. an ETA update that no longer applies."""
+        return self.speech.cancel(key)
+
+    def prerender(self, phrases):
+        """Queue phrases for rendering into the phrase cache in the background."""
+        if self.phrases is not None:
+            self.phrases.want(phrases)
+
+    def _speak(self, text: str) -> bool:
+        stream = self._stream
+        # Keep the assistant's own voice out of the recognizer
+        if stream is not None:
+            stream.mute()
+        try:
+            clip = self.phrases.lookup(text) if self.phrases is not None else None
+            if clip is not None:
+                count("tts_utterances", source="cache")
+                with span("tts.play_cached"):
+                    return self.player.play(clip, interrupted=self._interrupt_requested)
+            count("tts_utterances", source="live")
+            with span("tts.synthesize"):
+                self.tts.say(text)
+                self.tts.runAndWait()
+        finally:
+            if stream is not None:
+                stream.unmute()
+        return not self._interrupt_requested.is_set()
 
-    def ask(self, prompt: str, timeout: Optional[int] = None) -> str:
+    def _render_to_file(self, text: str, path: str):
+        self.tts.save_to_file(text, path)
+        self.tts.runAndWait()
+
+    def _on_word(self, name, location, length):
+        # pyttsx3 only honours stop() from inside its own callbacks
+        if self._interrupt_requested.is_set():
+            self.tts.stop()
+
+    def listen_partials(self, timeout: Optional[float] = None) -> Iterator[Transcript]:
+        """Stream one utterance: partial transcripts as they change, then the final one."""
+        if self._stt_engine == "vosk" and self._vosk_ready():
+            yield from self._stream.listen(timeout)
+        else:
+            yield Transcript("", True)
+
+    def close(self):
+        self.speech.close()
+        if self._stream is not None:
+            self._stream.close()
+
+    def ask(self, prompt: str, timeout: Optional[int] = None, grammar: Optional[List[str]] = None) -> str:
+        return self.ask_transcript(prompt, timeout=timeout, grammar=grammar).text
+
+    def ask_transcript(self, prompt: str, timeout: Optional[int] = None, grammar: Optional[List[str]] = None) -> Transcript:
+        """Speak ``prompt`` and return what was heard with its confidence.
+
+        ``grammar`` restricts Vosk to the listed phrases; other engines ignore it.
+        """
         # Speak prompt, then attempt STT, else fallback to keyboard input
         self.say(prompt)
-        if self._stt_engine == "vosk" and self._vosk_model and KaldiRecognizer:
-            return self._listen_vosk(timeout=timeout)
-        elif self._stt_engine == "sr" and sr:
-            return self._listen_sr(timeout=timeout)
+        with span("stt.listen", engine=self._stt_engine or "keyboard"):
+            return self._listen(timeout, grammar)
+
+    def _listen(self, timeout: Optional[int], grammar: Optional[List[str]]) -> Transcript:
+        if self._stt_engine == "vosk" and self._vosk_ready():
+            return self._stream.recognize(timeout=timeout or 8, grammar=grammar)
+        elif self._stt_engine == "sr" and sr.available:
+            text = self._listen_sr(timeout=timeout)
+            return Transcript(text, True, 1.0 if text else 0.0)
         else:
             # Keyboard fallback for demo
             sys.stdout.write("\nType your response and press Enter: ")
             sys.stdout.flush()
-            return input().strip()
+            return Transcript(input().strip(), True)
 
     def _listen_sr(self, timeout: Optional[int] = None) -> str:
-        if not sr:
+        if not sr.available:
             return ""
         r = sr.Recognizer()
         with sr.Microphone() as source:
@@ -68,34 +191,3 @@ class VoiceIO:
                 return text
             except Exception:
                 return ""
-
-    def _listen_vosk(self, timeout: Optional[int] = None) -> str:
-        if not (Model and KaldiRecognizer and self._vosk_model):
-            return ""
-        import pyaudio  # provided by SpeechRecognition dependency stack
-        pa = pyaudio.PyAudio()
-        stream = pa.open(format=pyaudio.paInt16, channels=1, rate=16000, input=True, frames_per_buffer=8000)
-        stream.start_stream()
-        rec = KaldiRecognizer(self._vosk_model, 16000)
-        try:
-            # Listen for a few seconds
-            for _ in range(0, 16000 // 800):
-                data = stream.read(4000, exception_on_overflow=False)
-                if rec.AcceptWaveform(data):
-                    res = rec.Result()
-                    try:
-                        obj = json.loads(res)
-                        return obj.get("text", "").strip()
-                    except Exception:
-                        return ""
-            # final partial
-            final = rec.FinalResult()
-            try:
-                obj = json.loads(final)
-                return obj.get("text", "").strip()
-            except Exception:
-                return ""
-        finally:
-            stream.stop_stream()
-            stream.close()
-            pa.terminate()